@@ -0,0 +1,692 @@
+#!/usr/bin/env python3
+
+# Benchmarks for the recognition pipeline
+# usage: benchmark.py startup [--backend BACKEND] [--repeat N]
+#        benchmark.py sequences [--peaks N ...]
+#        benchmark.py corners [--size WxH ...]
+#        benchmark.py multiscale [--sides N ...] [--boards N] [images ...]
+#        benchmark.py decode [--sides N ...] [--backend BACKEND] [images ...]
+#        benchmark.py dedup [--tile-sizes N ...] [--backend BACKEND] [images ...]
+#        benchmark.py stages [--sides N ...] [--batch-sizes N ...] [--baseline FILE]
+#                            [--save-baseline] [images ...]
+#        benchmark.py pool [--workers N ...] [--boards N] [--backend BACKEND] [images ...]
+
+import os
+import sys
+import json
+import argparse
+import subprocess
+import tracemalloc
+from timeit import default_timer as timer
+
+import numpy as np
+
+from constants import NN_BACKEND
+
+# Where benchmark.py stages keeps the timings it compares against
+BASELINE_FILE = 'benchmark_baseline.json'
+
+# A stage regresses when its median time or peak allocation grows by more
+# than this fraction of the baseline, plus a little slack for tiny stages
+MAX_REGRESSION = 0.3
+MIN_REGRESSION_MS = 1.0
+MIN_REGRESSION_KB = 64
+
+# Runs in a fresh interpreter, so nothing is imported or loaded yet.
+# Imports the same modules as the bot's recognition path
+_STARTUP_SCRIPT = """
+import json, resource, sys, time
+
+def max_rss_kb():
+    # ru_maxrss survives exec, so it would include the parent process
+    try:
+        with open('/proc/self/status') as f:
+            for line in f:
+                if line.startswith('VmHWM:'):
+                    return int(line.split()[1])
+    except OSError:
+        pass
+    return resource.getrusage(resource.RUSAGE_SELF).ru_maxrss
+
+t0 = time.perf_counter()
+import recognize
+import inference_service
+import worker_pool
+recognize.backend = sys.argv[1]
+import_s = time.perf_counter() - t0
+timings = recognize.warm_up()
+print(json.dumps(dict(
+    timings,
+    import_s=import_s,
+    tensorflow_imported='tensorflow' in sys.modules,
+    max_rss_mb=max_rss_kb() / 1024,
+)))
+"""
+
+def measure_startup(backend):
+    """ Returns a dict of import time, model load time, time to first
+        prediction and peak memory of a fresh process using backend
+    """
+    output = subprocess.run(
+        [sys.executable, '-c', _STARTUP_SCRIPT, backend],
+        check=True, capture_output=True, text=True,
+        cwd=os.path.dirname(os.path.abspath(__file__)),
+        env=dict(os.environ, TF_CPP_MIN_LOG_LEVEL='3'),
+    ).stdout
+    result = json.loads(output.strip().splitlines()[-1])
+    result['total_s'] = result['import_s'] + result['load_s'] + result['first_prediction_s']
+    return result
+
+def benchmark_startup(backends, n_repeats=1):
+    """ Prints the median startup timings of each backend over n_repeats
+        fresh processes. Returns {backend: median total seconds}
+    """
+    print('{:<16} {:>9} {:>9} {:>12} {:>9} {:>10} {:>4}'.format(
+        'backend', 'import s', 'load s', 'first pred s', 'total s', 'max RSS MB', 'TF'
+    ))
+    totals = {}
+    for backend in backends:
+        runs = [measure_startup(backend) for _ in range(n_repeats)]
+        median = {
+            key: np.median([r[key] for r in runs])
+            for key in ['import_s', 'load_s', 'first_prediction_s', 'total_s', 'max_rss_mb']
+        }
+        print('{:<16} {:>9.2f} {:>9.2f} {:>12.3f} {:>9.2f} {:>10.0f} {:>4}'.format(
+            backend, median['import_s'], median['load_s'],
+            median['first_prediction_s'], median['total_s'], median['max_rss_mb'],
+            'yes' if runs[0]['tensorflow_imported'] else 'no',
+        ))
+        totals[backend] = median['total_s']
+    return totals
+
+def _time(fn, *args, n_repeats=5):
+    """ Median seconds per call of fn(*args) """
+    times = []
+    for _ in range(n_repeats):
+        t = timer()
+        fn(*args)
+        times.append(timer() - t)
+    return np.median(times)
+
+def benchmark_sequences(peak_counts, image_size=1280):
+    """ Prints the time chessboard_finder takes to find line sequences among
+        growing numbers of Hough peaks: a real 9-line grid plus random noise
+    """
+    from chessboard_finder import _get_all_sequences
+    np.random.seed(1)
+    print('{:>6} {:>10} {:>10}'.format('peaks', 'sequences', 'ms'))
+    for n_peaks in peak_counts:
+        step = image_size // 10
+        grid = step + step * np.arange(9) + np.random.randint(-2, 3, 9)
+        noise = np.random.randint(0, image_size, max(0, n_peaks - len(grid)))
+        peaks = np.unique(np.concatenate([grid, noise]))
+        seqs = _get_all_sequences(peaks)
+        print('{:>6} {:>10} {:>10.2f}'.format(
+            len(peaks), len(seqs), _time(_get_all_sequences, peaks) * 1000
+        ))
+
+def _synthetic_photo(width, height):
+    """ Grayscale uint8 image of a chessboard on a noisy background """
+    np.random.seed(1)
+    img = np.random.randint(0, 40, (height, width)).astype(np.uint8)
+    side = min(width, height) * 2 // 3
+    squares = (np.indices((8, 8)).sum(axis=0) % 2 * 200 + 40).astype(np.uint8)
+    board = np.kron(squares, np.ones((side // 8, side // 8), dtype=np.uint8))
+    top, left = (height - board.shape[0]) // 2, (width - board.shape[1]) // 2
+    img[top:top+board.shape[0], left:left+board.shape[1]] = board
+    return img
+
+def _peak_mb(fn, *args):
+    """ Peak MB of memory allocated while calling fn(*args) """
+    tracemalloc.start()
+    fn(*args)
+    peak = tracemalloc.get_traced_memory()[1]
+    tracemalloc.stop()
+    return peak / 1024 / 1024
+
+def benchmark_corners(sizes):
+    """ Prints time and peak memory of the gradient projection and peak
+        suppression steps of chessboard_finder, and the time of the whole
+        corner detection, for each (width, height)
+    """
+    from chessboard_finder import (
+        _hough_projections, _nonmax_suppress_1d, detect_chessboard_corners
+    )
+
+    def projection_peaks(img):
+        hough_gx, hough_gy = _hough_projections(img)
+        return _nonmax_suppress_1d(hough_gx), _nonmax_suppress_1d(hough_gy)
+
+    print('{:>12} {:>8} {:>14} {:>10} {:>14} {:>10}'.format(
+        'size', 'MP', 'projection ms', 'NMS ms', 'peak alloc MB', 'detect ms'
+    ))
+    for width, height in sizes:
+        img = _synthetic_photo(width, height)
+        hough_gx, hough_gy = _hough_projections(img)
+        print('{:>12} {:>8.1f} {:>14.1f} {:>10.2f} {:>14.1f} {:>10.1f}'.format(
+            '{}x{}'.format(width, height), width * height / 1e6,
+            _time(_hough_projections, img) * 1000,
+            _time(lambda: (_nonmax_suppress_1d(hough_gx), _nonmax_suppress_1d(hough_gy))) * 1000,
+            _peak_mb(projection_peaks, img),
+            _time(detect_chessboard_corners, img) * 1000,
+        ))
+
+def _corner_error(corners, expected):
+    """ Largest distance in px between two [left, top, right, bottom] """
+    return np.abs(np.asarray(corners) - np.asarray(expected)).max()
+
+def benchmark_multiscale(sides, n_boards, image_paths):
+    """ Prints accuracy and time of full resolution and multiscale corner
+        detection at each image side: on synthetic boards with known corners,
+        and on screenshots resized to that side, where full resolution
+        detection is the reference
+    """
+    import PIL.Image
+    from chessboard_finder import (
+        COARSE_SIDE, synthetic_board, detect_chessboard_corners,
+        detect_chessboard_corners_multiscale,
+    )
+    detectors = [
+        ('full', detect_chessboard_corners),
+        ('multiscale', detect_chessboard_corners_multiscale),
+    ]
+    print('Multiscale search at {} px'.format(COARSE_SIDE))
+    print('{:<16} {:>6} {:<11} {:>7} {:>7} {:>12} {:>9}'.format(
+        'images', 'side', 'mode', 'found', 'exact', 'max err px', 'median ms'
+    ))
+    row = '{:<16} {:>6} {:<11} {:>7} {:>7} {:>12} {:>9.1f}'
+    for side in sides:
+        rng = np.random.default_rng(1)
+        # Boards of half to most of the image, like a cropped photo
+        boards = [synthetic_board(rng, (side // 20, side // 11), side // 4) for _ in range(n_boards)]
+        for mode, detect in detectors:
+            times, errors = [], []
+            for img, expected in boards:
+                t = timer()
+                corners = detect(img, noise_threshold=0)
+                times.append(timer() - t)
+                if corners is not None:
+                    errors.append(_corner_error(corners, expected))
+            print(row.format(
+                'synthetic', side, mode, '{}/{}'.format(len(errors), n_boards),
+                sum(e == 0 for e in errors), max(errors, default='-'),
+                np.median(times) * 1000,
+            ))
+        for image_path in image_paths:
+            img = PIL.Image.open(image_path).convert('L').resize((side, side), PIL.Image.BILINEAR)
+            img = np.asarray(img)
+            reference = detect_chessboard_corners(img)
+            for mode, detect in detectors:
+                corners = detect(img)
+                print(row.format(
+                    os.path.basename(image_path)[:16], side, mode,
+                    '-' if corners is None else 'yes',
+                    '-' if corners is None or reference is None else int(_corner_error(corners, reference) == 0),
+                    '-' if corners is None or reference is None else _corner_error(corners, reference),
+                    _time(detect, img) * 1000,
+                ))
+
+def _full_decode_tiles(image_bytes):
+    """ Tiles as chessboard_image made them before JPEG draft decoding: a
+        full RGB decode, resized, then converted to grayscale
+    """
+    import PIL.Image
+    from constants import USE_GRAYSCALE
+    from chessboard_image import open_image, _tiles_view, GRAYSCALE_MATRIX
+    img = open_image(image_bytes).convert('RGB').resize([256, 256], PIL.Image.BILINEAR)
+    if USE_GRAYSCALE:
+        img = img.convert('L', GRAYSCALE_MATRIX)
+    arr = np.asarray(img, dtype=np.uint8).reshape(256, 256, -1)
+    return _tiles_view(arr).reshape(64, 32, 32, -1).astype(np.float32) * np.float32(1. / 255)
+
+def benchmark_decode(sides, image_paths, backend):
+    """ Prints the time to turn PNG and JPEG files of each image at each
+        side into tiles, against a full decode, with the pixel differences
+        and how many tiles the model classifies the same.
+        Returns the largest mean difference in gray levels
+    """
+    import io
+    import PIL.Image
+    import recognize
+    from recognize import _chessboard_tiles_img_data, predict_tiles
+
+    recognize.backend = backend
+    recognize.load_model_if_needed()
+    print('{:<16} {:>6} {:<5} {:>9} {:>9} {:>9} {:>9} {:>11}'.format(
+        'image', 'side', 'fmt', 'full ms', 'fast ms', 'max diff', 'mean diff', 'same tiles'
+    ))
+    worst = 0.
+    for image_path in image_paths:
+        src = PIL.Image.open(image_path).convert('RGB')
+        for side in sides:
+            img = src.resize((side, side), PIL.Image.BICUBIC)
+            for fmt in ['PNG', 'JPEG']:
+                f = io.BytesIO()
+                img.save(f, fmt, **({'quality': 90} if fmt == 'JPEG' else {}))
+                image_bytes = f.getvalue()
+                reference = _full_decode_tiles(image_bytes)
+                tiles = _chessboard_tiles_img_data(image_bytes)
+                diff = np.abs(tiles - reference) * 255
+                worst = max(worst, diff.mean())
+                same = np.mean(
+                    predict_tiles(tiles).argmax(axis=1) == predict_tiles(reference).argmax(axis=1)
+                )
+                print('{:<16} {:>6} {:<5} {:>9.1f} {:>9.1f} {:>9.1f} {:>9.3f} {:>11.4f}'.format(
+                    os.path.basename(image_path)[:16], side, fmt,
+                    _time(_full_decode_tiles, image_bytes) * 1000,
+                    _time(_chessboard_tiles_img_data, image_bytes) * 1000,
+                    diff.max(), diff.mean(), same,
+                ))
+    return worst
+
+def _synthetic_diagram(rng, tile, n_pieces=16):
+    """ Grayscale uint8 image of a digital board diagram: flat squares and
+        the same few piece sprites on random squares
+    """
+    squares = (np.indices((8, 8)).sum(axis=0) % 2 * 80 + 140).astype(np.uint8)
+    img = np.kron(squares, np.ones((tile, tile), dtype=np.uint8))
+    sprites = rng.integers(0, 60, (4, tile // 2, tile // 2)).astype(np.uint8)
+    for rank, file in rng.integers(0, 8, (n_pieces, 2)):
+        top, left = rank * tile + tile // 4, file * tile + tile // 4
+        img[top:top + tile // 2, left:left + tile // 2] = sprites[rng.integers(0, 4)]
+    return img
+
+def benchmark_dedup(tile_sizes, image_paths, backend):
+    """ Prints the number of distinct tiles of each board (synthetic
+        diagrams with each tile size, and images) and the time to classify
+        them all, only the distinct ones, and again with a warm tile cache.
+        Returns the average fraction of tiles skipped on the diagrams
+    """
+    import recognize
+    from tile_cache import TileCache
+    from recognize import _chessboard_tiles_img_data, predict_tiles, classify_tiles
+
+    recognize.backend = backend
+    recognize.load_model_if_needed()
+    rng = np.random.default_rng(1)
+    boards = [('diagram/{}px'.format(tile), _synthetic_diagram(rng, tile)) for tile in tile_sizes]
+    boards += [(os.path.basename(path)[:16], path) for path in image_paths]
+    print('{:<16} {:>8} {:>11} {:>9} {:>10}'.format(
+        'board', 'unique', 'all ms', 'dedup ms', 'cached ms'
+    ))
+    skipped = []
+    for name, img in boards:
+        tiles = _chessboard_tiles_img_data(img)
+        stats = {}
+        recognize.tile_cache = None
+        classify_tiles(tiles, stats)
+        if name.startswith('diagram'):
+            skipped.append(1 - stats['unique'] / stats['tiles'])
+        dedup_ms = _time(classify_tiles, tiles) * 1000
+        recognize.tile_cache = TileCache()
+        classify_tiles(tiles)
+        cached_ms = _time(classify_tiles, tiles) * 1000
+        print('{:<16} {:>5}/64 {:>11.1f} {:>9.1f} {:>10.2f}'.format(
+            name, stats['unique'], _time(predict_tiles, tiles) * 1000, dedup_ms, cached_ms,
+        ))
+    recognize.tile_cache = None
+    return np.mean(skipped) if skipped else 0.
+
+def _screenshot(board, width):
+    """ RGB PIL image of a width x 9/16 width screenshot: a title bar, the
+        board image on the left and a side panel of text lines
+    """
+    import PIL.Image
+    import PIL.ImageDraw
+    height = width * 9 // 16
+    bar = height // 20
+    side = height - 2 * bar
+    img = PIL.Image.new('RGB', (width, height), (48, 46, 43))
+    draw = PIL.ImageDraw.Draw(img)
+    draw.rectangle([0, 0, width, bar], fill=(230, 230, 230))
+    img.paste(board.convert('RGB').resize((side, side), PIL.Image.BICUBIC), (bar, bar + bar // 2))
+    line_height = max(8, height // 30)
+    rng = np.random.default_rng(1)
+    for y in range(2 * bar, height - line_height, line_height):
+        x = side + 3 * bar
+        while x < width - 40:
+            word = int(rng.integers(10, 40))
+            draw.rectangle([x, y, x + word, y + line_height * 2 // 3], fill=(190, 190, 190))
+            x += word + int(rng.integers(5, 15))
+    return img
+
+def _percentiles(fn, *args, n_repeats=20):
+    """ Returns the p50, p95 and p99 milliseconds per call of fn(*args),
+        and the peak KB of memory allocated by Python and NumPy during one
+        more call (buffers PIL allocates itself aren't traced)
+    """
+    fn(*args)
+    times = []
+    for _ in range(n_repeats):
+        t = timer()
+        fn(*args)
+        times.append((timer() - t) * 1000)
+    tracemalloc.start()
+    fn(*args)
+    peak = tracemalloc.get_traced_memory()[1]
+    tracemalloc.stop()
+    p50, p95, p99 = np.percentile(times, [50, 95, 99])
+    return {'p50_ms': p50, 'p95_ms': p95, 'p99_ms': p99, 'peak_kb': peak / 1024}
+
+def benchmark_stages(sides, batch_sizes, image_paths, backend, n_repeats=20):
+    """ Times each step from image file to FEN on its own, by calling the
+        functions recognize runs: decoding PNG and JPEG screenshots of each
+        board image at each width, locating and cropping the board with and
+        without the geometry cache, resizing it, cutting tiles and the whole
+        image to tiles path. Then at each batch size: classifying the tiles
+        (classify_tiles, and the model call alone), FEN assembly and
+        predict_chessboards from screenshot bytes to FENs.
+
+        Prints and returns {stage: percentiles and peak KB (see _percentiles)}
+    """
+    import io
+    import PIL.Image
+    import recognize
+    import chessboard_image
+    from constants import USE_GRAYSCALE
+    from chessboard_finder import BoardGeometryCache
+    from chessboard_image import (
+        _decode, crop_to_chessboard, _resize_chessboard, _chessboard_array, _tiles_array,
+        get_chessboard_tiles_array,
+    )
+    from recognize import (
+        predict_tiles, classify_tiles, chessboard_from_probabilities, predict_chessboards
+    )
+
+    def locate_uncached(img):
+        chessboard_image.geometry_cache = BoardGeometryCache()
+        return crop_to_chessboard(img)
+
+    def tiles(img):
+        return _tiles_array(_chessboard_array(img, USE_GRAYSCALE))
+
+    def fens(probabilities):
+        return [
+            chessboard_from_probabilities(probabilities[i:i+64])
+            for i in range(0, len(probabilities), 64)
+        ]
+
+    def recognize_all(images, batch_size):
+        return list(predict_chessboards(images, boards_per_batch=batch_size))
+
+    recognize.backend = backend
+    recognize.load_model_if_needed()
+    geometry_cache = chessboard_image.geometry_cache
+    results = {}
+
+    def run(stage, fn, *args):
+        results[stage] = _percentiles(fn, *args, n_repeats=n_repeats)
+        print('{:<34} {:>9.2f} {:>9.2f} {:>9.2f} {:>11.0f}'.format(
+            stage, *[results[stage][k] for k in ['p50_ms', 'p95_ms', 'p99_ms', 'peak_kb']]
+        ))
+
+    print('{:<34} {:>9} {:>9} {:>9} {:>11}'.format(
+        'stage', 'p50 ms', 'p95 ms', 'p99 ms', 'peak KB'
+    ))
+    boards = []
+    screenshots = []
+    try:
+        for image_path in image_paths:
+            name = os.path.splitext(os.path.basename(image_path))[0][:12]
+            board = PIL.Image.open(image_path)
+            for side in sides:
+                screenshot = _screenshot(board, side)
+                for fmt in ['PNG', 'JPEG']:
+                    f = io.BytesIO()
+                    screenshot.save(f, fmt, **({'quality': 90} if fmt == 'JPEG' else {}))
+                    run('decode/{}/{}/{}'.format(name, fmt.lower(), side),
+                        _decode, f.getvalue(), USE_GRAYSCALE)
+                if side == min(sides):
+                    screenshots.append(f.getvalue())
+                img = _decode(f.getvalue(), USE_GRAYSCALE)
+                cropped, corners, _ = locate_uncached(img)
+                if corners is None:
+                    print('!! No board found in the {} screenshot at {} px'.format(name, side))
+                    continue
+                run('locate/{}/{}'.format(name, side), locate_uncached, img)
+                run('locate-cached/{}/{}'.format(name, side), crop_to_chessboard, img)
+                run('resize/{}/{}'.format(name, side), _resize_chessboard, cropped)
+                resized = _resize_chessboard(cropped)
+                run('tiles/{}/{}'.format(name, side), tiles, resized)
+                run('image-to-tiles/{}/{}'.format(name, side),
+                    get_chessboard_tiles_array, f.getvalue(), USE_GRAYSCALE)
+                boards.append(tiles(resized))
+        if not boards:
+            return results
+        for batch_size in batch_sizes:
+            # Boards repeat when there are fewer than batch_size, and then
+            # share all their tiles, as in a batch of copies
+            batch = np.concatenate([boards[i % len(boards)] for i in range(batch_size)])
+            run('classify/{}'.format(batch_size), classify_tiles, batch)
+            run('inference/{}/{}'.format(backend, batch_size), predict_tiles, batch)
+            run('fen/{}'.format(batch_size), fens, predict_tiles(batch))
+            images = [screenshots[i % len(screenshots)] for i in range(batch_size)]
+            run('recognize/{}'.format(batch_size), recognize_all, images, batch_size)
+    finally:
+        chessboard_image.geometry_cache = geometry_cache
+    return results
+
+def _recognize_bytes(image_bytes):
+    """ What a worker of the pool does with each job """
+    from recognize import _chessboard_tiles_img_data, classify_tiles, chessboard_from_probabilities
+    return chessboard_from_probabilities(classify_tiles(_chessboard_tiles_img_data(image_bytes)))
+
+def benchmark_pool(worker_counts, n_boards, image_paths, backend):
+    """ Prints the boards per second recognized in this process, one board
+        at a time, and by a worker pool of each size given n_boards images
+        at once, with the speedup over this process and per worker.
+        Returns {number of workers: boards per second}, 0 for in-process
+    """
+    import recognize
+    from worker_pool import RecognitionWorkerPool
+
+    images = []
+    for image_path in image_paths:
+        with open(image_path, 'rb') as f:
+            images.append(f.read())
+    images = [images[i % len(images)] for i in range(n_boards)]
+
+    recognize.backend = backend
+    recognize.warm_up()
+    t = timer()
+    for image_bytes in images:
+        _recognize_bytes(image_bytes)
+    results = {0: n_boards / (timer() - t)}
+    print('{:<12} {:>10} {:>10} {:>9} {:>11}'.format(
+        'workers', 'start s', 'boards/s', 'speedup', 'per worker'
+    ))
+    print('{:<12} {:>10} {:>10.1f} {:>9.2f} {:>11.2f}'.format(
+        'in-process', '-', results[0], 1, 1
+    ))
+    for size in worker_counts:
+        t = timer()
+        with RecognitionWorkerPool(size, backend=backend) as pool:
+            if not pool.wait_until_ready():
+                print('!! No worker of a pool of {} could be started'.format(size))
+                continue
+            start_s = timer() - t
+            # Once more per worker first, so every worker has run the model
+            for future in [pool.submit(image_bytes) for image_bytes in images[:size]]:
+                future.result()
+            t = timer()
+            for future in [pool.submit(image_bytes) for image_bytes in images]:
+                future.result()
+            results[size] = n_boards / (timer() - t)
+        speedup = results[size] / results[0]
+        print('{:<12} {:>10.1f} {:>10.1f} {:>9.2f} {:>11.2f}'.format(
+            size, start_s, results[size], speedup, speedup / size
+        ))
+    return results
+
+def save_baseline(results, path):
+    with open(path, 'w') as f:
+        json.dump(results, f, indent=1, sort_keys=True)
+
+def compare_to_baseline(results, path, max_regression=MAX_REGRESSION):
+    """ Prints the stages of results that are slower or allocate more than
+        in the baseline file at path by more than max_regression.
+        Returns the number of regressed stages
+    """
+    with open(path) as f:
+        baseline = json.load(f)
+    n_regressions = 0
+    for stage, result in results.items():
+        if stage not in baseline:
+            continue
+        base = baseline[stage]
+        for key, slack in [('p50_ms', MIN_REGRESSION_MS), ('peak_kb', MIN_REGRESSION_KB)]:
+            if result[key] > base[key] * (1 + max_regression) + slack:
+                n_regressions += 1
+                print('!! {} {} regressed: {:.2f} -> {:.2f}'.format(
+                    stage, key, base[key], result[key]
+                ))
+    return n_regressions
+
+def _image_size(value):
+    width, height = value.lower().split('x')
+    return int(width), int(height)
+
+if __name__ == '__main__':
+    parser = argparse.ArgumentParser()
+    subparsers = parser.add_subparsers(dest='command', required=True)
+
+    startup = subparsers.add_parser(
+        'startup', help="Time imports, model load and first prediction"
+    )
+    startup.add_argument("-b", "--backend", action="append",
+                         help="Backend to measure (repeatable, default NN_BACKEND)")
+    startup.add_argument("-n", "--repeat", type=int, default=3,
+                         help="Number of fresh processes per backend")
+    startup.add_argument("--max-seconds", type=float,
+                         help="Exit with an error if any backend's total is slower")
+
+    sequences = subparsers.add_parser(
+        'sequences', help="Time the line sequence search for growing peak counts"
+    )
+    sequences.add_argument("--peaks", type=int, nargs='+',
+                           default=[16, 32, 64, 128, 256, 512],
+                           help="Numbers of Hough peaks to search")
+
+    corners = subparsers.add_parser(
+        'corners', help="Time the gradient projection of chessboard_finder on photo-sized images"
+    )
+    corners.add_argument("--size", type=_image_size, nargs='+',
+                         default=[(1280, 960), (4000, 3000)],
+                         help="Image sizes as WIDTHxHEIGHT (default up to a 12MP photo)")
+
+    multiscale = subparsers.add_parser(
+        'multiscale', help="Compare full resolution and multiscale corner detection"
+    )
+    multiscale.add_argument("--sides", type=int, nargs='+', default=[640, 1280, 2560, 4000],
+                            help="Image sides in px to test")
+    multiscale.add_argument("--boards", type=int, default=20,
+                            help="Number of synthetic boards per side")
+    multiscale.add_argument("images", nargs='*', default=['chess_board.png'],
+                            help="Screenshots to resize to each side")
+
+    decode = subparsers.add_parser(
+        'decode', help="Time turning PNG and JPEG files into tiles against a full decode"
+    )
+    decode.add_argument("--sides", type=int, nargs='+', default=[720, 1280, 2560, 4000],
+                        help="Image sides in px to test")
+    decode.add_argument("-b", "--backend", default=NN_BACKEND,
+                        help="Backend that classifies the tiles")
+    decode.add_argument("--max-mean-difference", type=float, default=1.0,
+                        help="Exit with an error if tiles differ more on average, in gray levels")
+    decode.add_argument("images", nargs='*', default=['chess_board.png'],
+                        help="Chessboard images to encode at each side")
+
+    dedup = subparsers.add_parser(
+        'dedup', help="Count distinct tiles per board and time classifying only those"
+    )
+    dedup.add_argument("--tile-sizes", type=int, nargs='+', default=[32, 45, 64, 100],
+                       help="Square sizes in px of the synthetic diagrams")
+    dedup.add_argument("-b", "--backend", default=NN_BACKEND,
+                       help="Backend that classifies the tiles")
+    dedup.add_argument("images", nargs='*', default=['chess_board.png'],
+                       help="Chessboard images to count distinct tiles of too")
+
+    stages = subparsers.add_parser(
+        'stages', help="Time each step from image file to FEN, against a baseline"
+    )
+    stages.add_argument("--sides", type=int, nargs='+', default=[720, 1280, 2560],
+                        help="Screenshot widths in px to test")
+    stages.add_argument("--batch-sizes", type=int, nargs='+', default=[1, 8, 32],
+                        help="Numbers of boards per model call to test")
+    stages.add_argument("-b", "--backend", default=NN_BACKEND,
+                        help="Backend that classifies the tiles")
+    stages.add_argument("-n", "--repeat", type=int, default=20,
+                        help="Timed calls per stage")
+    stages.add_argument("--baseline", default=BASELINE_FILE,
+                        help="JSON file of baseline timings to compare against")
+    stages.add_argument("--save-baseline", action="store_true",
+                        help="Save the timings as the new baseline instead of comparing")
+    stages.add_argument("--max-regression", type=float, default=MAX_REGRESSION,
+                        help="Exit with an error if a stage is slower or allocates "
+                        "more than this fraction over the baseline")
+    stages.add_argument("images", nargs='*',
+                        help="Chessboard images to render into screenshots (default "
+                        "chess_board.png and the first two images in CHESSBOARDS_DIR)")
+
+    pool = subparsers.add_parser(
+        'pool', help="Compare boards/sec of worker pools of each size against in-process"
+    )
+    pool.add_argument("-w", "--workers", type=int, nargs='+',
+                      help="Pool sizes to test (default 1 up to the number of CPUs)")
+    pool.add_argument("--boards", type=int, default=64,
+                      help="Number of images recognized per measurement")
+    pool.add_argument("-b", "--backend", default=NN_BACKEND,
+                      help="Backend the workers and this process use")
+    pool.add_argument("images", nargs='*', default=['chess_board.png'],
+                      help="Chessboard images to recognize, repeated up to --boards")
+
+    args = parser.parse_args()
+    if args.command == 'startup':
+        totals = benchmark_startup(args.backend or [NN_BACKEND], args.repeat)
+        if args.max_seconds is not None:
+            slow = [b for b, total in totals.items() if total > args.max_seconds]
+            if slow:
+                print('!! Startup slower than {}s: {}'.format(args.max_seconds, ', '.join(slow)))
+                exit(1)
+    elif args.command == 'sequences':
+        benchmark_sequences(args.peaks)
+    elif args.command == 'corners':
+        benchmark_corners(args.size)
+    elif args.command == 'multiscale':
+        benchmark_multiscale(args.sides, args.boards, args.images)
+    elif args.command == 'decode':
+        worst = benchmark_decode(args.sides, args.images, args.backend)
+        if worst > args.max_mean_difference:
+            print('!! Tiles differ by {:.3f} gray levels on average, more than {}'.format(
+                worst, args.max_mean_difference
+            ))
+            exit(1)
+    elif args.command == 'dedup':
+        skipped = benchmark_dedup(args.tile_sizes, args.images, args.backend)
+        print('Diagrams skip {:.0%} of tiles on average'.format(skipped))
+    elif args.command == 'pool':
+        from worker_pool import default_pool_size
+        benchmark_pool(
+            args.workers or list(range(1, default_pool_size() + 1)),
+            args.boards, args.images, args.backend,
+        )
+    elif args.command == 'stages':
+        from glob import glob
+        from constants import CHESSBOARDS_DIR
+        images = args.images or ['chess_board.png'] + sorted(
+            glob(os.path.join(CHESSBOARDS_DIR, '**', '*.png'), recursive=True)
+        )[:2]
+        results = benchmark_stages(
+            args.sides, args.batch_sizes, images, args.backend, args.repeat
+        )
+        if args.save_baseline:
+            save_baseline(results, args.baseline)
+            print('Saved baseline to {}'.format(args.baseline))
+        elif os.path.exists(args.baseline):
+            if compare_to_baseline(results, args.baseline, args.max_regression):
+                exit(1)
+            print('No stage regressed more than {:.0%} from {}'.format(
+                args.max_regression, args.baseline
+            ))
+        else:
+            print('No baseline at {}, save one with --save-baseline'.format(args.baseline))
@@ -2,19 +2,53 @@
 # -*- coding: utf-8 -*-
 
 # Pass in image of online chessboard screenshot, returns corners of chessboard
-# usage: chessboard_finder.py [-h] urls [urls ...]
+# usage: chessboard_finder.py [-h] [--check] [images ...]
 
 # Find orthorectified chessboard corners in image
 
 # positional arguments:
-#   urls        Input image urls
+#   images      Input image paths
 
 # optional arguments:
 #   -h, --help  show this help message and exit
+#   --check     Detect synthetic boards with known corners, exit 1 on a miss
+
+import argparse
+import threading
+from bisect import bisect_left
+from collections import OrderedDict
 
 import numpy as np
+from numpy.lib.stride_tricks import sliding_window_view
 import PIL.Image
 
+import tracing
+
+# Images larger than this many px on a side are searched for a board at a
+# lower resolution first, see detect_chessboard_corners_multiscale
+COARSE_SIDE = 640
+
+# Smallest board locate_chessboard looks for, in px on a side
+MIN_BOARD_SIDE = 64
+
+# Boards scoring lower than this aren't accepted, see board_score
+MIN_BOARD_SCORE = 0.5
+
+# Number of screen layouts BoardGeometryCache remembers
+GEOMETRY_CACHE_SIZE = 256
+
+def _nearest(seq, n):
+    """ Given a sorted list, returns the value closest to n. Ties go to the
+        smaller value
+    """
+    i = bisect_left(seq, n)
+    if i == 0:
+        return seq[0]
+    if i == len(seq):
+        return seq[-1]
+    before, after = seq[i-1], seq[i]
+    return before if n - before <= after - n else after
+
 def _get_all_sequences(seq, min_seq_len=7, err_px=5):
     """ Given sequence of increasing numbers, get all sequences with common
         spacing (within err_px) that contain at least min_seq_len values
@@ -23,79 +57,178 @@ def _get_all_sequences(seq, min_seq_len=7, err_px=5):
     if len(seq) < min_seq_len:
         return []
 
+    seq = np.asarray(seq)
+    values = seq.tolist()
+    last = values[-1]
+
     # For every value, take the next value and see how many times we can step
     # that falls on another value within err_px points
     seqs = []
-    for i in range(len(seq)-1):
-        for j in range(i+1, len(seq)):
+    # Consecutive pairs of values already part of a found sequence
+    used_pairs = set()
+    for i in range(len(values)-1):
+        for j in range(i+1, len(values)):
+            d = values[j] - values[i]
+
+            # Each step lands more than d - err_px further along, so once even
+            # that can't fit min_seq_len values, no larger d will either
+            if values[i] + (min_seq_len - 1) * (d - err_px) >= last:
+                break
+
             # Check that seq[i], seq[j] not already in previous sequences
-            duplicate = False
-            for prev_seq in seqs:
-                for k in range(len(prev_seq)-1):
-                    if seq[i] == prev_seq[k] and seq[j] == prev_seq[k+1]:
-                        duplicate = True
-            if duplicate:
+            if (values[i], values[j]) in used_pairs:
                 continue
-            d = seq[j] - seq[i]
-            
+
             # Ignore two points that are within error bounds of each other
             if d < err_px:
                 continue
 
-            s = [seq[i], seq[j]]
+            s = [values[i], values[j]]
             n = s[-1] + d
-            while np.abs((seq-n)).min() < err_px:
-                n = seq[np.abs((seq-n)).argmin()]
-                s.append(n)
-                n = s[-1] + d
+            while True:
+                nearest = _nearest(values, n)
+                if abs(nearest - n) >= err_px:
+                    break
+                s.append(nearest)
+                n = nearest + d
 
             if len(s) >= min_seq_len:
-                s = np.array(s)
-                seqs.append(s)
+                used_pairs.update(zip(s, s[1:]))
+                seqs.append(np.array(s, dtype=seq.dtype))
     return seqs
 
 def _nonmax_suppress_1d(arr, winsize=5):
     """ Return 1d array with only peaks, use neighborhood window of winsize px
     """
+    size = arr.size
+    # Max of the winsize values before each element (0 for the first one)
+    padded = np.concatenate([np.full(winsize, -np.inf), arr])
+    left_max = sliding_window_view(padded[:-1], winsize).max(axis=1)
+    left_max[0] = 0
+    # Max of the winsize-1 values after each element, never looking at the
+    # last element (0 for the last two)
+    right_max = np.zeros(size)
+    if size > 2:
+        padded = np.concatenate([arr[1:size-1], np.full(winsize - 2, -np.inf)])
+        right_max[:size-2] = sliding_window_view(padded, winsize - 1).max(axis=1)
     _arr = arr.copy()
-    for i in range(_arr.size):
-        if i == 0:
-            left_neighborhood = 0
-        else:
-            left_neighborhood = arr[max(0,i-winsize):i]
-        if i >= _arr.size-2:
-            right_neighborhood = 0
-        else:
-            right_neighborhood = arr[i+1:min(arr.size-1,i+winsize)]
-
-        if arr[i] < np.max(left_neighborhood) or arr[i] <= np.max(right_neighborhood):
-            _arr[i] = 0
+    _arr[(arr < left_max) | (arr <= right_max)] = 0
     return _arr
 
-def detect_chessboard_corners(img_arr_gray, noise_threshold = 8000):
+def _gradient(img_arr, axis, out):
+    """ Same as np.gradient(img_arr, axis=axis), written into the float32
+        array out without a float copy of the image
+    """
+    a = np.moveaxis(img_arr, axis, 0)
+    g = np.moveaxis(out, axis, 0)
+    np.subtract(a[2:], a[:-2], out=g[1:-1], dtype=np.float32)
+    g[1:-1] *= 0.5
+    np.subtract(a[1:2], a[:1], out=g[:1], dtype=np.float32)
+    np.subtract(a[-1:], a[-2:-1], out=g[-1:], dtype=np.float32)
+    return out
+
+def _hough_projections(img_arr_gray):
+    """ 1-D amplitude of hough transform of gradients about X & Y axes: for each
+        row (X) and column (Y), the sum of positive gradients times the sum of
+        negative gradients.
+
+        Uses two float32 buffers the size of the image. Sums are accumulated
+        in float64, so results match float64 gradients for 8-bit images
+    """
+    grad = np.empty(img_arr_gray.shape, dtype=np.float32)
+    buf = np.empty_like(grad)
+    hough = []
+    # gx is the gradient along rows, summed per row; gy along columns
+    for grad_axis, sum_axis in [(0, 1), (1, 0)]:
+        _gradient(img_arr_gray, grad_axis, grad)
+        pos = np.maximum(grad, 0, out=buf).sum(axis=sum_axis, dtype=np.float64)
+        neg = np.minimum(grad, 0, out=buf).sum(axis=sum_axis, dtype=np.float64)
+        hough.append(pos * -neg)
+    return hough
+
+def _integral_at(img_arr, rows, cols):
+    """ Summed-area table of a 2D array at sorted rows and cols only:
+        T[i, j] = img_arr[:rows[i], :cols[j]].sum(), so a box sum is
+        T[i1, j1] - T[i0, j1] - T[i1, j0] + T[i0, j0]. Costs one pass over
+        the array instead of a full-size table. cols must start at 0
+    """
+    h, w = img_arr.shape
+    if h == 0 or w == 0:
+        return np.zeros((len(rows), len(cols)))
+    # Sums of the column blocks between consecutive cols, then running totals
+    starts = cols[cols < w]
+    block_sums = np.add.reduceat(img_arr, starts, axis=1, dtype=np.float64)
+    col_totals = np.zeros((h + 1, len(starts) + 1))
+    np.cumsum(block_sums, axis=1, out=col_totals[1:, 1:])
+    np.cumsum(col_totals[1:], axis=0, out=col_totals[1:])
+    return col_totals[rows][:, :len(cols)]
+
+def _spaced_edges(starts, ends):
+    """ (N, 9) int array of 9 evenly spaced line positions from each start to
+        the matching end
+    """
+    starts = np.asarray(starts, dtype=float)[:, None]
+    ends = np.asarray(ends, dtype=float)[:, None]
+    return np.rint(starts + (ends - starts) * np.arange(9) / 8).astype(int)
+
+def _grid_edges(inner_lines, step):
+    """ Candidate positions of the 9 lines of a board along one axis: one row
+        for every run of 7 inner lines, padded by a tile on each side
+    """
+    runs = np.array([inner_lines[k:k+7] for k in range(len(inner_lines) - 6)])
+    return np.rint(np.column_stack([runs[:, 0] - step, runs, runs[:, -1] + step])).astype(int)
+
+def _moved_edges(edges, refine_px):
+    """ Candidates around the 9 line positions of edges, with both outer
+        edges moved by up to refine_px. The unmoved edges come first
+    """
+    offsets = np.array([0] + [sign * d for d in range(1, refine_px + 1) for sign in (-1, 1)])
+    starts, ends = np.meshgrid(edges[0] + offsets, edges[-1] + offsets, indexing='ij')
+    return _spaced_edges(starts.ravel(), ends.ravel())
+
+def _checkerboard_scores(img_arr, row_edges, col_edges):
+    """ Checkerboard response of every combination of (N, 9) row and column
+        edges, as an (N rows, N cols) array: the absolute alternating sum of
+        the mean brightness of the 64 squares, computed from box sums of the
+        summed-area table. Absolute since it's possible board is rotated 90 deg
+    """
+    rows = np.clip(row_edges, 0, img_arr.shape[0])
+    cols = np.clip(col_edges, 0, img_arr.shape[1])
+    # Box sums don't change if the table starts at the first edges
+    top, left = rows.min(), cols.min()
+    row_values, row_index = np.unique(rows - top, return_inverse=True)
+    col_values, col_index = np.unique(cols - left, return_inverse=True)
+    table = _integral_at(
+        img_arr[top:top + row_values[-1], left:left + col_values[-1]],
+        row_values, col_values,
+    )
+    # (N rows, N cols, 9, 9) table values at the grid points
+    S = table[row_index.reshape(rows.shape)[:, None, :, None],
+              col_index.reshape(cols.shape)[None, :, None, :]]
+    square_sums = np.diff(np.diff(S, axis=2), axis=3)
+    # Squares outside the image have no area, count them as black
+    areas = np.diff(rows)[:, None, :, None] * np.diff(cols)[None, :, None, :]
+    square_means = square_sums / np.maximum(areas, 1)
+    signs = 1 - 2 * (np.indices((8, 8)).sum(axis=0) % 2)
+    return np.abs((square_means * signs).sum(axis=(2, 3)))
+
+def detect_chessboard_corners(img_arr_gray, noise_threshold = 8000, refine_px = 2):
     """ Load image grayscale as an numpy array
-        Return None on failure to find a chessboard
+        Return [left, top, right, bottom] corners, or None on failure to find
+        a chessboard
 
         noise_threshold: Ratio of standard deviation of hough values along an axis
         versus the number of pixels, manually measured bad trigger images
         at < 5,000 and good  chessboards values at > 10,000
+        refine_px: Distance in px the board edges found from the hough lines
+        are moved to look for a better checkerboard response
     """
-    # Get gradients, split into positive and inverted negative components 
-    gx, gy = np.gradient(img_arr_gray)
-    gx_pos = gx.copy()
-    gx_pos[gx_pos<0] = 0
-    gx_neg = -gx.copy()
-    gx_neg[gx_neg<0] = 0
-
-    gy_pos = gy.copy()
-    gy_pos[gy_pos<0] = 0
-    gy_neg = -gy.copy()
-    gy_neg[gy_neg<0] = 0
-
     # 1-D ampltitude of hough transform of gradients about X & Y axes
-    num_px = img_arr_gray.shape[0] * img_arr_gray.shape[1]
-    hough_gx = gx_pos.sum(axis=1) * gx_neg.sum(axis=1)
-    hough_gy = gy_pos.sum(axis=0) * gy_neg.sum(axis=0)
+    hough_gx, hough_gy = _hough_projections(img_arr_gray)
+
+    # Nothing to find in a flat image
+    if hough_gx.max() == 0 or hough_gy.max() == 0:
+        return None
 
     # Check that gradient peak signal is strong enough by
     # comparing normalized standard deviation to threshold
@@ -130,6 +263,8 @@ def detect_chessboard_corners(img_arr_gray, noise_threshold = 8000):
     seqs_x_vals = [pot_lines_x_vals[[v in seq for v in pot_lines_x]] for seq in seqs_x]
     seqs_y_vals = [pot_lines_y_vals[[v in seq for v in pot_lines_y]] for seq in seqs_y]
 
+    full_seqs_x, full_seqs_y = list(seqs_x), list(seqs_y)
+
     # shorten sequences to up to 9 values based on score
     # X sequences
     for i in range(len(seqs_x)):
@@ -176,86 +311,412 @@ def detect_chessboard_corners(img_arr_gray, noise_threshold = 8000):
 
     # TODO (elucidation): Choose heuristic score between step size and hough response
 
-    best_seq_x = seqs_x[scores_x.argmax()]
-    best_seq_y = seqs_y[scores_y.argmax()]
-    # print(best_seq_x, best_seq_y)
+    # Now that we know the board's lines, every run of 7 of them in the full
+    # sequence is a candidate board (the shortened sequence can keep a wrong
+    # edge). Keep the one with the best checkerboard response, then move its
+    # outer edges a few pixels, since hough peaks can be a pixel off
+    # X sequences are rows (from hough_gx), Y sequences are columns
+    full_seq_x = full_seqs_x[scores_x.argmax()]
+    full_seq_y = full_seqs_y[scores_y.argmax()]
+    row_edges = _grid_edges(full_seq_x, np.median(np.diff(full_seq_x)))
+    col_edges = _grid_edges(full_seq_y, np.median(np.diff(full_seq_y)))
+    return _best_grid(img_arr_gray, row_edges, col_edges, refine_px)
+
+def _best_grid(img_arr_gray, row_edges, col_edges, refine_px):
+    """ Given (N, 9) candidate row and column line positions, returns the
+        [left, top, right, bottom] corners of the combination with the best
+        checkerboard response, after moving its outer edges by up to refine_px
+    """
+    i, j = 0, 0
+    if len(row_edges) > 1 or len(col_edges) > 1:
+        scores = _checkerboard_scores(img_arr_gray, row_edges, col_edges)
+        i, j = np.unravel_index(scores.argmax(), scores.shape)
+
+    row_edges = _moved_edges(row_edges[i], refine_px)
+    col_edges = _moved_edges(col_edges[j], refine_px)
+    scores = _checkerboard_scores(img_arr_gray, row_edges, col_edges)
+    i, j = np.unravel_index(scores.argmax(), scores.shape)
+
+    # [left, top, right, bottom]
+    return np.array([col_edges[j][0], row_edges[i][0], col_edges[j][-1], row_edges[i][-1]])
+
+def _downsample(img_arr, factor):
+    """ Mean of every factor x factor block """
+    if img_arr.dtype == np.uint8:
+        # PIL's box reduce is much faster than a NumPy reduction
+        return np.asarray(PIL.Image.fromarray(img_arr).reduce(factor))
+    h, w = img_arr.shape[0] // factor, img_arr.shape[1] // factor
+    blocks = img_arr[:h * factor, :w * factor].reshape(h, factor, w, factor)
+    return blocks.mean(axis=(1, 3), dtype=np.float32)
+
+def _refine_lines(img_arr_gray, lines, span, band_px):
+    """ Moves each of the row positions in lines to the strongest hough peak
+        within band_px of it, looking only at the columns in span
+    """
+    refined = []
+    for line in lines:
+        start = max(0, line - band_px)
+        strip = img_arr_gray[start:line + band_px + 1, max(0, span[0]):span[1]]
+        if strip.shape[0] < 3 or strip.shape[1] < 1:
+            refined.append(line)
+            continue
+        hough_gx, _ = _hough_projections(strip)
+        # The strip's first and last rows only have one-sided gradients.
+        # An edge gives two equal peaks, keep the second like _nonmax_suppress_1d
+        peaks = hough_gx[1:-1]
+        refined.append(start + len(peaks) - peaks[::-1].argmax())
+    return np.array(refined)
+
+def _fit_edges(inner_lines):
+    """ 9 evenly spaced board edges, least squares fit to 7 inner line
+        positions
+    """
+    step, offset = np.polyfit(np.arange(1, 8), inner_lines, 1)
+    return np.rint(offset + step * np.arange(9)).astype(int)
+
+def detect_chessboard_corners_multiscale(img_arr_gray, coarse_side=COARSE_SIDE,
+                                         noise_threshold=8000, refine_px=2):
+    """ Same result as detect_chessboard_corners, for large images: finds the
+        grid on a copy downsampled to about coarse_side px, then moves its 7
+        inner lines to the hough peaks in narrow bands of the full image and
+        scores the grid at full resolution
+        Return [left, top, right, bottom] corners, or None on failure to find
+        a chessboard
+    """
+    factor = -(-max(img_arr_gray.shape) // coarse_side)
+    if factor < 2:
+        return detect_chessboard_corners(img_arr_gray, noise_threshold, refine_px)
 
-    # Now if we have sequences greater than length 7, (up to 9),
-    # that means we have up to 9 possible combinations of sets of 7 sequences
-    # We try all of them and see which has the best checkerboard response
-    sub_seqs_x = [best_seq_x[k:k+7] for k in range(len(best_seq_x) - 7 + 1)]
-    sub_seqs_y = [best_seq_y[k:k+7] for k in range(len(best_seq_y) - 7 + 1)]
+    corners = detect_chessboard_corners(
+        _downsample(img_arr_gray, factor), noise_threshold, refine_px
+    )
+    if corners is None:
+        return None
+    left, top, right, bottom = corners * factor
+
+    # Coarse lines are within a downsampled pixel or two of the real ones
+    band_px = 2 * factor
+    row_lines = _refine_lines(
+        img_arr_gray, _spaced_edges([top], [bottom])[0][1:-1], (left, right), band_px
+    )
+    col_lines = _refine_lines(
+        img_arr_gray.T, _spaced_edges([left], [right])[0][1:-1], (top, bottom), band_px
+    )
+    return _best_grid(
+        img_arr_gray, _fit_edges(row_lines)[None], _fit_edges(col_lines)[None], refine_px
+    )
+
+def _square_means(img_arr, corners):
+    """ 8x8 mean brightness of the squares of the board at corners """
+    left, top, right, bottom = corners
+    rows = np.clip(_spaced_edges([top], [bottom])[0], 0, img_arr.shape[0])
+    cols = np.clip(_spaced_edges([left], [right])[0], 0, img_arr.shape[1])
+    table = _integral_at(
+        img_arr[rows[0]:rows[-1], cols[0]:cols[-1]], rows - rows[0], cols - cols[0]
+    )
+    areas = np.diff(rows)[:, None] * np.diff(cols)[None, :]
+    return np.diff(np.diff(table, axis=0), axis=1) / np.maximum(areas, 1)
+
+def board_score(img_arr_gray, corners):
+    """ How much the area at corners looks like a chessboard, from 0 to 1:
+        the share of the brightness differences between its squares that
+        follows the alternating light/dark pattern. 1 for an empty board,
+        near 0 for text or a flat area
+    """
+    means = _square_means(img_arr_gray, corners)
+    deviations = means - means.mean()
+    total = np.abs(deviations).sum()
+    if total == 0:
+        return 0.
+    signs = 1 - 2 * (np.indices((8, 8)).sum(axis=0) % 2)
+    return abs((deviations * signs).sum()) / total
+
+def _plausible_board(corners, width, height, min_side=MIN_BOARD_SIDE):
+    """ Whether corners are a square of at least min_side px inside a
+        width x height image, allowing a pixel or two of overhang
+    """
+    left, top, right, bottom = corners
+    side = max(right - left, bottom - top)
+    if side < min_side or abs(1 - (right - left) / (bottom - top)) > 0.05:
+        return False
+    overhang = max(2, side // 64)
+    return (left >= -overhang and top >= -overhang and
+            right <= width + overhang and bottom <= height + overhang)
+
+def _search_windows(width, height):
+    """ [left, top, right, bottom] windows that a board could fill most of:
+        the whole image, and squares as big as its shorter side sliding along
+        the longer one by a quarter of their size
+    """
+    windows = [(0, 0, width, height)]
+    side = min(width, height)
+    length = max(width, height)
+    if length - side > side // 8:
+        offsets = list(range(0, length - side, max(1, side // 4))) + [length - side]
+        for offset in offsets:
+            if width > height:
+                windows.append((offset, 0, offset + side, height))
+            else:
+                windows.append((0, offset, width, offset + side))
+    return windows
 
-    dx = np.median(np.diff(best_seq_x))
-    dy = np.median(np.diff(best_seq_y))
-    corners = np.zeros(4, dtype=int)
-    
-    # Add 1 buffer to include the outer tiles, since sequences are only using
-    # inner chessboard lines
-    corners[0] = int(best_seq_y[0]-dy)
-    corners[1] = int(best_seq_x[0]-dx)
-    corners[2] = int(best_seq_y[-1]+dy)
-    corners[3] = int(best_seq_x[-1]+dx)
-
-    # Generate crop image with on full sequence, which may be wider than a normal
-    # chessboard by an extra 2 tiles, we'll iterate over all combinations
-    # (up to 9) and choose the one that correlates best with a chessboard
-    gray_img_crop = PIL.Image.fromarray(img_arr_gray).crop(corners)
-
-    # Build a kernel image of an idea chessboard to correlate against
-    k = 8 # Arbitrarily chose 8x8 pixel tiles for correlation image
-    quad = np.ones([k,k])
-    kernel = np.vstack([np.hstack([quad,-quad]), np.hstack([-quad,quad])])
-    kernel = np.tile(kernel,(4,4)) # Becomes an 8x8 alternating grid (chessboard)
-    kernel = kernel/np.linalg.norm(kernel) # normalize
-    # 8*8 = 64x64 pixel ideal chessboard
-
-    k = 0
-    n = max(len(sub_seqs_x), len(sub_seqs_y))
-    final_corners = None
-    best_score = None
-
-    # Iterate over all possible combinations of sub sequences and keep the corners
-    # with the best correlation response to the ideal 64x64px chessboard
-    for i in range(len(sub_seqs_x)):
-        for j in range(len(sub_seqs_y)):
-            k = k + 1
-          
-            # [y, x, y, x]
-            sub_corners = np.array([
-                sub_seqs_y[j][0]-corners[0]-dy, sub_seqs_x[i][0]-corners[1]-dx,
-                sub_seqs_y[j][-1]-corners[0]+dy, sub_seqs_x[i][-1]-corners[1]+dx
-            ], dtype=np.int)
-
-            # Generate crop candidate, nearest pixel is fine for correlation check
-            sub_img = gray_img_crop.crop(sub_corners).resize((64,64)) 
-
-            # Perform correlation score, keep running best corners as our final output
-            # Use absolute since it's possible board is rotated 90 deg
-            score = np.abs(np.sum(kernel * sub_img))
-            if best_score is None or score > best_score:
-                best_score = score
-                final_corners = sub_corners + [
-                    corners[0], corners[1], corners[0], corners[1]
-                ]
-    return final_corners
+def _span_windows(img_arr_gray, coarse_side=COARSE_SIDE):
+    """ Windows covering the strongest sequence of evenly spaced lines found
+        along each axis, at full extent along the other. A side panel of text
+        can drown a board's lines in one projection but not the other
+    """
+    factor = max(1, -(-max(img_arr_gray.shape) // coarse_side))
+    small = _downsample(img_arr_gray, factor) if factor > 1 else img_arr_gray
+    height, width = img_arr_gray.shape
+    windows = []
+    for axis, hough in enumerate(_hough_projections(small)):
+        if hough.max() == 0:
+            continue
+        peaks = _nonmax_suppress_1d(hough) / hough.max()
+        seqs = _get_all_sequences(np.where(peaks >= 0.2)[0])
+        if not seqs:
+            continue
+        seq = max(seqs, key=lambda seq: peaks[seq].mean())
+        step = np.median(np.diff(seq))
+        # A tile of margin beyond the outer lines
+        start = max(0, int((seq[0] - 2 * step) * factor))
+        end = int((seq[-1] + 2 * step + 1) * factor)
+        if axis == 0:
+            windows.append((0, start, width, min(height, end)))
+        else:
+            windows.append((start, 0, min(width, end), height))
+    return windows
+
+def locate_chessboard(img_arr_gray, noise_threshold=0):
+    """ Finds a chessboard anywhere in an image, like a screenshot with
+        browser chrome, side panels or move lists around the board.
+
+        Looks for the board's grid in the whole image, in square windows
+        along its longer side and in bands around the lines found along each
+        axis, since other parts of a screenshot also have regular lines. The
+        best board found is searched again in a window one tile larger than
+        it, where the projections only see the board.
+
+        The noise threshold of detect_chessboard_corners is off by default:
+        low contrast boards in a screenshot fall below it, and board_score
+        tells boards from other regular patterns much better.
+
+        Returns a tuple of ([left, top, right, bottom], score), see board_score,
+        or (None, 0) if no board was found
+    """
+    height, width = img_arr_gray.shape
+    best_corners, best_score = None, 0.
+
+    def search(window):
+        nonlocal best_corners, best_score
+        left, top, right, bottom = window
+        corners = detect_chessboard_corners_multiscale(
+            img_arr_gray[top:bottom, left:right], noise_threshold=noise_threshold
+        )
+        if corners is None:
+            return
+        corners = corners + [left, top, left, top]
+        if not _plausible_board(corners, width, height):
+            return
+        score = board_score(img_arr_gray, corners)
+        if score > best_score:
+            best_corners, best_score = corners, score
+
+    for window in _search_windows(width, height) + _span_windows(img_arr_gray):
+        search(window)
+    if best_corners is not None:
+        left, top, right, bottom = best_corners
+        margin = (right - left) // 8
+        search((max(0, left - margin), max(0, top - margin),
+                min(width, right + margin), min(height, bottom + margin)))
+    return best_corners, best_score
+
+def border_signature(img_arr_gray, n_cells=8, levels=16):
+    """ Cheap signature of the border of an image, where a site or app has
+        its chrome: the mean brightness of n_cells cells along each edge,
+        quantized to levels
+    """
+    band = max(1, min(img_arr_gray.shape) // 32)
+    cells = []
+    for strip in [img_arr_gray[:band], img_arr_gray[-band:],
+                  img_arr_gray[:, :band].T, img_arr_gray[:, -band:].T]:
+        profile = strip.mean(axis=0)
+        cells.extend(cell.mean() for cell in np.array_split(profile, n_cells))
+    return bytes((np.array(cells) * levels // 256).astype(np.uint8))
+
+class BoardGeometryCache:
+    """ LRU of board corners by image size and border signature.
+
+        Screenshots from the same site or app share both, so the corners
+        found in one are proposed for the next and confirmed with the
+        checkerboard response instead of searching the image again. Up to
+        max_entries layouts are kept
+    """
+    def __init__(self, max_entries=GEOMETRY_CACHE_SIZE):
+        self.max_entries = max_entries
+        self._entries = OrderedDict()  # key -> corners
+        self._lock = threading.Lock()
+        self.hits = 0
+        self.misses = 0
+        self.rejections = 0
+        self.evictions = 0
+
+    def locate(self, img_arr_gray):
+        """ Same as locate_chessboard, trying the cached corners first """
+        height, width = img_arr_gray.shape
+        key = (width, height, border_signature(img_arr_gray))
+        with self._lock:
+            corners = self._entries.get(key)
+            if corners is not None:
+                self._entries.move_to_end(key)
+        if corners is not None:
+            # A board a few px away from the cached one still scores well,
+            # so also check that nudging the edges doesn't fit better
+            left, top, right, bottom = corners
+            refined = _best_grid(
+                img_arr_gray, _spaced_edges([top], [bottom]),
+                _spaced_edges([left], [right]), refine_px=2,
+            )
+            if np.abs(refined - corners).max() <= 1:
+                score = board_score(img_arr_gray, refined)
+                if score >= MIN_BOARD_SCORE:
+                    with self._lock:
+                        self.hits += 1
+                    tracing.annotate(geometry_cache='hit')
+                    return refined, score
+        with self._lock:
+            if corners is None:
+                self.misses += 1
+            else:
+                # Same layout, but the board moved or is gone
+                self.rejections += 1
+                self._entries.pop(key, None)
+        tracing.annotate(geometry_cache='miss' if corners is None else 'rejected')
+
+        corners, score = locate_chessboard(img_arr_gray)
+        if corners is not None and score >= MIN_BOARD_SCORE:
+            with self._lock:
+                self._entries[key] = corners
+                self._entries.move_to_end(key)
+                while len(self._entries) > self.max_entries:
+                    self._entries.popitem(last=False)
+                    self.evictions += 1
+        return corners, score
+
+    def stats(self):
+        """ Returns a dict of cache counters """
+        with self._lock:
+            lookups = self.hits + self.misses + self.rejections
+            return {
+                'entries': len(self._entries),
+                'hits': self.hits,
+                'misses': self.misses,
+                'rejections': self.rejections,
+                'evictions': self.evictions,
+                'hit_rate': self.hits / lookups if lookups else 0.,
+            }
 
 def get_chessboard_corners(img_arr, detect_corners=False):
     """ Returns a tuple of (corners, error_message)
     """
     if not detect_corners:
         # Don't try to detect corners. Assume the entire image is a board
-        return (([0, 0, img_arr.shape[0], img_arr.shape[1]]), None)
-    corners = detect_chessboard_corners(img_arr)
+        return (([0, 0, img_arr.shape[1], img_arr.shape[0]]), None)
+    with tracing.span('get_chessboard_corners', width=img_arr.shape[1],
+                      height=img_arr.shape[0]) as span:
+        corners, score = locate_chessboard(img_arr)
+        span.set(score=float(score))
     if corners is None:
         return (None, "Failed to find corners in chessboard image")
-    width = corners[2] - corners[0]
-    height = corners[3] - corners[1]
-    ratio = abs(1 - width / height)
-    if ratio > 0.05:
-        return (corners, "Invalid corners - chessboard size is not square")
-    if corners[0] > 1 or corners[1] > 1:
-        # TODO generalize this for chessboards positioned within images
-        return (corners, "Invalid corners - (x,y) are too far from (0,0)")
+    if score < MIN_BOARD_SCORE:
+        return (corners, "Invalid corners - area doesn't look like a chessboard")
     return (corners, None)
 
+def _draw_board(img, rng, left, top, tile):
+    """ Draws a chessboard with random square colors and blobs for pieces """
+    light, dark = rng.integers(150, 230), rng.integers(60, 120)
+    squares = np.where(np.indices((8, 8)).sum(axis=0) % 2, dark, light).astype(np.uint8)
+    img[top:top+8*tile, left:left+8*tile] = np.kron(squares, np.ones((tile, tile), dtype=np.uint8))
+    for _ in range(rng.integers(0, 24)):
+        row, col = rng.integers(0, 8, 2)
+        y, x, m = top + row * tile, left + col * tile, tile // 4
+        img[y+m:y+tile-m, x+m:x+tile-m] = rng.integers(0, 256)
+    return [left, top, left + 8 * tile, top + 8 * tile]
+
+def synthetic_board(rng, tile_sizes=(30, 80), margin=300):
+    """ Returns (grayscale uint8 image, [left, top, right, bottom]) of a
+        chessboard placed at a random position on a noisy background
+    """
+    tile = int(rng.integers(*tile_sizes))
+    width = int(rng.integers(8 * tile, 8 * tile + margin))
+    height = int(rng.integers(8 * tile, 8 * tile + margin))
+    img = rng.integers(0, 30, (height, width)).astype(np.uint8)
+    left = int(rng.integers(0, width - 8 * tile + 1))
+    top = int(rng.integers(0, height - 8 * tile + 1))
+    return img, _draw_board(img, rng, left, top, tile)
+
+def synthetic_screenshot(rng, tile_sizes=(30, 100)):
+    """ Returns (grayscale uint8 image, [left, top, right, bottom]) of a
+        wide screenshot: a title bar, a board and a side panel of text lines
+    """
+    tile = int(rng.integers(*tile_sizes))
+    side = 8 * tile
+    bar = int(rng.integers(20, 80))
+    height = bar + side + int(rng.integers(0, side // 3))
+    width = side + int(rng.integers(side // 3, side))
+    img = np.full((height, width), rng.integers(0, 256), dtype=np.uint8)
+    img[:bar] = rng.integers(0, 256)
+    left = int(rng.integers(0, width - side + 1))
+    top = int(rng.integers(bar, height - side + 1))
+    corners = _draw_board(img, rng, left, top, tile)
+    # Move list: words of dark blocks on lines with regular spacing, next to
+    # the board on its wider side
+    panel = (left + side + 10, width) if width - left - side > left else (0, left - 10)
+    line_height = int(rng.integers(14, 30))
+    for y in range(bar + 5, height - line_height, line_height):
+        x = panel[0] + int(rng.integers(0, 20))
+        while x < panel[1] - 40:
+            word = int(rng.integers(10, 40))
+            img[y:y + line_height * 2 // 3, x:min(x + word, panel[1])] = rng.integers(0, 80)
+            x += word + int(rng.integers(5, 15))
+    return img, corners
+
+def check_synthetic_boards(n_boards=100, seed=1):
+    """ Runs detect_chessboard_corners on synthetic boards and
+        locate_chessboard on synthetic screenshots, prints the misses and
+        returns the number of boards found at exactly the right corners
+    """
+    rng = np.random.default_rng(seed)
+    n_found = 0
+    for k in range(n_boards):
+        if k % 2:
+            img, expected = synthetic_board(rng)
+            # noise_threshold is tuned on real screenshots, this checks the geometry
+            corners = detect_chessboard_corners(img, noise_threshold=0)
+        else:
+            img, expected = synthetic_screenshot(rng)
+            corners, _ = locate_chessboard(img, noise_threshold=0)
+        if corners is not None and list(corners) == expected:
+            n_found += 1
+        else:
+            print('Board {} {}x{}: expected {}, got {}'.format(
+                k, img.shape[1], img.shape[0], expected, corners
+            ))
+    return n_found
+
+if __name__ == '__main__':
+    parser = argparse.ArgumentParser()
+    parser.add_argument("images", nargs='*', help="Input image paths")
+    parser.add_argument("--check", action="store_true",
+                        help="Detect synthetic boards with known corners, exit 1 on a miss")
+    args = parser.parse_args()
+    for image_path in args.images:
+        img_arr = np.asarray(PIL.Image.open(image_path).convert('L'))
+        corners, score = locate_chessboard(img_arr)
+        print('{}: {} score {:.3f}'.format(image_path, corners, score))
+    if args.check:
+        n_boards = 100
+        n_found = check_synthetic_boards(n_boards)
+        print('Found {}/{} synthetic boards'.format(n_found, n_boards))
+        if n_found < n_boards:
+            exit(1)
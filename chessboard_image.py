@@ -1,41 +1,152 @@
+from io import BytesIO
+
 import numpy as np
 import PIL.Image
 
-def _get_resized_chessboard(chessboard_img_path):
-    """ chessboard_img_path = path to a chessboard image
-        Returns a 256x256 image of a chessboard (32x32 per tile)
+import metrics
+import tracing
+from chessboard_finder import BoardGeometryCache, MIN_BOARD_SCORE
+
+# Same luma weights as the tile PNGs used for training
+GRAYSCALE_MATRIX = (0.2989, 0.5870, 0.1140, 0)
+
+# JPEGs are decoded at the smallest DCT scale at least this big, twice the
+# 256x256 board so the bilinear resize still smooths it like a full decode
+DRAFT_SIDE = 512
+
+# Board corners of the screenshot layouts seen by crop_to_chessboard
+geometry_cache = BoardGeometryCache()
+
+def open_image(chessboard_img):
+    """ chessboard_img = file path, raw image bytes, file-like object,
+        PIL image or numpy array of pixels (HxW or HxWx3, uint8)
+        Returns a PIL image
+    """
+    if isinstance(chessboard_img, PIL.Image.Image):
+        return chessboard_img
+    if isinstance(chessboard_img, np.ndarray):
+        return PIL.Image.fromarray(chessboard_img)
+    if isinstance(chessboard_img, (bytes, bytearray, memoryview)):
+        return PIL.Image.open(BytesIO(chessboard_img))
+    return PIL.Image.open(chessboard_img)
+
+def crop_to_chessboard(img, detect_corners=False):
+    """ img = PIL image
+        detect_corners = true/false for whether to look for a board in
+        square images too, images that aren't square are always searched
+
+        Returns a tuple of (image cropped to the chessboard found in it,
+        [left, top, right, bottom] corners, localization score). The image
+        is returned whole with corners None if it wasn't searched or no
+        board was found
+    """
+    width, height = img.size
+    if not detect_corners and abs(1 - width / height) <= 0.05:
+        return img, None, 0.
+    # Only images that are searched are timed, so square ones don't hide
+    # the cost of locating the board
+    with metrics.timed('detect'), \
+            tracing.span('locate_chessboard', width=width, height=height) as span:
+        corners, score = geometry_cache.locate(np.asarray(img.convert('L')))
+        span.set(score=float(score))
+    if corners is None or score < MIN_BOARD_SCORE:
+        return img, None, score
+    return img.crop(tuple(int(c) for c in corners)), corners, score
+
+def _decode(chessboard_img, use_grayscale=False, detect_corners=False):
+    """ chessboard_img = chessboard image, anything accepted by open_image
+        Returns a PIL image, in 'L' mode if it was decoded straight to
+        luminance, otherwise 'RGB'.
+
+        JPEGs that won't be searched for a board are decoded at the
+        smallest DCT scale (1/2, 1/4 or 1/8) still at least DRAFT_SIDE px,
+        and to the luminance channel only when use_grayscale is set, instead
+        of decoding every full size RGB pixel just to resample it
+    """
+    img = open_image(chessboard_img)
+    width, height = img.size
+    if (img.format == 'JPEG' and not detect_corners and
+            abs(1 - width / height) <= 0.05):
+        img.draft('L' if use_grayscale else 'RGB', (DRAFT_SIDE, DRAFT_SIDE))
+        if img.mode == 'L' and use_grayscale:
+            return img
+    return img.convert('RGB')
+
+def _get_resized_chessboard(chessboard_img, use_grayscale=False, detect_corners=False):
+    """ chessboard_img = chessboard image, anything accepted by open_image
+        Returns a 256x256 image of a chessboard (32x32 per tile), in 'L'
+        mode if it was decoded to luminance (see _decode), otherwise 'RGB'
+    """
+    with metrics.timed('decode'), tracing.span('decode') as span:
+        img_data = _decode(chessboard_img, use_grayscale, detect_corners)
+        span.set(width=img_data.width, height=img_data.height)
+    img_data, _, _ = crop_to_chessboard(img_data, detect_corners)
+    return _resize_chessboard(img_data)
+
+def _resize_chessboard(img):
+    """ Returns the PIL image of a chessboard resized to 256x256 (32x32 per tile) """
+    return img.resize([256, 256], PIL.Image.BILINEAR)
+
+def _chessboard_array(img_data, use_grayscale=True):
+    """ img_data = 256x256 PIL image of a chessboard
+        Returns a 256x256x1 (grayscale) or 256x256x3 (RGB) uint8 array
+    """
+    if use_grayscale and img_data.mode != 'L':
+        img_data = img_data.convert('L', GRAYSCALE_MATRIX)
+    chessboard_256x256_img = np.asarray(img_data, dtype=np.uint8)
+    if use_grayscale:
+        chessboard_256x256_img = chessboard_256x256_img[:, :, np.newaxis]
+    return chessboard_256x256_img
+
+def _get_chessboard_array(chessboard_img, use_grayscale=True, detect_corners=False):
+    """ chessboard_img = chessboard image, anything accepted by open_image
+        Returns a 256x256x1 (grayscale) or 256x256x3 (RGB) uint8 array
+    """
+    return _chessboard_array(
+        _get_resized_chessboard(chessboard_img, use_grayscale, detect_corners), use_grayscale
+    )
+
+def _tiles_view(chessboard_256x256_img):
+    """ Returns an (8, 8, 32, 32, C) view of a 256x256xC chessboard array
+        indexed by [rank, file], without copying any pixels
     """
-    img_data = PIL.Image.open(chessboard_img_path).convert('RGB')
-    return img_data.resize([256, 256], PIL.Image.BILINEAR)
+    n_channels = chessboard_256x256_img.shape[2]
+    # [rank, row, file, col, channel] -> [rank, file, row, col, channel]
+    return chessboard_256x256_img.reshape(8, 32, 8, 32, n_channels) \
+        .transpose(0, 2, 1, 3, 4)
 
-def get_chessboard_tiles(chessboard_img_path, use_grayscale=True):
-    """ chessboard_img_path = path to a chessboard image
+def _tiles_array(chessboard_256x256_img):
+    """ Returns the (64, 32, 32, C) float32 tiles scaled to [0, 1] of a
+        256x256xC uint8 chessboard array
+    """
+    tiles = _tiles_view(chessboard_256x256_img)
+    # 64 tiles in order from top-left to bottom-right (A8, B8, ..., G1, H1)
+    tiles = tiles.reshape(64, 32, 32, tiles.shape[-1])
+    # Same uint8 -> float32 scaling as tf.image.convert_image_dtype
+    return tiles.astype(np.float32) * np.float32(1. / 255)
+
+def get_chessboard_tiles_array(chessboard_img, use_grayscale=True, detect_corners=False):
+    """ chessboard_img = chessboard image, anything accepted by open_image
+        use_grayscale = true/false for whether to return tiles in grayscale
+        detect_corners = true/false for whether to crop square images to
+        the board found in them too (see crop_to_chessboard)
+
+        Returns a (64, 32, 32, C) float32 array of tiles scaled to [0, 1],
+        C = 1 for grayscale, 3 for RGB
+    """
+    with tracing.span('get_chessboard_tiles'):
+        return _tiles_array(_get_chessboard_array(chessboard_img, use_grayscale, detect_corners))
+
+def get_chessboard_tiles(chessboard_img, use_grayscale=True):
+    """ chessboard_img = chessboard image, anything accepted by open_image
         use_grayscale = true/false for whether to return tiles in grayscale
 
         Returns a list (length 64) of 32x32 image data
     """
-    img_data = _get_resized_chessboard(chessboard_img_path)
+    with tracing.span('get_chessboard_tiles'):
+        chessboard_256x256_img = _get_chessboard_array(chessboard_img, use_grayscale)
+    tiles = _tiles_view(chessboard_256x256_img).reshape(64, 32, 32, -1)
     if use_grayscale:
-        img_data = img_data.convert('L', (0.2989, 0.5870, 0.1140, 0))
-    chessboard_256x256_img = np.asarray(img_data, dtype=np.uint8)
+        tiles = np.repeat(tiles, 3, axis=3)
     # 64 tiles in order from top-left to bottom-right (A8, B8, ..., G1, H1)
-    tiles = [None] * 64
-    for rank in range(8): # rows/ranks (numbers)
-        for file in range(8): # columns/files (letters)
-            sq_i = rank * 8 + file
-            tile = np.zeros([32, 32, 3], dtype=np.uint8)
-            for i in range(32):
-                for j in range(32):
-                    if use_grayscale:
-                        tile[i, j] = chessboard_256x256_img[
-                            rank*32 + i,
-                            file*32 + j,
-                        ]
-                    else:
-                        tile[i, j] = chessboard_256x256_img[
-                            rank*32 + i,
-                            file*32 + j,
-                            :,
-                        ]
-            tiles[sq_i] = PIL.Image.fromarray(tile, 'RGB')
-    return tiles
+    return [PIL.Image.fromarray(np.ascontiguousarray(tile), 'RGB') for tile in tiles]
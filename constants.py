@@ -1,10 +1,13 @@
+import os
+
 # Each FEN char represents of the contents of a chessboard tile
 FEN_CHARS = '1RNBQKPrnbqkp'
 
 # Base directory for auto-generated chessboard images
 CHESSBOARDS_DIR = './images/chessboards'
 
-# Try to detect the corners of a chessboard in the image
+# Try to detect the corners of a chessboard in every image. Images that
+# aren't square are always searched for a board
 DETECT_CORNERS = False
 
 # Base directory for 32x32 PNG chessboard squares for
@@ -16,3 +19,28 @@ USE_GRAYSCALE = True
 
 # Where neural network model/weights are stored
 NN_MODEL_PATH = './nn'
+
+# TFLite exports of the neural network, by quantization (see tflite_model.py)
+NN_TFLITE_MODEL_PATHS = {
+    'float16': './nn/model_float16.tflite',
+    'int8': './nn/model_int8.tflite',
+}
+
+# Weights of the neural network for the NumPy backend (see numpy_model.py)
+NN_NUMPY_MODEL_PATH = './nn/model_weights.npz'
+
+# Probabilities of this many distinct tiles are kept and reused by later
+# images, so common piece sprites skip the model. 0 turns the cache off
+TILE_CACHE_SIZE = int(os.environ.get('TILE_CACHE_SIZE', 0))
+
+# Tiles the network is less sure of than this are classified again with a
+# few small augmentations and the probabilities averaged. 0 turns it off
+REFINE_TILE_CONFIDENCE = float(os.environ.get('REFINE_TILE_CONFIDENCE', 0))
+
+# Edge threshold below which tiles are labelled empty without running the
+# network, tuned by empty_cascade.py. The cascade is off if it's missing
+NN_EMPTY_CASCADE_PATH = './nn/empty_cascade.json'
+
+# Which model to run: 'savedmodel' (NN_MODEL_PATH), 'tflite-float16',
+# 'tflite-int8' or 'numpy' (NN_NUMPY_MODEL_PATH)
+NN_BACKEND = os.environ.get('NN_BACKEND', 'savedmodel')
@@ -0,0 +1,85 @@
+#!/usr/bin/env python3
+
+# Renders prediction logs (see prediction_log.py) as an HTML debug report
+# usage: debug_report.py [log_file ...]
+
+import sys
+import json
+import os
+from glob import glob
+
+OUT_FILE = "debug.html"
+
+def _confidence_color(confidence):
+    if confidence >= 0.999:
+        return "#00C176"
+    elif confidence > 0.99:
+        return "#88C100"
+    elif confidence > 0.95:
+        return "#FABE28"
+    elif confidence > 0.9:
+        return "#FF8A00"
+    else:
+        return "#FF003C"
+
+def _prediction_html(chessboard_img_path, fen, predictions, confidence):
+    confidence_color = _confidence_color(confidence)
+    html = '<h3>{}</h3>'.format(chessboard_img_path)
+    html += '<div class="boards-row">'
+    html += '<img src="{}" />'.format(chessboard_img_path)
+    html += '<img src="http://www.fen-to-image.com/image/32/{}"/>'.format(fen)
+    html += '<div class="predictions-matrix">'
+    for i in range(8):
+        html += '<div>'
+        for j in range(8):
+            c = predictions[i*8 + j]
+            html += '<div class="prediction" style="color: {}">{}</div>'.format(
+                _confidence_color(c),
+                format(c, '.3f')
+            )
+        html += '</div>'
+    html += '</div>'
+    html += '</div>'
+    html += '<br />'
+    html += '<a href="https://lichess.org/editor/{}" target="_blank">{}</a>'.format(
+        fen, fen
+    )
+    html += '<div style="color: {}">{}</div>'.format(confidence_color, confidence)
+    html += '<br /><br />'
+    return html
+
+def _read_records(log_paths):
+    for log_path in log_paths:
+        with open(log_path, encoding='utf-8') as f:
+            for line in f:
+                if line.strip():
+                    yield json.loads(line)
+
+def rotated_log_paths(log_path):
+    """ log_path and its rotated backups (log_path.1, log_path.2 ...),
+        oldest first
+    """
+    backups = [p for p in glob('{}.*'.format(log_path)) if p.rsplit('.', 1)[1].isdigit()]
+    backups.sort(key=lambda p: int(p.rsplit('.', 1)[1]), reverse=True)
+    return backups + ([log_path] if os.path.exists(log_path) else [])
+
+def save_html(log_paths, out_file=OUT_FILE):
+    """ Writes every prediction in log_paths to out_file """
+    html = '<link rel="stylesheet" href="./web/style.css" />'
+    for record in _read_records(log_paths):
+        html += _prediction_html(
+            record['image'], record['fen'],
+            [p for _, p in record['tiles']], record['confidence']
+        )
+    with open(out_file, "w") as f:
+        f.write(html)
+
+if __name__ == '__main__':
+    log_paths = []
+    for log_path in sys.argv[1:] or ['predictions.jsonl']:
+        log_paths += rotated_log_paths(log_path)
+    if not log_paths:
+        print("No prediction logs found")
+        exit(1)
+    save_html(log_paths)
+    print("Saved {} to {}".format(', '.join(log_paths), OUT_FILE))
@@ -0,0 +1,161 @@
+#!/usr/bin/env python3
+
+# Cheap first stage in front of the tile classifier: squares whose centre
+# has almost no edges are labelled empty without running the network.
+# The edge threshold is tuned on the test split of train.get_dataset so that
+# no occupied test tile is mistaken for an empty one
+#
+# usage: empty_cascade.py [--margin M] [--backend BACKEND] [--report]
+
+import os
+import json
+import argparse
+from timeit import default_timer as timer
+
+import numpy as np
+
+from constants import NN_EMPTY_CASCADE_PATH, FEN_CHARS
+
+# Pixels at the edge of a tile that are ignored, where board lines,
+# coordinates and the neighbouring square bleed in
+BORDER_PX = 4
+
+# Fraction of the lowest edge energy of an occupied test tile used as the
+# threshold, so tiles slightly flatter than any seen still go to the network
+MARGIN = 0.8
+
+def edge_energy(tiles):
+    """ Given an (N, 32, 32, C) array of tiles scaled to [0, 1], returns
+        the mean absolute difference between neighbouring pixels in the
+        centre of each tile, 0 for a flat square
+    """
+    centre = tiles[:, BORDER_PX:-BORDER_PX, BORDER_PX:-BORDER_PX, :]
+    return (
+        np.abs(np.diff(centre, axis=1)).mean(axis=(1, 2, 3)) +
+        np.abs(np.diff(centre, axis=2)).mean(axis=(1, 2, 3))
+    )
+
+class EmptySquareFilter:
+    """ Labels tiles with an edge energy below max_edge_energy as empty,
+        with probabilities that the network gave such tiles on average
+    """
+    def __init__(self, max_edge_energy, empty_probability):
+        self.max_edge_energy = max_edge_energy
+        self.empty_probability = empty_probability
+        self.probabilities = np.full(
+            len(FEN_CHARS), (1 - empty_probability) / (len(FEN_CHARS) - 1), dtype=np.float32
+        )
+        self.probabilities[FEN_CHARS.index('1')] = empty_probability
+
+    def is_empty(self, tiles):
+        """ Returns a boolean array, True for tiles that are surely empty """
+        return edge_energy(tiles) < self.max_edge_energy
+
+    def save(self, path=NN_EMPTY_CASCADE_PATH):
+        with open(path, 'w') as f:
+            json.dump({
+                'max_edge_energy': float(self.max_edge_energy),
+                'empty_probability': float(self.empty_probability),
+            }, f, indent=1)
+
+def load(path=NN_EMPTY_CASCADE_PATH):
+    """ Returns the EmptySquareFilter saved at path, None if there isn't one """
+    if not os.path.exists(path):
+        return None
+    with open(path) as f:
+        params = json.load(f)
+    return EmptySquareFilter(params['max_edge_energy'], params['empty_probability'])
+
+def tune(tiles, labels, probabilities, margin=MARGIN):
+    """ Given test tiles, their labels and the network's probabilities for
+        them, returns an EmptySquareFilter that labels none of the occupied
+        tiles empty
+    """
+    energy = edge_energy(tiles)
+    empty = labels == FEN_CHARS.index('1')
+    if empty.all():
+        raise ValueError("No occupied tiles to tune the threshold on")
+    max_edge_energy = energy[~empty].min() * margin
+    flat = energy < max_edge_energy
+    if flat.any():
+        empty_probability = probabilities[flat, FEN_CHARS.index('1')].mean()
+    else:
+        empty_probability = 1.
+    return EmptySquareFilter(max_edge_energy, empty_probability)
+
+def report(tiles, labels, probabilities, empty_filter, classify):
+    """ Prints accuracy and time of the network alone and of the cascade
+        on the test tiles. Returns (network accuracy, cascade accuracy)
+    """
+    t = timer()
+    classify(tiles)
+    network_s = timer() - t
+
+    t = timer()
+    flat = empty_filter.is_empty(tiles)
+    if not flat.all():
+        classify(tiles[~flat])
+    cascade_s = timer() - t
+
+    network_predictions = probabilities.argmax(axis=1)
+    cascade_predictions = network_predictions.copy()
+    cascade_predictions[flat] = FEN_CHARS.index('1')
+    network_accuracy = np.mean(network_predictions == labels)
+    cascade_accuracy = np.mean(cascade_predictions == labels)
+    empty = labels == FEN_CHARS.index('1')
+
+    print('Edge energy threshold {:.4f}: {} of {} test tiles ({} of {} empty ones) '
+          'skip the network'.format(
+              empty_filter.max_edge_energy, flat.sum(), len(tiles),
+              np.sum(flat & empty), empty.sum(),
+          ))
+    print('{:<10} {:>9} {:>8} {:>12} {:>8}'.format(
+        'mode', 'accuracy', 'errors', 'ms/1k tiles', 'speedup'
+    ))
+    for mode, accuracy, predictions, seconds in [
+        ('network', network_accuracy, network_predictions, network_s),
+        ('cascade', cascade_accuracy, cascade_predictions, cascade_s),
+    ]:
+        print('{:<10} {:>9.4%} {:>8} {:>12.1f} {:>7.2f}x'.format(
+            mode, accuracy, np.sum(predictions != labels),
+            seconds / len(tiles) * 1e6, network_s / seconds,
+        ))
+    return network_accuracy, cascade_accuracy
+
+if __name__ == '__main__':
+    parser = argparse.ArgumentParser()
+    parser.add_argument("--margin", type=float, default=MARGIN,
+                        help="Fraction of the flattest occupied test tile's edge energy to use as the threshold")
+    parser.add_argument("-b", "--backend",
+                        help="Backend of the network to compare against (default NN_BACKEND)")
+    parser.add_argument("--report", action="store_true",
+                        help="Only report on the saved threshold, don't tune it")
+    args = parser.parse_args()
+
+    import recognize
+    from train import get_dataset
+    if args.backend:
+        recognize.backend = args.backend
+    _, (test_images, test_labels) = get_dataset()
+    if not len(test_images):
+        print("No test images found!")
+        exit(1)
+    test_images = test_images.astype(np.float32)
+    test_probabilities = recognize.predict_tiles(test_images)
+
+    if args.report:
+        empty_filter = load()
+        if empty_filter is None:
+            print("No threshold saved at {}".format(NN_EMPTY_CASCADE_PATH))
+            exit(1)
+    else:
+        empty_filter = tune(test_images, test_labels, test_probabilities, args.margin)
+    network_accuracy, cascade_accuracy = report(
+        test_images, test_labels, test_probabilities, empty_filter, recognize.predict_tiles
+    )
+    if cascade_accuracy < network_accuracy:
+        print('!! The cascade is less accurate than the network alone')
+        exit(1)
+    if not args.report:
+        empty_filter.save()
+        print('Saved threshold to {}'.format(NN_EMPTY_CASCADE_PATH))
@@ -0,0 +1,155 @@
+#!/usr/bin/env python3
+
+# Runs chessboard recognition off the asyncio event loop, classifying
+# concurrent requests together in a single model call
+
+import time
+import asyncio
+from concurrent.futures import ThreadPoolExecutor
+
+import numpy as np
+
+import prediction_log
+import tracing
+from recognize import (
+    _chessboard_tiles_img_data, classify_tiles, predictions_from_probabilities,
+    chessboard_from_predictions, unique_tiles_per_board,
+)
+
+# Seconds to wait for more requests before running a batch
+BATCH_WINDOW = 0.02
+
+# Maximum number of chessboards classified in one model call
+MAX_BATCH_SIZE = 16
+
+def predict_chessboard_batch(chessboard_imgs):
+    """ Given a list of chessboard images (file paths, bytes, file-like objects
+        or numpy arrays), classifies the tiles of all
+        chessboards with a single model call.
+
+        Returns a list with a (FEN string, confidence) tuple for each image,
+        or the exception raised while reading that image
+    """
+    results = [None] * len(chessboard_imgs)
+    tiles = []
+    with tracing.span('predict_chessboard_batch', batch_size=len(chessboard_imgs)):
+        for i, chessboard_img in enumerate(chessboard_imgs):
+            try:
+                tiles.append((i, _chessboard_tiles_img_data(chessboard_img)))
+            except Exception as e:
+                results[i] = e
+        if not tiles:
+            return results
+        t0 = time.perf_counter()
+        tile_stats = {}
+        probabilities = classify_tiles(np.concatenate([t for _, t in tiles]), tile_stats)
+        inference_s = time.perf_counter() - t0
+    unique_tiles = unique_tiles_per_board(tile_stats['keys'])
+    for n, (i, _) in enumerate(tiles):
+        predictions = predictions_from_probabilities(probabilities[n*64:(n+1)*64])
+        results[i] = chessboard_from_predictions(predictions)
+        if prediction_log.is_enabled():
+            img = chessboard_imgs[i]
+            prediction_log.log_prediction(
+                img if isinstance(img, str) else 'in-memory image',
+                results[i][0], results[i][1], predictions,
+                {'inference_s': inference_s}, unique_tiles[n],
+            )
+    return results
+
+class InferenceService:
+    """ Awaitable chessboard recognition.
+
+        Requests arriving within batch_window seconds of each other are
+        collected (up to max_batch_size) and classified together on a
+        background thread, so the event loop keeps serving other updates.
+    """
+    def __init__(self, batch_window=BATCH_WINDOW, max_batch_size=MAX_BATCH_SIZE):
+        self.batch_window = batch_window
+        self.max_batch_size = max_batch_size
+        # One thread, so the model is only ever called from one place
+        self._executor = ThreadPoolExecutor(
+            max_workers=1, thread_name_prefix='inference'
+        )
+        self._queue = None
+        self._worker = None
+        self.num_requests = 0
+        self.num_batches = 0
+
+    async def predict(self, chessboard_img):
+        """ Given a chessboard image (file path, bytes, file-like object
+            or numpy array), Returns a tuple of (FEN string, confidence)
+        """
+        loop = asyncio.get_running_loop()
+        if self._queue is None:
+            self._queue = asyncio.Queue()
+        if self._worker is None or self._worker.done():
+            self._worker = loop.create_task(self._run())
+        future = loop.create_future()
+        self.num_requests += 1
+        await self._queue.put((chessboard_img, future, tracing.current_traces()))
+        with tracing.span('inference_queue'):
+            return await future
+
+    async def predict_batch(self, chessboard_imgs):
+        """ Given a list of chessboard images, classifies all of them in one
+            model call right away, without waiting for other requests.
+
+            Returns a list with a (FEN string, confidence) tuple for each
+            image, or the exception raised while reading that image
+        """
+        loop = asyncio.get_running_loop()
+        self.num_requests += len(chessboard_imgs)
+        self.num_batches += 1
+        return await loop.run_in_executor(
+            self._executor, tracing.run_traced, tracing.current_traces(),
+            predict_chessboard_batch, list(chessboard_imgs),
+        )
+
+    def queue_depth(self):
+        """ Number of images waiting for the next batch """
+        return 0 if self._queue is None else self._queue.qsize()
+
+    async def _next_batch(self):
+        loop = asyncio.get_running_loop()
+        batch = [await self._queue.get()]
+        deadline = loop.time() + self.batch_window
+        while len(batch) < self.max_batch_size:
+            timeout = deadline - loop.time()
+            if timeout <= 0:
+                break
+            try:
+                batch.append(await asyncio.wait_for(self._queue.get(), timeout))
+            except asyncio.TimeoutError:
+                break
+        # Callers that gave up while waiting don't need a prediction
+        return [job for job in batch if not job[1].done()]
+
+    async def _run(self):
+        loop = asyncio.get_running_loop()
+        while True:
+            batch = await self._next_batch()
+            if not batch:
+                continue
+            self.num_batches += 1
+            # Spans of the batch are recorded in the traces of all its requests
+            traces = [trace for _, _, job_traces in batch for trace in job_traces]
+            try:
+                results = await loop.run_in_executor(
+                    self._executor, tracing.run_traced, traces,
+                    predict_chessboard_batch, [img for img, _, _ in batch],
+                )
+            except Exception as e:
+                results = [e] * len(batch)
+            for (_, future, _), result in zip(batch, results):
+                if future.done():
+                    continue
+                if isinstance(result, Exception):
+                    future.set_exception(result)
+                else:
+                    future.set_result(result)
+
+    def close(self):
+        if self._worker is not None:
+            self._worker.cancel()
+        self._executor.shutdown(wait=False)
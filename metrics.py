@@ -0,0 +1,183 @@
+#!/usr/bin/env python3
+
+# Counters, gauges and histograms of the recognition pipeline, served by the
+# bot's web server at /metrics in the Prometheus text exposition format.
+# Recording a value is a lock and a few additions, cheap enough to leave on
+
+import time
+import bisect
+import threading
+from contextlib import contextmanager
+
+# Upper bounds in seconds of the stage latency buckets
+LATENCY_BUCKETS = (0.005, 0.01, 0.025, 0.05, 0.1, 0.25, 0.5, 1, 2.5, 5, 10)
+
+# Upper bounds of the board confidence buckets, the bot's warning is at 0.85
+CONFIDENCE_BUCKETS = (0.1, 0.25, 0.5, 0.75, 0.85, 0.9, 0.95, 0.99, 1)
+
+def _format_labels(labels):
+    if not labels:
+        return ''
+    return '{' + ','.join(
+        '{}="{}"'.format(k, str(v).replace('\\', '\\\\').replace('"', '\\"'))
+        for k, v in labels
+    ) + '}'
+
+def _format_value(value):
+    if value == float('inf'):
+        return '+Inf'
+    if isinstance(value, int):
+        return str(value)
+    return repr(float(value))
+
+class _Metric:
+    def __init__(self, name, help_text, metric_type):
+        self.name = name
+        self.help = help_text
+        self.type = metric_type
+        self._lock = threading.Lock()
+        self._values = {}  # sorted label items -> value
+
+    def _samples(self):
+        """ Returns a list of (name suffix, labels, value) """
+        with self._lock:
+            return [('', labels, value) for labels, value in self._values.items()]
+
+    def render(self):
+        lines = [
+            '# HELP {} {}'.format(self.name, self.help),
+            '# TYPE {} {}'.format(self.name, self.type),
+        ]
+        for suffix, labels, value in self._samples():
+            lines.append('{}{}{} {}'.format(
+                self.name, suffix, _format_labels(labels), _format_value(value)
+            ))
+        return lines
+
+class Counter(_Metric):
+    """ Value that only goes up, per set of labels """
+    def __init__(self, name, help_text):
+        super().__init__(name, help_text, 'counter')
+
+    def inc(self, amount=1, **labels):
+        key = tuple(sorted(labels.items()))
+        with self._lock:
+            self._values[key] = self._values.get(key, 0) + amount
+
+class Gauge(_Metric):
+    """ Value that can go up and down, per set of labels """
+    def __init__(self, name, help_text):
+        super().__init__(name, help_text, 'gauge')
+
+    def set(self, value, **labels):
+        with self._lock:
+            self._values[tuple(sorted(labels.items()))] = value
+
+    def inc(self, amount=1, **labels):
+        key = tuple(sorted(labels.items()))
+        with self._lock:
+            self._values[key] = self._values.get(key, 0) + amount
+
+    def dec(self, amount=1, **labels):
+        self.inc(-amount, **labels)
+
+class Histogram(_Metric):
+    """ Counts of observed values at or below each bucket bound, with their
+        sum and count, per set of labels
+    """
+    def __init__(self, name, help_text, buckets):
+        super().__init__(name, help_text, 'histogram')
+        self.buckets = tuple(buckets)
+
+    def observe(self, value, **labels):
+        key = tuple(sorted(labels.items()))
+        i = bisect.bisect_left(self.buckets, value)
+        with self._lock:
+            counts = self._values.get(key)
+            if counts is None:
+                # One count per bucket, then +Inf, sum
+                counts = self._values[key] = [0] * (len(self.buckets) + 1) + [0.]
+            counts[i] += 1
+            counts[-1] += value
+
+    def _samples(self):
+        with self._lock:
+            values = [(labels, list(counts)) for labels, counts in self._values.items()]
+        samples = []
+        for labels, counts in values:
+            cumulative = 0
+            for bound, count in zip(self.buckets + (float('inf'),), counts):
+                cumulative += count
+                samples.append(('_bucket', labels + (('le', _format_value(bound)),), cumulative))
+            samples.append(('_sum', labels, counts[-1]))
+            samples.append(('_count', labels, cumulative))
+        return samples
+
+stage_seconds = Histogram(
+    'chessbot_stage_seconds', 'Seconds spent in each stage of recognizing a photo',
+    LATENCY_BUCKETS,
+)
+requests_total = Counter('chessbot_requests_total', 'Photos received')
+errors_total = Counter('chessbot_errors_total', 'Photos that failed, by stage')
+in_flight = Gauge('chessbot_in_flight', 'Photos being handled right now')
+queue_depth = Gauge('chessbot_queue_depth', 'Images waiting for the model')
+model_load_seconds = Gauge('chessbot_model_load_seconds', 'Seconds it took to load the model')
+resident_memory_bytes = Gauge('chessbot_resident_memory_bytes', 'Resident memory of the bot process')
+tiles_total = Counter(
+    'chessbot_tiles_total',
+    'Tiles by how they were classified: by the model, labelled empty before it, '
+    'copied from an identical tile of the batch or from the tile cache',
+)
+refined_tiles_total = Counter(
+    'chessbot_refined_tiles_total', 'Low confidence tiles classified again with augmentations'
+)
+confidence = Histogram(
+    'chessbot_confidence', 'Confidence of recognized boards', CONFIDENCE_BUCKETS
+)
+
+# Shown as 0 before anything happens, rather than missing
+requests_total.inc(0)
+in_flight.set(0)
+
+_metrics = [
+    stage_seconds, requests_total, errors_total, in_flight, queue_depth,
+    model_load_seconds, resident_memory_bytes, tiles_total, refined_tiles_total,
+    confidence,
+]
+
+def observe_stage(stage, seconds):
+    stage_seconds.observe(seconds, stage=stage)
+
+@contextmanager
+def timed(stage):
+    """ Records the seconds spent in the with block as stage, and counts an
+        error of stage if it raises
+    """
+    t0 = time.perf_counter()
+    try:
+        yield
+    except Exception:
+        errors_total.inc(stage=stage)
+        raise
+    finally:
+        stage_seconds.observe(time.perf_counter() - t0, stage=stage)
+
+def _resident_memory_bytes():
+    try:
+        with open('/proc/self/status') as f:
+            for line in f:
+                if line.startswith('VmRSS:'):
+                    return int(line.split()[1]) * 1024
+    except OSError:
+        pass
+    return None
+
+def render():
+    """ Returns all metrics in the Prometheus text exposition format """
+    rss = _resident_memory_bytes()
+    if rss is not None:
+        resident_memory_bytes.set(rss)
+    lines = []
+    for metric in _metrics:
+        lines.extend(metric.render())
+    return '\n'.join(lines) + '\n'
@@ -0,0 +1,113 @@
+#!/usr/bin/env python3
+
+# Runs the tile classifier from train.create_model with plain NumPy, so the
+# bot can serve predictions without importing TensorFlow
+
+import os
+import argparse
+
+import numpy as np
+from numpy.lib.stride_tricks import sliding_window_view
+
+from constants import NN_MODEL_PATH, NN_NUMPY_MODEL_PATH, USE_GRAYSCALE
+
+# Layers of train.create_model that have weights, in order
+CONV_LAYERS = ['conv_0', 'conv_1', 'conv_2']
+DENSE_LAYERS = ['dense_0', 'dense_1']
+
+# Largest allowed difference from the Keras model's probabilities
+MAX_DIFFERENCE = 1e-5
+
+def export_weights(model, weights_path=NN_NUMPY_MODEL_PATH):
+    """ Saves the kernels and biases of a train.create_model network to .npz """
+    weighted_layers = [layer for layer in model.layers if layer.get_weights()]
+    names = CONV_LAYERS + DENSE_LAYERS
+    if len(weighted_layers) != len(names):
+        raise ValueError("Expected {} layers with weights, got {}".format(
+            len(names), len(weighted_layers)
+        ))
+    arrays = {}
+    for name, layer in zip(names, weighted_layers):
+        kernel, bias = layer.get_weights()
+        arrays[name + '_kernel'] = kernel.astype(np.float32)
+        arrays[name + '_bias'] = bias.astype(np.float32)
+    np.savez_compressed(weights_path, **arrays)
+
+def _conv2d_relu(x, kernel, bias):
+    """ 'valid' 3x3 convolution + ReLU over an (N, H, W, C) batch, as a
+        single matrix multiply of all image patches (im2col)
+    """
+    kh, kw, c_in, c_out = kernel.shape
+    # (N, H', W', C, kh, kw) view, no copy
+    patches = sliding_window_view(x, (kh, kw), axis=(1, 2))
+    n, h, w = patches.shape[:3]
+    # Match the kernel's (kh, kw, C) layout, this is where the copy happens
+    patches = patches.transpose(0, 1, 2, 4, 5, 3).reshape(n * h * w, kh * kw * c_in)
+    out = patches @ kernel.reshape(kh * kw * c_in, c_out)
+    out += bias
+    np.maximum(out, 0, out=out)
+    return out.reshape(n, h, w, c_out)
+
+def _max_pool_2x2(x):
+    n, h, w, c = x.shape
+    x = x[:, :h // 2 * 2, :w // 2 * 2, :]
+    return x.reshape(n, h // 2, 2, w // 2, 2, c).max(axis=(2, 4))
+
+def _softmax(x):
+    x = x - x.max(axis=1, keepdims=True)
+    np.exp(x, out=x)
+    x /= x.sum(axis=1, keepdims=True)
+    return x
+
+class NumpyModel:
+    """ NumPy forward pass of the train.create_model network.
+        Called like a Keras model: model(batch) -> (N, 13) probabilities
+    """
+    def __init__(self, weights_path=NN_NUMPY_MODEL_PATH):
+        with np.load(weights_path) as weights:
+            self.weights = {name: weights[name] for name in weights.files}
+
+    def __call__(self, batch, training=False):
+        w = self.weights
+        x = np.asarray(batch, dtype=np.float32)
+        x = _conv2d_relu(x, w['conv_0_kernel'], w['conv_0_bias'])
+        x = _max_pool_2x2(x)
+        x = _conv2d_relu(x, w['conv_1_kernel'], w['conv_1_bias'])
+        x = _max_pool_2x2(x)
+        x = _conv2d_relu(x, w['conv_2_kernel'], w['conv_2_bias'])
+        # Same row-major (H, W, C) order as keras Flatten
+        x = x.reshape(x.shape[0], -1)
+        x = x @ w['dense_0_kernel'] + w['dense_0_bias']
+        np.maximum(x, 0, out=x)
+        x = x @ w['dense_1_kernel'] + w['dense_1_bias']
+        return _softmax(x)
+
+def _check_against_keras(keras_model, numpy_model, n_tiles=256):
+    """ Returns the largest absolute difference between the probabilities of
+        both models on random tiles
+    """
+    n_channels = 1 if USE_GRAYSCALE else 3
+    np.random.seed(1)
+    tiles = np.random.rand(n_tiles, 32, 32, n_channels).astype(np.float32)
+    expected = np.asarray(keras_model(tiles, training=False))
+    return np.abs(numpy_model(tiles) - expected).max()
+
+if __name__ == '__main__':
+    parser = argparse.ArgumentParser()
+    parser.add_argument("--benchmark-only", action="store_true",
+                        help="Skip exporting weights, only run the startup benchmark")
+    args = parser.parse_args()
+    if not args.benchmark_only:
+        from tensorflow.keras import models
+        keras_model = models.load_model(NN_MODEL_PATH)
+        export_weights(keras_model)
+        print('Saved {} ({:.1f} KB)'.format(
+            NN_NUMPY_MODEL_PATH, os.path.getsize(NN_NUMPY_MODEL_PATH) / 1024
+        ))
+        max_diff = _check_against_keras(keras_model, NumpyModel())
+        print('Largest difference from the Keras model: {:.2e}'.format(max_diff))
+        if max_diff > MAX_DIFFERENCE:
+            print('!! Larger than the allowed {:.0e}'.format(MAX_DIFFERENCE))
+            exit(1)
+    from benchmark import benchmark_startup
+    benchmark_startup(['savedmodel', 'numpy'])
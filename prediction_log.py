@@ -0,0 +1,67 @@
+#!/usr/bin/env python3
+
+# Optional JSONL log of predictions, written by a background thread so the
+# recognition path never waits on file I/O. Off unless enable() is called.
+# Render it as HTML with debug_report.py
+
+import json
+import time
+import queue
+import atexit
+import logging
+import logging.handlers
+
+# Rotate the log after this many bytes, keeping BACKUP_COUNT old files
+MAX_BYTES = 10 * 1024 * 1024
+BACKUP_COUNT = 5
+
+_logger = logging.getLogger('predictions')
+_logger.propagate = False
+_listener = None
+
+def enable(path, max_bytes=MAX_BYTES, backup_count=BACKUP_COUNT):
+    """ Starts logging predictions to path """
+    global _listener
+    if _listener is not None:
+        return
+    handler = logging.handlers.RotatingFileHandler(
+        path, maxBytes=max_bytes, backupCount=backup_count, encoding='utf-8'
+    )
+    handler.setFormatter(logging.Formatter('%(message)s'))
+    log_queue = queue.SimpleQueue()
+    _logger.addHandler(logging.handlers.QueueHandler(log_queue))
+    _logger.setLevel(logging.INFO)
+    _listener = logging.handlers.QueueListener(log_queue, handler)
+    _listener.start()
+    atexit.register(disable)
+
+def disable():
+    """ Writes out buffered records and stops logging """
+    global _listener
+    if _listener is None:
+        return
+    _listener.stop()
+    for handler in list(_logger.handlers):
+        _logger.removeHandler(handler)
+    _listener = None
+
+def is_enabled():
+    return _listener is not None
+
+def log_prediction(image, fen, confidence, predictions, timings=None, unique_tiles=None):
+    """ image = label of the image (file path or description)
+        predictions = 64 (FEN char, probability) tuples, a8 ... h1
+        timings = dict of seconds spent in each step
+        unique_tiles = number of distinct tiles of the board, if known
+    """
+    if _listener is None:
+        return
+    _logger.info(json.dumps({
+        'time': time.time(),
+        'image': image,
+        'fen': fen,
+        'confidence': float(confidence),
+        'tiles': [[c, round(float(p), 6)] for c, p in predictions],
+        'timings': timings or {},
+        'unique_tiles': unique_tiles,
+    }))
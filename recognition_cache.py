@@ -0,0 +1,168 @@
+#!/usr/bin/env python3
+
+# Cache of recognition results, so images that were already recognized
+# (forwarded screenshots, the same puzzle sent again) skip inference
+
+import time
+import sqlite3
+import hashlib
+import threading
+from collections import OrderedDict
+
+from chessboard_image import open_image
+
+# Number of results kept in memory
+MAX_ENTRIES = 1024
+
+# Seconds a result stays valid
+TTL = 7 * 24 * 3600
+
+def file_key(file_unique_id):
+    """ Key for a Telegram file, usable before downloading it """
+    return 'file:{}'.format(file_unique_id)
+
+def pixels_key(image_bytes):
+    """ Key for the decoded pixels of an image, so the same picture matches
+        whatever file it was re-encoded into
+    """
+    img = open_image(image_bytes).convert('RGB')
+    digest = hashlib.sha256()
+    digest.update('{}x{}'.format(*img.size).encode())
+    digest.update(img.tobytes())
+    return 'pixels:{}'.format(digest.hexdigest())
+
+class RecognitionCache:
+    """ Two-tier cache of (FEN string, confidence) results.
+
+        An in-memory LRU of up to max_entries results in front of an
+        optional SQLite database at db_path that survives restarts.
+        Results older than ttl seconds are treated as misses and removed.
+
+        model_version is prefixed to every key, so results stored by another
+        model or configuration (see recognize.model_fingerprint) are misses
+        and expire from the database
+    """
+    def __init__(self, max_entries=MAX_ENTRIES, ttl=TTL, db_path=None, model_version=''):
+        self.max_entries = max_entries
+        self.ttl = ttl
+        self.model_version = model_version
+        self._entries = OrderedDict()  # key -> (fen, confidence, created)
+        self._lock = threading.Lock()
+        self._db = None
+        if db_path:
+            self._db = sqlite3.connect(db_path, check_same_thread=False)
+            self._db.execute(
+                'CREATE TABLE IF NOT EXISTS results '
+                '(key TEXT PRIMARY KEY, fen TEXT, confidence REAL, created REAL)'
+            )
+            # Drop results that expired while the bot wasn't running
+            self._db.execute(
+                'DELETE FROM results WHERE created < ?', (time.time() - ttl,)
+            )
+            self._db.commit()
+        self.memory_hits = 0
+        self.disk_hits = 0
+        self.misses = 0
+        self.evictions = 0
+        self.expirations = 0
+
+    def _expired(self, created):
+        return time.time() - created > self.ttl
+
+    def get(self, key):
+        """ Returns the cached (FEN string, confidence) for key, or None """
+        return self.get_many([key])[0]
+
+    def get_many(self, keys):
+        """ Returns a list with the cached (FEN string, confidence) of each
+            key, or None. Looks up the keys missing from memory with a single
+            query, and removes the expired ones with a single commit.
+
+            Touches the database, so call it off the event loop
+        """
+        keys = [self._versioned(key) for key in keys]
+        results = [None] * len(keys)
+        with self._lock:
+            on_disk = {}
+            for i, key in enumerate(keys):
+                entry = self._entries.get(key)
+                if entry is not None:
+                    if not self._expired(entry[2]):
+                        self._entries.move_to_end(key)
+                        self.memory_hits += 1
+                        results[i] = entry[:2]
+                        continue
+                    del self._entries[key]
+                    self.expirations += 1
+                on_disk.setdefault(key, []).append(i)
+            if on_disk and self._db is not None:
+                rows = self._db.execute(
+                    'SELECT key, fen, confidence, created FROM results WHERE key IN ({})'.format(
+                        ', '.join('?' * len(on_disk))
+                    ), list(on_disk)
+                ).fetchall()
+                expired = []
+                for row in rows:
+                    if self._expired(row[3]):
+                        expired.append((row[0],))
+                        self.expirations += 1
+                        continue
+                    self._remember(row[0], row[1:])
+                    for i in on_disk[row[0]]:
+                        results[i] = row[1:3]
+                        self.disk_hits += 1
+                if expired:
+                    self._db.executemany('DELETE FROM results WHERE key = ?', expired)
+                    self._db.commit()
+            self.misses += sum(r is None for r in results)
+        return results
+
+    def put(self, key, fen, confidence):
+        """ Stores a result in memory and on disk """
+        self.put_many([(key, fen, confidence)])
+
+    def put_many(self, items):
+        """ Stores (key, FEN string, confidence) results in memory and on
+            disk, with a single commit.
+
+            Touches the database, so call it off the event loop
+        """
+        now = time.time()
+        rows = [
+            (self._versioned(key), fen, float(confidence), now)
+            for key, fen, confidence in items
+        ]
+        with self._lock:
+            for row in rows:
+                self._remember(row[0], row[1:])
+            if rows and self._db is not None:
+                self._db.executemany('INSERT OR REPLACE INTO results VALUES (?, ?, ?, ?)', rows)
+                self._db.commit()
+
+    def _versioned(self, key):
+        return '{}:{}'.format(self.model_version, key) if self.model_version else key
+
+    def _remember(self, key, entry):
+        """ Adds an entry to the in-memory LRU. Must hold self._lock """
+        self._entries[key] = tuple(entry)
+        self._entries.move_to_end(key)
+        while len(self._entries) > self.max_entries:
+            self._entries.popitem(last=False)
+            self.evictions += 1
+
+    def stats(self):
+        """ Returns a dict of cache counters """
+        with self._lock:
+            return {
+                'entries': len(self._entries),
+                'memory_hits': self.memory_hits,
+                'disk_hits': self.disk_hits,
+                'misses': self.misses,
+                'evictions': self.evictions,
+                'expirations': self.expirations,
+            }
+
+    def close(self):
+        if self._db is not None:
+            self._db.close()
+            self._db = None
@@ -1,147 +1,524 @@
 #!/usr/bin/env python3
 
 import sys
+import csv
+import json
+import time
+import hashlib
 from glob import glob
-from io import BytesIO
 from functools import reduce
+from collections import deque
+from concurrent.futures import ThreadPoolExecutor
 import os
 os.environ['TF_CPP_MIN_LOG_LEVEL'] = '3'
 
-import tensorflow as tf
-from tensorflow.keras import models
 import numpy as np
 
 from constants import (
-    TILES_DIR, NN_MODEL_PATH, FEN_CHARS, USE_GRAYSCALE, DETECT_CORNERS
+    TILES_DIR, NN_MODEL_PATH, NN_TFLITE_MODEL_PATHS, NN_NUMPY_MODEL_PATH,
+    NN_BACKEND, FEN_CHARS, USE_GRAYSCALE, DETECT_CORNERS, TILE_CACHE_SIZE,
+    REFINE_TILE_CONFIDENCE,
 )
 from utils import compressed_fen
-from train import image_data
+import metrics
+import prediction_log
+import tracing
 from chessboard_finder import get_chessboard_corners
-from chessboard_image import get_chessboard_tiles
+from chessboard_image import get_chessboard_tiles_array
+from tile_cache import TileCache, tile_keys, unique_indices
+import empty_cascade
+import tile_refinement
 
-OUT_FILE = "debug.html"
+# Where recognize.py --debug logs predictions
+PREDICTION_LOG_FILE = "predictions.jsonl"
+
+# Boards whose tiles predict_chessboards classifies in one model call
+BOARDS_PER_BATCH = 32
+
+# Threads predict_chessboards reads and decodes images on
+DECODE_THREADS = 4
+
+# Image files recognize.py picks up when given a directory
+IMAGE_EXTENSIONS = ('.png', '.jpg', '.jpeg', '.webp', '.bmp', '.gif')
+
+# Probabilities of tiles seen before, shared by all images (None = off)
+tile_cache = TileCache(TILE_CACHE_SIZE) if TILE_CACHE_SIZE > 0 else None
+
+# Labels flat squares empty before the network (None = off, see empty_cascade.py)
+empty_filter = empty_cascade.load()
+
+# Tiles less confident than this are classified again with more contrast
+# (0 = off, see tile_refinement.py)
+refine_min_confidence = REFINE_TILE_CONFIDENCE
 
 # Global model değişkeni
 model = None
 
+# 'savedmodel', 'tflite-float16', 'tflite-int8' or 'numpy'
+backend = NN_BACKEND
+
 def load_model_if_needed():
     global model
     if model is None:
-        model = models.load_model(NN_MODEL_PATH)
+        t0 = time.perf_counter()
+        if backend == 'savedmodel':
+            # TensorFlow is only imported by the backend that needs it
+            from tensorflow.keras import models
+            model = models.load_model(NN_MODEL_PATH)
+        elif backend.startswith('tflite-') and backend[7:] in NN_TFLITE_MODEL_PATHS:
+            from tflite_model import TFLiteModel
+            model = TFLiteModel(NN_TFLITE_MODEL_PATHS[backend[7:]])
+        elif backend == 'numpy':
+            from numpy_model import NumpyModel
+            model = NumpyModel(NN_NUMPY_MODEL_PATH)
+        else:
+            raise ValueError("Unknown NN backend: {}".format(backend))
+        metrics.model_load_seconds.set(time.perf_counter() - t0)
     return model
 
-def _chessboard_tiles_img_data(chessboard_img_path, options={}):
-    """ Given a file path to a chessboard PNG image, returns a
-        size-64 array of 32x32 tiles representing each square of a chessboard
+def _model_files():
+    """ Returns the paths of the files the backend loads the model from """
+    if backend == 'savedmodel':
+        return [os.path.join(NN_MODEL_PATH, 'saved_model.pb')] + sorted(
+            glob(os.path.join(NN_MODEL_PATH, 'variables', '*'))
+        )
+    if backend.startswith('tflite-') and backend[7:] in NN_TFLITE_MODEL_PATHS:
+        return [NN_TFLITE_MODEL_PATHS[backend[7:]]]
+    if backend == 'numpy':
+        return [NN_NUMPY_MODEL_PATH]
+    raise ValueError("Unknown NN backend: {}".format(backend))
+
+def model_fingerprint():
+    """ Returns a short hex digest of the backend, its model files and the
+        settings that change predictions (empty square cascade, tile
+        refinement, grayscale, corner detection), so results computed with
+        another model or configuration can be told apart
+    """
+    digest = hashlib.blake2b(digest_size=8)
+    digest.update(json.dumps([
+        backend, refine_min_confidence, USE_GRAYSCALE, DETECT_CORNERS,
+        None if empty_filter is None else
+        [float(empty_filter.max_edge_energy), float(empty_filter.empty_probability)],
+    ]).encode())
+    for path in _model_files():
+        digest.update(os.path.basename(path).encode())
+        if os.path.exists(path):
+            with open(path, 'rb') as f:
+                digest.update(f.read())
+    return digest.hexdigest()
+
+def warm_up():
+    """ Loads the model and runs a first prediction on a blank chessboard,
+        so the first real image doesn't pay for either.
+
+        Returns a dict with the seconds taken by each step
     """
+    t0 = time.perf_counter()
+    load_model_if_needed()
+    t1 = time.perf_counter()
     n_channels = 1 if USE_GRAYSCALE else 3
-    tiles = get_chessboard_tiles(chessboard_img_path, use_grayscale=USE_GRAYSCALE)
-    img_data_list = []
-    for i in range(64):
-        buf = BytesIO()
-        tiles[i].save(buf, format='PNG')
-        img_data = tf.image.decode_image(buf.getvalue(), channels=n_channels)
-        img_data = tf.image.convert_image_dtype(img_data, tf.float32)
-        img_data = tf.image.resize(img_data, [32, 32])
-        img_data_list.append(img_data)
-    return img_data_list
-
-def _confidence_color(confidence):
-    if confidence >= 0.999:
-        return "#00C176"
-    elif confidence > 0.99:
-        return "#88C100"
-    elif confidence > 0.95:
-        return "#FABE28"
-    elif confidence > 0.9:
-        return "#FF8A00"
-    else:
-        return "#FF003C"
-
-def _save_output_html(chessboard_img_path, fen, predictions, confidence):
-    confidence_color = _confidence_color(confidence)
-    html = '<h3>{}</h3>'.format(chessboard_img_path)
-    html += '<div class="boards-row">'
-    html += '<img src="{}" />'.format(chessboard_img_path)
-    html += '<img src="http://www.fen-to-image.com/image/32/{}"/>'.format(fen)
-    html += '<div class="predictions-matrix">'
-    for i in range(8):
-        html += '<div>'
-        for j in range(8):
-            c = predictions[i*8 + j]
-            html += '<div class="prediction" style="color: {}">{}</div>'.format(
-                _confidence_color(c),
-                format(c, '.3f')
-            )
-        html += '</div>'
-    html += '</div>'
-    html += '</div>'
-    html += '<br />'
-    html += '<a href="https://lichess.org/editor/{}" target="_blank">{}</a>'.format(
-        fen, fen
+    predict_tiles(np.zeros([64, 32, 32, n_channels], dtype=np.float32))
+    t2 = time.perf_counter()
+    return {'load_s': t1 - t0, 'first_prediction_s': t2 - t1}
+
+def _chessboard_tiles_img_data(chessboard_img, options=None):
+    """ Given a chessboard image (file path, bytes, file-like object
+        or numpy array), returns a
+        (64, 32, 32, C) float32 array of tiles representing each square of a chessboard.
+        Screenshots that aren't square are cropped to the board in them first
+    """
+    return get_chessboard_tiles_array(
+        chessboard_img, use_grayscale=USE_GRAYSCALE, detect_corners=DETECT_CORNERS
     )
-    html += '<div style="color: {}">{}</div>'.format(confidence_color, confidence)
-    html += '<br /><br />'
-    with open(OUT_FILE, "a") as f:
-        f.write(html)
 
-def predict_chessboard(chessboard_img_path, options={}):
-    """ Given a file path to a chessboard PNG image,
+def predict_chessboard(chessboard_img, options=None, return_probabilities=False):
+    """ Given a chessboard image (file path, bytes, file-like object
+        or numpy array),
         Returns a tuple of (FEN string, confidence)
+
+        options = parsed CLI arguments, prints progress unless options.quiet
+        (quiet when not given)
+        return_probabilities = true/false for whether to also return the
+        64x13 array of tile probabilities, as (FEN string, confidence, probabilities)
     """
-    if not options.quiet:
-        print("Predicting chessboard {}".format(chessboard_img_path))
-    img_data_list = _chessboard_tiles_img_data(chessboard_img_path, options)
-    predictions = []
-    confidence = 1
-    for i in range(64):
+    quiet = getattr(options, 'quiet', True)
+    # Debug output can only link to images that are files
+    img_label = chessboard_img if isinstance(chessboard_img, str) else 'in-memory image'
+    if not quiet:
+        print("Predicting chessboard {}".format(img_label))
+    with tracing.span('predict_chessboard'):
+        t0 = time.perf_counter()
+        img_data_list = _chessboard_tiles_img_data(chessboard_img, options)
+        t1 = time.perf_counter()
         # a8, b8 ... g1, h1
-        tile_img_data = img_data_list[i]
-        (fen_char, probability) = predict_tile(tile_img_data)
-        if not options.quiet:
-            print((fen_char, probability))
-        predictions.append((fen_char, probability))
+        tile_stats = {}
+        probabilities = classify_tiles(img_data_list, tile_stats)
+        t2 = time.perf_counter()
+        predictions = predictions_from_probabilities(probabilities)
+    if not quiet:
+        for prediction in predictions:
+            print(prediction)
+        print("Unique tiles: {}/64, {} labelled empty, {} classified, {} refined".format(
+            tile_stats['unique'], tile_stats['empty'], tile_stats['classified'],
+            tile_stats['refined'],
+        ))
+    predicted_fen, confidence = chessboard_from_predictions(predictions)
+    if not quiet:
+        print("Confidence: {}".format(confidence))
+        print("https://lichess.org/editor/{}".format(predicted_fen))
+    prediction_log.log_prediction(
+        img_label, predicted_fen, confidence, predictions,
+        {'tiles_s': t1 - t0, 'inference_s': t2 - t1}, tile_stats['unique'],
+    )
+    if return_probabilities:
+        return predicted_fen, confidence, probabilities
+    return predicted_fen, confidence
+
+def predict_chessboards(chessboard_imgs, boards_per_batch=BOARDS_PER_BATCH,
+                        decode_threads=DECODE_THREADS):
+    """ Given an iterable of chessboard images (file paths, bytes, file-like
+        objects or numpy arrays), yields a (chessboard image, result) tuple
+        for each of them in order, result being a (FEN string, confidence)
+        tuple or the exception raised while reading that image.
+
+        Images are read and decoded on decode_threads threads while the
+        previous batch is classified, and the tiles of up to boards_per_batch
+        boards go through the model together. At most 3 * boards_per_batch
+        images are held in memory, the batch being classified and up to
+        2 * boards_per_batch read ahead, so the iterable can be arbitrarily
+        long. Raises ValueError if boards_per_batch is less than 1.
+    """
+    if boards_per_batch < 1:
+        raise ValueError("boards_per_batch must be at least 1, got {}".format(boards_per_batch))
+    chessboard_imgs = iter(chessboard_imgs)
+    pending = deque()
+    with ThreadPoolExecutor(decode_threads, thread_name_prefix='decode') as executor:
+        def prefetch():
+            while len(pending) < 2 * boards_per_batch:
+                chessboard_img = next(chessboard_imgs, None)
+                if chessboard_img is None:
+                    return
+                pending.append((chessboard_img, executor.submit(
+                    _chessboard_tiles_img_data, chessboard_img
+                )))
+        prefetch()
+        while pending:
+            batch = [pending.popleft() for _ in range(min(boards_per_batch, len(pending)))]
+            results = []
+            tiles = []
+            for chessboard_img, future in batch:
+                try:
+                    tiles.append(future.result())
+                    results.append(None)
+                except Exception as e:
+                    results.append(e)
+            # Decode the next batch while this one is classified
+            prefetch()
+            if tiles:
+                t0 = time.perf_counter()
+                tile_stats = {}
+                probabilities = classify_tiles(np.concatenate(tiles), tile_stats)
+                unique_tiles = unique_tiles_per_board(tile_stats['keys'])
+                inference_s = time.perf_counter() - t0
+            n = 0
+            for (chessboard_img, _), result in zip(batch, results):
+                if result is None:
+                    predictions = predictions_from_probabilities(
+                        probabilities[n*64:(n+1)*64]
+                    )
+                    n += 1
+                    result = chessboard_from_predictions(predictions)
+                    if prediction_log.is_enabled():
+                        prediction_log.log_prediction(
+                            chessboard_img if isinstance(chessboard_img, str)
+                            else 'in-memory image',
+                            result[0], result[1], predictions,
+                            {'inference_s': inference_s}, unique_tiles[n - 1],
+                        )
+                yield chessboard_img, result
+
+def chessboard_from_predictions(predictions):
+    """ Given a list of 64 (FEN char, confidence) tile predictions in order
+        a8, b8 ... g1, h1,
+        Returns a tuple of (FEN string, confidence)
+    """
+    confidence = 1
+    for (fen_char, probability) in predictions:
         confidence *= probability
-    
     predicted_fen = compressed_fen(
         '/'.join(
             [''.join(r) for r in np.reshape([p[0] for p in predictions], [8, 8])]
         )
     )
-    if not options.quiet:
-        print("Confidence: {}".format(confidence))
-    # if options.debug:
-    print("https://lichess.org/editor/{}".format(predicted_fen))
-    _save_output_html(chessboard_img_path, predicted_fen, [p[1] for p in predictions], confidence)
-    print("Saved {} prediction to {}".format(chessboard_img_path, OUT_FILE))
     return predicted_fen, confidence
 
+def chessboard_from_probabilities(probabilities):
+    """ Given a 64x13 array of tile probabilities,
+        Returns a tuple of (FEN string, confidence)
+    """
+    return chessboard_from_predictions(predictions_from_probabilities(probabilities))
+
+def predictions_from_probabilities(probabilities):
+    """ Given an (N, 13) array of tile probabilities,
+        Returns a list of N (predicted FEN char, confidence) tuples
+    """
+    indices = np.argmax(probabilities, axis=1)
+    return [
+        (FEN_CHARS[i], probabilities[n, i]) for n, i in enumerate(indices)
+    ]
+
+def predict_tiles(tiles_img_data):
+    """ Given the image data of N tiles, classifies all of them with
+        a single model call.
+
+        Returns an (N, 13) array of probabilities, one row per tile
+    """
+    model = load_model_if_needed()
+    batch = np.asarray(tiles_img_data, dtype=np.float32)
+    with metrics.timed('infer'), tracing.span('inference', tiles=len(batch)):
+        return np.asarray(model(batch, training=False))
+
+def classify_tiles(tiles_img_data, stats=None):
+    """ Same as predict_tiles, but only the distinct tiles that aren't in
+        tile_cache go through the model, their probabilities are copied to
+        the identical tiles. Of those, tiles empty_filter finds flat are
+        labelled empty without the model.
+
+        stats = optional dict, set to the number of 'tiles', 'unique' tiles,
+        tiles found in the 'cached' probabilities, labelled 'empty' by
+        empty_filter, 'classified' by the model and of those 'refined'
+        because they were less confident than refine_min_confidence, and
+        the tile 'keys' (see unique_tiles_per_board)
+    """
+    tiles = np.asarray(tiles_img_data, dtype=np.float32)
+    keys = tile_keys(tiles)
+    first, inverse = unique_indices(keys)
+    unique_keys = [keys[i] for i in first]
+    if tile_cache is not None:
+        unique_probabilities = tile_cache.get_many(unique_keys)
+    else:
+        unique_probabilities = [None] * len(first)
+    missing = [j for j, p in enumerate(unique_probabilities) if p is None]
+    num_cached = len(first) - len(missing)
+    num_empty = 0
+    if missing and empty_filter is not None:
+        flat = empty_filter.is_empty(tiles[[first[j] for j in missing]])
+        for j in np.asarray(missing)[flat]:
+            unique_probabilities[j] = empty_filter.probabilities
+        num_empty = int(flat.sum())
+        missing = [j for j, is_flat in zip(missing, flat) if not is_flat]
+    num_refined = 0
+    if missing:
+        missing_tiles = tiles[[first[j] for j in missing]]
+        probabilities = predict_tiles(missing_tiles)
+        if refine_min_confidence > 0:
+            probabilities, refined = tile_refinement.refine(
+                missing_tiles, probabilities, predict_tiles, refine_min_confidence
+            )
+            num_refined = len(refined)
+            metrics.refined_tiles_total.inc(num_refined)
+        for j, p in zip(missing, probabilities):
+            unique_probabilities[j] = p.copy()
+        if tile_cache is not None:
+            tile_cache.put_many(
+                [unique_keys[j] for j in missing], [unique_probabilities[j] for j in missing]
+            )
+    metrics.tiles_total.inc(len(keys) - len(first), result='duplicate')
+    metrics.tiles_total.inc(num_cached, result='cached')
+    metrics.tiles_total.inc(num_empty, result='empty')
+    metrics.tiles_total.inc(len(missing), result='classified')
+    if stats is not None:
+        stats.update(
+            tiles=len(keys), unique=len(first), cached=num_cached, empty=num_empty,
+            classified=len(missing), refined=num_refined, keys=keys,
+        )
+    return np.stack(unique_probabilities)[inverse]
+
+def unique_tiles_per_board(keys):
+    """ Given the tile keys of boards classified together, returns the
+        number of distinct tiles of each board, 64 meaning no duplicates
+    """
+    return [len(set(keys[i:i+64])) for i in range(0, len(keys), 64)]
+
 def predict_tile(tile_img_data):
     """ Given the image data of a tile, try to determine what piece
         is on the tile, or if it's blank.
 
         Returns a tuple of (predicted FEN char, confidence)
     """
-    model = load_model_if_needed()
-    probabilities = list(model.predict(np.array([tile_img_data]))[0])
-    max_probability = max(probabilities)
-    i = probabilities.index(max_probability)
-    return (FEN_CHARS[i], max_probability)
+    return predictions_from_probabilities(predict_tiles([tile_img_data]))[0]
+
+def _image_paths(image_path):
+    """ Given a path/glob, or a directory to search for images recursively,
+        Returns a sorted list of image file paths
+    """
+    if os.path.isdir(image_path):
+        return sorted(
+            path for path in glob(os.path.join(image_path, '**', '*'), recursive=True)
+            if path.lower().endswith(IMAGE_EXTENSIONS)
+        )
+    return sorted(glob(image_path))
+
+def _completed_paths(output_path, output_format):
+    """ Returns the set of image paths already recognized in a JSONL or CSV
+        results file, dropping a last line that was cut off mid-write.
+        Images whose row is an error aren't included, so they're tried again
+    """
+    if not os.path.exists(output_path):
+        return set()
+    with open(output_path, 'rb+') as f:
+        data = f.read()
+        if data and not data.endswith(b'\n'):
+            f.truncate(data.rfind(b'\n') + 1)
+    with open(output_path, newline='') as f:
+        if output_format == 'csv':
+            rows = csv.DictReader(f)
+        else:
+            rows = (json.loads(line) for line in f if line.strip())
+        return {row['path'] for row in rows if not row['error']}
+
+def _positive_int(value):
+    import argparse
+    number = int(value)
+    if number < 1:
+        raise argparse.ArgumentTypeError("must be at least 1, got {}".format(value))
+    return number
+
+def _write_results(results, out, output_format, write_header=True):
+    """ Writes each (image path, result) from predict_chessboards as a
+        JSONL or CSV row as soon as it's known.
+        Returns the number of images that couldn't be recognized
+    """
+    if output_format == 'csv':
+        writer = csv.writer(out)
+        if write_header:
+            writer.writerow(['path', 'fen', 'confidence', 'error'])
+    num_errors = 0
+    for path, result in results:
+        if isinstance(result, Exception):
+            num_errors += 1
+            row = {'path': path, 'fen': None, 'confidence': None, 'error': str(result)}
+        else:
+            row = {'path': path, 'fen': result[0],
+                   'confidence': float(result[1]), 'error': None}
+        if output_format == 'csv':
+            writer.writerow(['' if v is None else v for v in row.values()])
+        else:
+            out.write(json.dumps(row) + '\n')
+        # Everything written is kept if the run is interrupted
+        out.flush()
+    return num_errors
 
 if __name__ == '__main__':
     import argparse
+    import debug_report
     parser = argparse.ArgumentParser()
     parser.add_argument("-q", "--quiet", help="Only print recognized FEN position",
                         action="store_true")
-    parser.add_argument("-d", "--debug", help="Saves debug output to debug.html",
+    parser.add_argument("-d", "--debug",
+                        help="Logs predictions to {} and saves them to {}".format(
+                            PREDICTION_LOG_FILE, debug_report.OUT_FILE
+                        ),
                         action="store_true")
-    parser.add_argument("image_path", help="Path/glob to PNG chessboard image(s)")
+    parser.add_argument("-w", "--workers", type=int, default=0,
+                        help="Recognize images on a pool of N worker processes")
+    parser.add_argument("-b", "--backend", default=NN_BACKEND,
+                        choices=['savedmodel', 'tflite-float16', 'tflite-int8', 'numpy'],
+                        help="Neural network inference backend")
+    parser.add_argument("-f", "--format", choices=['jsonl', 'csv'],
+                        help="Stream results as JSONL or CSV rows, recognizing "
+                        "images in batches (default when --output is given: "
+                        "from its extension)")
+    parser.add_argument("-o", "--output",
+                        help="Write --format results to this file instead of "
+                        "stdout, skipping images it already has results for. "
+                        "Images with an error row are tried again and get a new row")
+    parser.add_argument("--batch-size", type=_positive_int, default=BOARDS_PER_BATCH,
+                        help="Boards classified in one model call with --format")
+    parser.add_argument("--threads", type=_positive_int, default=DECODE_THREADS,
+                        help="Threads decoding images with --format")
+    parser.add_argument("-r", "--refine", type=float, default=REFINE_TILE_CONFIDENCE,
+                        help="Classify tiles less confident than this again with "
+                        "more contrast (see tile_refinement.py)")
+    parser.add_argument("-t", "--trace",
+                        help="Save a Chrome trace of recognizing each image to this file")
+    parser.add_argument("image_path",
+                        help="Path/glob to chessboard image(s), or a directory of them")
     args = parser.parse_args()
-    if not args.quiet:
+    backend = args.backend
+    refine_min_confidence = args.refine
+    if args.output and not args.format:
+        args.format = 'csv' if args.output.lower().endswith('.csv') else 'jsonl'
+    if args.format:
+        # Results go to stdout/--output, everything else to stderr
+        chessboard_image_paths = _image_paths(args.image_path)
+        num_total = len(chessboard_image_paths)
+        completed = set()
+        if args.output:
+            completed = _completed_paths(args.output, args.format)
+            chessboard_image_paths = [
+                path for path in chessboard_image_paths if path not in completed
+            ]
+        if len(chessboard_image_paths) < num_total:
+            print("Resuming, {} of {} images already recognized".format(
+                num_total - len(chessboard_image_paths), num_total
+            ), file=sys.stderr)
+        if args.debug:
+            prediction_log.enable(PREDICTION_LOG_FILE)
+        t0 = time.perf_counter()
+        results = predict_chessboards(
+            chessboard_image_paths, boards_per_batch=args.batch_size,
+            decode_threads=args.threads,
+        )
+        if args.output:
+            write_header = not (os.path.exists(args.output) and os.path.getsize(args.output))
+            with open(args.output, 'a', newline='') as out:
+                num_errors = _write_results(results, out, args.format, write_header)
+        else:
+            num_errors = _write_results(results, sys.stdout, args.format)
+        elapsed = time.perf_counter() - t0
+        if args.debug:
+            prediction_log.disable()
+        num_images = len(chessboard_image_paths)
+        print("Recognized {} of {} images in {:.1f}s ({:.1f} images/sec), {} errors".format(
+            num_images - num_errors, num_images, elapsed,
+            num_images / elapsed if elapsed else 0., num_errors,
+        ), file=sys.stderr)
+        sys.exit(0)
+    if not args.quiet and backend == 'savedmodel':
+        import tensorflow as tf
         print('Tensorflow {}'.format(tf.version.VERSION))
     if len(sys.argv) > 1:
-        with open(OUT_FILE, "w") as f:
-            f.write('<link rel="stylesheet" href="./web/style.css" />')
-        for chessboard_image_path in sorted(glob(args.image_path)):
-            print(predict_chessboard(chessboard_image_path, args))
-
+        if args.debug:
+            if os.path.exists(PREDICTION_LOG_FILE):
+                os.remove(PREDICTION_LOG_FILE)
+            prediction_log.enable(PREDICTION_LOG_FILE)
+        chessboard_image_paths = _image_paths(args.image_path)
+        if args.workers > 0:
+            from worker_pool import RecognitionWorkerPool
+            with RecognitionWorkerPool(args.workers, backend=args.backend,
+                                       refine_min_confidence=args.refine) as pool:
+                futures = []
+                for chessboard_image_path in chessboard_image_paths:
+                    with open(chessboard_image_path, 'rb') as f:
+                        futures.append(pool.submit(f.read()))
+                for chessboard_image_path, future in zip(chessboard_image_paths, futures):
+                    fen, confidence, probabilities = future.result()
+                    prediction_log.log_prediction(
+                        chessboard_image_path, fen, confidence,
+                        predictions_from_probabilities(probabilities),
+                    )
+                    print((fen, confidence))
+        else:
+            if args.trace:
+                tracing.set_sample_rate(1)
+            for chessboard_image_path in chessboard_image_paths:
+                with tracing.trace('recognize', image=chessboard_image_path):
+                    print(predict_chessboard(chessboard_image_path, args))
+            if args.trace:
+                tracing.save_chrome_trace(args.trace, tracing.slowest(tracing.RECENT_TRACES))
+                print("Saved trace to {}".format(args.trace))
+        if args.debug:
+            prediction_log.disable()
+            debug_report.save_html(debug_report.rotated_log_paths(PREDICTION_LOG_FILE))
+            print("Saved predictions to {}".format(debug_report.OUT_FILE))
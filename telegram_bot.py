@@ -1,42 +1,114 @@
 #!/usr/bin/env python3
 
+# Tanıma süreçleri (RECOGNITION_WORKERS) bu modülü yeniden import eder, bu yüzden
+# modül seviyesinde sadece sabitler tanımlanır: token kontrolü, önbellek, servisler
+# ve python-telegram-bot run_bot içinde kurulur/yüklenir
+from __future__ import annotations
+
 import os
+import json
 import logging
-from telegram import Update
-from telegram.ext import Application, CommandHandler, MessageHandler, filters, ContextTypes
-from recognize import predict_chessboard, load_model_if_needed
-import tempfile
+import recognize
+from recognize import warm_up, predictions_from_probabilities
+import prediction_log
+import metrics
+import tracing
+from inference_service import InferenceService
+from worker_pool import RecognitionWorkerPool
+from recognition_cache import RecognitionCache, file_key, pixels_key
+from chessboard_image import geometry_cache
+from constants import DETECT_CORNERS
 import time
 import threading
 from http.server import HTTPServer, BaseHTTPRequestHandler
-import nest_asyncio
-import requests
+from urllib.parse import urlparse, parse_qs
 import asyncio
+from typing import TYPE_CHECKING
 
-# Event loop düzeltmesi
-nest_asyncio.apply()
-
-# Loglama ayarları
-logging.basicConfig(
-    format='%(asctime)s - %(name)s - %(levelname)s - %(message)s',
-    level=logging.INFO
-)
+if TYPE_CHECKING:
+    # Sadece tip açıklamaları için; telegram run_bot içinde import edilir
+    from telegram import Update
+    from telegram.ext import ContextTypes
 
-# Bot token'ı environment variable'dan al
+# Bot token'ı environment variable'dan al, run_bot kontrol eder
 TOKEN = os.environ.get("TELEGRAM_BOT_TOKEN")
-if not TOKEN:
-    raise ValueError("TELEGRAM_BOT_TOKEN environment variable is not set!")
 
 # Service URL'ini environment variable'dan al veya default değer kullan
 SERVICE_URL = os.environ.get("RENDER_EXTERNAL_URL")
 
+# Eşzamanlı istekleri tek model çağrısında toplamak için bekleme süresi (ms)
+INFERENCE_BATCH_WINDOW_MS = int(os.environ.get("INFERENCE_BATCH_WINDOW_MS", 20))
+
+# Tanıma işlemini event loop dışında, toplu olarak çalıştıran servis
+# RECOGNITION_WORKERS = 0 ise run_bot tarafından oluşturulur
+inference_service = None
+
+# Tahta 256x256'ya küçültüldüğü için daha büyük fotoğraf indirmeye gerek yok
+MIN_PHOTO_SIDE = 256
+
+# Kare olmayan fotoğraflar içlerindeki tahtaya kırpılır. Tahtanın kenarı en az
+# fotoğrafın kısa kenarının bu oranı kadar varsayılır; kırpılan tahta 256
+# pikselden küçük kalmasın diye kısa kenarı MIN_PHOTO_SIDE / MIN_BOARD_FRACTION
+# olan boyut seçilir
+MIN_BOARD_FRACTION = 0.5
+
+# 0'dan büyükse tanıma işlemi bu sayıda ayrı süreçte (process) yapılır
+RECOGNITION_WORKERS = int(os.environ.get("RECOGNITION_WORKERS", 0))
+
+# RECOGNITION_WORKERS > 0 ise run_bot tarafından oluşturulur
+worker_pool = None
+
+# Tahminlerin JSONL olarak kaydedileceği dosya, boşsa kayıt tutulmaz
+# HTML rapor için: python debug_report.py <dosya>
+PREDICTION_LOG = os.environ.get("PREDICTION_LOG")
+
+# İzlenecek (trace) isteklerin oranı, 0 ise izleme kapalı
+# En yavaş istekler /traces (metin) ve /traces.json (Chrome trace) adreslerinde
+TRACE_SAMPLE_RATE = float(os.environ.get("TRACE_SAMPLE_RATE", 0))
+
+# Albüm (media group) olarak gönderilen fotoğrafların hepsini toplamak için
+# ilk fotoğraftan sonra beklenecek süre (ms)
+MEDIA_GROUP_WINDOW_MS = int(os.environ.get("MEDIA_GROUP_WINDOW_MS", 1000))
+
+# (chat_id, media_group_id) -> henüz işlenmemiş albüm mesajları
+media_groups = {}
+
+# Albümleri işleyen görevler, çöp toplayıcı silmesin diye tutulur
+media_group_tasks = set()
+
+# Daha önce tanınan fotoğrafların sonuçları: bellekte LRU + diskte SQLite
+# RECOGNITION_CACHE_DB boş bırakılırsa sadece bellek kullanılır
+RECOGNITION_CACHE_SIZE = int(os.environ.get("RECOGNITION_CACHE_SIZE", 1024))
+RECOGNITION_CACHE_TTL = int(os.environ.get("RECOGNITION_CACHE_TTL", 7 * 24 * 3600))
+RECOGNITION_CACHE_DB = os.environ.get("RECOGNITION_CACHE_DB", "recognition_cache.db")
+
+# run_bot tarafından oluşturulur
+recognition_cache = None
+
 # Web sunucusu için basit handler
 class SimpleHTTPRequestHandler(BaseHTTPRequestHandler):
     def do_GET(self):
+        url = urlparse(self.path)
+        if url.path == '/metrics':
+            self.send_metrics()
+            return
+        if url.path in ('/traces', '/traces.json'):
+            self.send_traces(url)
+            return
         self.send_response(200)
         self.send_header('Content-type', 'text/html; charset=utf-8')
         self.end_headers()
         current_time = time.strftime("%Y-%m-%d %H:%M:%S")
+        cache_stats = recognition_cache.stats()
+        # RECOGNITION_WORKERS > 0 ise her sürecin kendi tahta konumu önbelleği vardır
+        geometry_stats = geometry_cache.stats()
+        tile_cache_html = ''
+        if recognize.tile_cache is not None:
+            tile_stats = recognize.tile_cache.stats()
+            tile_cache_html = (
+                f"<p>Kare önbelleği: {tile_stats['hits']} isabet "
+                f"(%{tile_stats['hit_rate'] * 100:.0f}), {tile_stats['entries']} kare</p>"
+            )
         response = f"""
         <html>
             <head><title>Satranç Tahtası Tanıma Botu</title></head>
@@ -44,11 +116,55 @@ class SimpleHTTPRequestHandler(BaseHTTPRequestHandler):
                 <h1>Satranç Tahtası Tanıma Botu Aktif</h1>
                 <p>Bot başarıyla çalışıyor. Telegram'dan @ChessRecognitionBot ile iletişime geçebilirsiniz.</p>
                 <p>Son kontrol zamanı: {current_time}</p>
+                <p>Önbellek: {cache_stats['memory_hits'] + cache_stats['disk_hits']} isabet
+                   ({cache_stats['disk_hits']} diskten), {cache_stats['misses']} ıskalama,
+                   {cache_stats['evictions']} çıkarma, {cache_stats['expirations']} süresi dolan</p>
+                <p>Tahta konumu önbelleği: {geometry_stats['hits']} isabet
+                   (%{geometry_stats['hit_rate'] * 100:.0f}), {geometry_stats['misses']} ıskalama,
+                   {geometry_stats['rejections']} doğrulanamayan, {geometry_stats['entries']} düzen</p>
+                {tile_cache_html}
             </body>
         </html>
         """
         self.wfile.write(response.encode('utf-8'))
 
+    def send_metrics(self):
+        """Prometheus için metrikler (text exposition format)"""
+        # Modele sırada bekleyen görüntüler
+        if worker_pool is not None:
+            metrics.queue_depth.set(worker_pool.stats()['pending'])
+        else:
+            metrics.queue_depth.set(inference_service.queue_depth())
+        body = metrics.render().encode('utf-8')
+        self.send_response(200)
+        self.send_header('Content-type', 'text/plain; version=0.0.4; charset=utf-8')
+        self.send_header('Content-Length', str(len(body)))
+        self.end_headers()
+        self.wfile.write(body)
+
+    def send_traces(self, url):
+        """Son izlenen isteklerin en yavaşları, ?n= ile sayısı seçilir"""
+        try:
+            n = int(parse_qs(url.query).get('n', ['10'])[0])
+        except ValueError:
+            n = 0
+        if n < 1:
+            self.send_error(400, "n must be a positive integer")
+            return
+        # Saklanan izlerden fazlası istenemez
+        traces = tracing.slowest(min(n, tracing.RECENT_TRACES))
+        if url.path == '/traces.json':
+            body = json.dumps(tracing.chrome_trace(traces)).encode('utf-8')
+            content_type = 'application/json'
+        else:
+            body = tracing.summary(traces).encode('utf-8')
+            content_type = 'text/plain; charset=utf-8'
+        self.send_response(200)
+        self.send_header('Content-type', content_type)
+        self.send_header('Content-Length', str(len(body)))
+        self.end_headers()
+        self.wfile.write(body)
+
     def do_HEAD(self):
         self.send_response(200)
         self.send_header('Content-type', 'text/html; charset=utf-8')
@@ -64,8 +180,6 @@ def start_web_server():
 
 async def start(update: Update, context: ContextTypes.DEFAULT_TYPE):
     """Bot başlatıldığında çalışacak komut"""
-    # Model'i başlangıçta yükle
-    load_model_if_needed()
     await update.message.reply_text(
         'Merhaba! Ben bir satranç tahtası tanıma botuyum. '
         'Bana bir satranç tahtası fotoğrafı gönder, ben sana:\n\n'
@@ -84,61 +198,289 @@ async def help_command(update: Update, context: ContextTypes.DEFAULT_TYPE):
         '4. /help - Bu yardım mesajını göster'
     )
 
+LOW_CONFIDENCE_WARNING = (
+    "⚠️ Uyarı: Tahmin güvenilirliği düşük. Lütfen FEN notasyonunu kontrol edin. "
+    "Daha iyi sonuç için:\n"
+    "1. Tahtanın tamamı fotoğraf karesinde olmalı\n"
+    "2. Fotoğraf net ve iyi aydınlatılmış olmalı\n"
+    "3. Taşlar net görünmeli"
+)
+
+def confidence_emoji(confidence_percentage):
+    """Güvenilirlik emojisi seç"""
+    if confidence_percentage >= 95:
+        return "🟢"  # Yüksek güvenilirlik
+    elif confidence_percentage >= 85:
+        return "🟡"  # Orta güvenilirlik
+    else:
+        return "🔴"  # Düşük güvenilirlik
+
+async def reply_with_result(update: Update, fen, confidence):
+    """FEN notasyonunu, güvenilirliği ve Lichess linkini gönder"""
+    # Güvenilirlik yüzdesini hesapla
+    confidence_percentage = confidence * 100
+    emoji = confidence_emoji(confidence_percentage)
+    
+    # FEN notasyonunu ve güvenilirliği gönder
+    await update.message.reply_text(
+        f"FEN Notasyonu:\n`{fen}`\n\n"
+        f"Tahmin güvenilirliği: {emoji} %{confidence_percentage:.1f}",
+        parse_mode='Markdown'
+    )
+    
+    # Lichess analiz linki
+    lichess_url = f"https://lichess.org/analysis/standard/{fen}"
+    await update.message.reply_text(f"Lichess'te analiz et:\n{lichess_url}")
+    
+    # Düşük güvenilirlik uyarısı
+    if confidence_percentage < 85:
+        await update.message.reply_text(LOW_CONFIDENCE_WARNING)
+
+async def recognize_photo(image_bytes):
+    """Satranç tahtasını analiz et, (fen, confidence) döndür"""
+    with metrics.timed('recognize'), tracing.span('recognize', image_bytes=len(image_bytes)):
+        fen, confidence = await _recognize_photo(image_bytes)
+    metrics.confidence.observe(float(confidence))
+    return fen, confidence
+
+async def _recognize_photo(image_bytes):
+    if worker_pool is not None:
+        fen, confidence, probabilities = await asyncio.wrap_future(
+            worker_pool.submit(image_bytes)
+        )
+        prediction_log.log_prediction(
+            'in-memory image', fen, confidence,
+            predictions_from_probabilities(probabilities),
+        )
+        return fen, confidence
+    return await inference_service.predict(image_bytes)
+
+def select_photo_size(photo_sizes):
+    """Tahtanın 256x256'ya küçültülmesine yetecek en küçük fotoğraf boyutunu seç"""
+    largest = max(photo_sizes, key=lambda p: p.width * p.height)
+    min_side = MIN_PHOTO_SIDE
+    if DETECT_CORNERS or abs(1 - largest.width / largest.height) > 0.05:
+        # Tahta fotoğrafın sadece bir kısmı, kırpıldıktan sonra da 256 piksel kalmalı
+        min_side = MIN_PHOTO_SIDE / MIN_BOARD_FRACTION
+    large_enough = [
+        p for p in photo_sizes if min(p.width, p.height) >= min_side
+    ]
+    if not large_enough:
+        # Hepsi küçükse en büyüğünü kullan
+        return largest
+    return min(large_enough, key=lambda p: p.width * p.height)
+
+async def cache_get(keys):
+    """Önbellekteki sonuçları oku, SQLite sorgusu event loop'u bloklamasın
+    diye ayrı thread'de çalışır"""
+    loop = asyncio.get_running_loop()
+    return await loop.run_in_executor(None, recognition_cache.get_many, keys)
+
+async def cache_put(items):
+    """(key, fen, confidence) sonuçlarını tek commit ile önbelleğe yaz"""
+    loop = asyncio.get_running_loop()
+    await loop.run_in_executor(None, recognition_cache.put_many, items)
+
+async def download_photo(photo_size):
+    """Fotoğrafı doğrudan belleğe indir"""
+    photo = await photo_size.get_file()
+    return bytes(await photo.download_as_bytearray())
+
+async def recognize_photos(images):
+    """Birden çok görüntüyü tek seferde tanı, her biri için (fen, confidence)
+    ya da hata döndür"""
+    with metrics.timed('recognize'), tracing.span('recognize', photos=len(images)):
+        if worker_pool is not None:
+            # Her süreç bir fotoğraf alır, fotoğraflar paralel tanınır
+            results = await asyncio.gather(
+                *[_recognize_photo(image_bytes) for image_bytes in images],
+                return_exceptions=True,
+            )
+        else:
+            # Hepsi tek bir model çağrısında
+            results = await inference_service.predict_batch(images)
+    for result in results:
+        if not isinstance(result, BaseException):
+            metrics.confidence.observe(float(result[1]))
+    return results
+
+def media_group_reply(results):
+    """Albümdeki her fotoğrafın sonucunu tek mesajda listele, düşük
+    güvenilirlikte uyarıyı da ekle"""
+    lines = []
+    for n, result in enumerate(results, 1):
+        if isinstance(result, BaseException):
+            lines.append(f"{n}. ❌ Satranç tahtası analiz edilemedi")
+            continue
+        fen, confidence = result
+        confidence_percentage = confidence * 100
+        lines.append(
+            f"{n}. {confidence_emoji(confidence_percentage)} %{confidence_percentage:.1f}\n"
+            f"`{fen}`\n"
+            f"https://lichess.org/analysis/standard/{fen}"
+        )
+    if any(not isinstance(r, BaseException) and r[1] < 0.85 for r in results):
+        lines.append(LOW_CONFIDENCE_WARNING)
+    return "\n\n".join(lines)
+
+async def handle_media_group(updates):
+    """Albümdeki fotoğrafları birlikte indir, tek seferde tanı ve tek mesajla cevap ver"""
+    updates = sorted(updates, key=lambda u: u.message.message_id)
+    message = updates[0].message
+    photo_sizes = [select_photo_size(u.message.photo) for u in updates]
+    results = await cache_get([file_key(p.file_unique_id) for p in photo_sizes])
+    tracing.annotate(photos=len(updates), cached=sum(r is not None for r in results))
+
+    processing_msg = None
+    try:
+        todo = [i for i, result in enumerate(results) if result is None]
+        if todo:
+            processing_msg = await message.reply_text(
+                f"{len(updates)} fotoğraf işleniyor..."
+            )
+
+            # Fotoğrafları aynı anda indir
+            with metrics.timed('download'), tracing.span('download', photos=len(todo)):
+                downloads = await asyncio.gather(
+                    *[download_photo(photo_sizes[i]) for i in todo],
+                    return_exceptions=True,
+                )
+
+            # Aynı görüntüler daha önce farklı dosyalar olarak tanındı mı?
+            loop = asyncio.get_running_loop()
+            pixel_keys = await asyncio.gather(*[
+                loop.run_in_executor(None, pixels_key, image_bytes)
+                for image_bytes in downloads if not isinstance(image_bytes, BaseException)
+            ], return_exceptions=True)
+            pixel_keys = iter(pixel_keys)
+            keys = {}
+            for i, image_bytes in zip(todo, downloads):
+                if isinstance(image_bytes, BaseException):
+                    metrics.errors_total.inc(stage='download')
+                    results[i] = image_bytes
+                    continue
+                key = next(pixel_keys)
+                if isinstance(key, BaseException):
+                    # Görüntü açılamadı
+                    metrics.errors_total.inc(stage='decode')
+                    results[i] = key
+                    continue
+                keys[i] = key
+            for i, result in zip(keys, await cache_get(list(keys.values()))):
+                results[i] = result
+            to_recognize = [
+                (i, image_bytes) for i, image_bytes in zip(todo, downloads)
+                if i in keys and results[i] is None
+            ]
+
+            # Kalan tüm tahtalar tek bir toplu tanımada
+            to_cache = []
+            if to_recognize:
+                recognized = await recognize_photos([b for _, b in to_recognize])
+                for (i, _), result in zip(to_recognize, recognized):
+                    results[i] = result
+                    if not isinstance(result, BaseException):
+                        to_cache.append((keys[i],) + tuple(result))
+                    else:
+                        metrics.errors_total.inc(stage='recognize')
+            for i in todo:
+                if not isinstance(results[i], BaseException):
+                    to_cache.append((file_key(photo_sizes[i].file_unique_id),) + tuple(results[i]))
+            await cache_put(to_cache)
+
+        with metrics.timed('reply'), tracing.span('reply'):
+            await message.reply_text(media_group_reply(results), parse_mode='Markdown')
+
+    except Exception as e:
+        await message.reply_text(f"Bir hata oluştu: {str(e)}")
+
+    finally:
+        # İşlem mesajını temizle
+        if processing_msg:
+            try:
+                await processing_msg.delete()
+            except:
+                pass
+
+async def process_media_group_later(key):
+    """Albümün kalan fotoğraflarını bekle, sonra hepsini birlikte işle"""
+    await asyncio.sleep(MEDIA_GROUP_WINDOW_MS / 1000)
+    updates = media_groups.pop(key)
+    metrics.in_flight.inc(len(updates))
+    try:
+        with tracing.trace('handle_media_group'):
+            await handle_media_group(updates)
+    finally:
+        metrics.in_flight.dec(len(updates))
+
+def collect_media_group(update: Update):
+    """Albüm fotoğrafını grubuna ekle, grubun ilk fotoğrafıysa işlemeyi planla"""
+    key = (update.message.chat_id, update.message.media_group_id)
+    if key not in media_groups:
+        media_groups[key] = []
+        task = asyncio.get_running_loop().create_task(process_media_group_later(key))
+        media_group_tasks.add(task)
+        task.add_done_callback(media_group_tasks.discard)
+    media_groups[key].append(update)
+
 async def handle_photo(update: Update, context: ContextTypes.DEFAULT_TYPE):
     """Fotoğraf geldiğinde çalışacak fonksiyon"""
-    temp_file = None
+    metrics.requests_total.inc()
+    # Albümün fotoğrafları ayrı ayrı gelir, birlikte cevaplanmak üzere toplanır
+    if update.message.media_group_id is not None:
+        collect_media_group(update)
+        return
+    metrics.in_flight.inc()
+    try:
+        with tracing.trace('handle_photo'):
+            await _handle_photo(update)
+    finally:
+        metrics.in_flight.dec()
+
+async def _handle_photo(update: Update):
+    # Fotoğrafı al (yeterli çözünürlükteki en küçük versiyonu)
+    photo_size = select_photo_size(update.message.photo)
+
+    # Aynı dosya daha önce tanındıysa indirmeden cevap ver
+    cached, = await cache_get([file_key(photo_size.file_unique_id)])
+    tracing.annotate(
+        width=photo_size.width, height=photo_size.height,
+        cache='file' if cached is not None else 'miss',
+    )
+    if cached is not None:
+        with metrics.timed('reply'), tracing.span('reply'):
+            await reply_with_result(update, *cached)
+        return
+
     processing_msg = None
     try:
-        # Model'i yükle
-        load_model_if_needed()
-        
         # Kullanıcıya işlemin başladığını bildir
         processing_msg = await update.message.reply_text("Fotoğraf işleniyor...")
 
-        # Fotoğrafı al (en büyük boyuttaki versiyonu)
-        photo = await update.message.photo[-1].get_file()
-        
-        # Benzersiz bir geçici dosya adı oluştur
-        temp_file = tempfile.NamedTemporaryFile(delete=False, suffix=f'_{int(time.time())}.png').name
-        
-        # Fotoğrafı geçici dosyaya kaydet
-        await photo.download_to_drive(temp_file)
+        with metrics.timed('download'), tracing.span('download'):
+            image_bytes = await download_photo(photo_size)
         
         try:
-            # Satranç tahtasını analiz et
-            fen, confidence = predict_chessboard(temp_file, type('Args', (), {'quiet': True, 'debug': False})())
-            
-            # Güvenilirlik yüzdesini hesapla
-            confidence_percentage = confidence * 100
-            
-            # Güvenilirlik emojisi seç
-            if confidence_percentage >= 95:
-                emoji = "🟢"  # Yüksek güvenilirlik
-            elif confidence_percentage >= 85:
-                emoji = "🟡"  # Orta güvenilirlik
+            # Aynı görüntü farklı bir dosya olarak daha önce tanındı mı?
+            loop = asyncio.get_running_loop()
+            try:
+                key = await loop.run_in_executor(None, pixels_key, image_bytes)
+            except Exception:
+                # Görüntü açılamadı
+                metrics.errors_total.inc(stage='decode')
+                raise
+            result, = await cache_get([key])
+            to_cache = []
+            if result is not None:
+                tracing.annotate(cache='pixels')
             else:
-                emoji = "🔴"  # Düşük güvenilirlik
-            
-            # FEN notasyonunu ve güvenilirliği gönder
-            await update.message.reply_text(
-                f"FEN Notasyonu:\n`{fen}`\n\n"
-                f"Tahmin güvenilirliği: {emoji} %{confidence_percentage:.1f}",
-                parse_mode='Markdown'
-            )
-            
-            # Lichess analiz linki
-            lichess_url = f"https://lichess.org/analysis/standard/{fen}"
-            await update.message.reply_text(f"Lichess'te analiz et:\n{lichess_url}")
-            
-            # Düşük güvenilirlik uyarısı
-            if confidence_percentage < 85:
-                await update.message.reply_text(
-                    "⚠️ Uyarı: Tahmin güvenilirliği düşük. Lütfen FEN notasyonunu kontrol edin. "
-                    "Daha iyi sonuç için:\n"
-                    "1. Tahtanın tamamı fotoğraf karesinde olmalı\n"
-                    "2. Fotoğraf net ve iyi aydınlatılmış olmalı\n"
-                    "3. Taşlar net görünmeli"
-                )
+                result = await recognize_photo(image_bytes)
+                to_cache.append((key,) + tuple(result))
+            to_cache.append((file_key(photo_size.file_unique_id),) + tuple(result))
+            await cache_put(to_cache)
+
+            with metrics.timed('reply'), tracing.span('reply'):
+                await reply_with_result(update, *result)
             
         except Exception as e:
             await update.message.reply_text(f"Satranç tahtası analiz edilirken bir hata oluştu: {str(e)}")
@@ -147,13 +489,6 @@ async def handle_photo(update: Update, context: ContextTypes.DEFAULT_TYPE):
         await update.message.reply_text(f"Bir hata oluştu: {str(e)}")
     
     finally:
-        # Geçici dosyayı temizle
-        if temp_file and os.path.exists(temp_file):
-            try:
-                os.unlink(temp_file)
-            except:
-                pass
-        
         # İşlem mesajını temizle
         if processing_msg:
             try:
@@ -163,6 +498,7 @@ async def handle_photo(update: Update, context: ContextTypes.DEFAULT_TYPE):
 
 def keep_alive():
     """Servisi canlı tutmak için periyodik olarak ping at"""
+    import requests
     while True:
         try:
             if SERVICE_URL:
@@ -173,14 +509,56 @@ def keep_alive():
             print(f"Self-ping error: {str(e)}")
             time.sleep(60)  # Hata durumunda 1 dakika bekle
 
+def setup():
+    """Loglama, önbellek ve tanıma servisini kur (bir kez)"""
+    global recognition_cache, inference_service, worker_pool
+    if not TOKEN:
+        raise ValueError("TELEGRAM_BOT_TOKEN environment variable is not set!")
+
+    # Event loop düzeltmesi
+    import nest_asyncio
+    nest_asyncio.apply()
+
+    # Loglama ayarları
+    logging.basicConfig(
+        format='%(asctime)s - %(name)s - %(levelname)s - %(message)s',
+        level=logging.INFO
+    )
+
+    tracing.set_sample_rate(TRACE_SAMPLE_RATE)
+    if PREDICTION_LOG:
+        prediction_log.enable(PREDICTION_LOG)
+
+    if recognition_cache is None:
+        recognition_cache = RecognitionCache(
+            max_entries=RECOGNITION_CACHE_SIZE,
+            ttl=RECOGNITION_CACHE_TTL,
+            db_path=RECOGNITION_CACHE_DB,
+            # Model, backend veya ayarlar değişince eski sonuçlar kullanılmaz
+            model_version=recognize.model_fingerprint(),
+        )
+
+    # Model'i başlangıçta yükle ve ilk tahmini yap (warm-up)
+    if RECOGNITION_WORKERS > 0:
+        if worker_pool is None:
+            print(f"{RECOGNITION_WORKERS} tanıma süreci başlatılıyor...")
+            worker_pool = RecognitionWorkerPool(RECOGNITION_WORKERS)
+    elif inference_service is None:
+        inference_service = InferenceService(batch_window=INFERENCE_BATCH_WINDOW_MS / 1000)
+        timings = warm_up()
+        print(
+            f"Model yüklendi: {timings['load_s']:.2f} sn, "
+            f"ilk tahmin: {timings['first_prediction_s']:.3f} sn"
+        )
+
 def run_bot():
     """Bot'u başlat"""
+    from telegram import Update
+    from telegram.ext import Application, CommandHandler, MessageHandler, filters
     try:
-        # Model'i başlangıçta yükle
-        load_model_if_needed()
-        
         # Bot uygulamasını oluştur
-        application = Application.builder().token(TOKEN).build()
+        # Fotoğraflar paralel işlenebilsin diye güncellemeler eşzamanlı alınır
+        application = Application.builder().token(TOKEN).concurrent_updates(True).build()
 
         # Komutları ekle
         application.add_handler(CommandHandler("start", start))
@@ -216,4 +594,5 @@ def run_bot():
 
 if __name__ == '__main__':
     # Bot'u başlat
+    setup()
     run_bot() 
\ No newline at end of file
@@ -0,0 +1,7 @@
+import os
+import sys
+
+# The modules live at the top of the repo and open files relative to it
+REPO_DIR = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+sys.path.insert(0, REPO_DIR)
+os.chdir(REPO_DIR)
@@ -0,0 +1,108 @@
+import numpy as np
+import pytest
+
+from chessboard_finder import _get_all_sequences
+
+def _get_all_sequences_quadratic(seq, min_seq_len=7, err_px=5):
+    """ The sequence search as it was before user-011, kept as the oracle """
+    if len(seq) < min_seq_len:
+        return []
+
+    seqs = []
+    for i in range(len(seq)-1):
+        for j in range(i+1, len(seq)):
+            duplicate = False
+            for prev_seq in seqs:
+                for k in range(len(prev_seq)-1):
+                    if seq[i] == prev_seq[k] and seq[j] == prev_seq[k+1]:
+                        duplicate = True
+            if duplicate:
+                continue
+            d = seq[j] - seq[i]
+
+            if d < err_px:
+                continue
+
+            s = [seq[i], seq[j]]
+            n = s[-1] + d
+            while np.abs((seq-n)).min() < err_px:
+                n = seq[np.abs((seq-n)).argmin()]
+                s.append(n)
+                n = s[-1] + d
+
+            if len(s) >= min_seq_len:
+                s = np.array(s)
+                seqs.append(s)
+    return seqs
+
+def _assert_same(seq, **kwargs):
+    expected = _get_all_sequences_quadratic(seq, **kwargs)
+    actual = _get_all_sequences(seq, **kwargs)
+    assert len(actual) == len(expected)
+    for a, e in zip(actual, expected):
+        assert a.dtype == e.dtype
+        np.testing.assert_array_equal(a, e)
+    return actual
+
+def _noisy_grid(rng, size=640, n_noise=20):
+    """ Increasing peaks of a jittered 9-line grid plus random noise lines,
+        like np.where of the Hough peaks
+    """
+    step = rng.integers(size // 14, size // 9)
+    start = rng.integers(0, size - 8 * step)
+    grid = start + step * np.arange(9) + rng.integers(-2, 3, 9)
+    noise = rng.integers(0, size, n_noise)
+    return np.unique(np.clip(np.concatenate([grid, noise]), 0, size - 1))
+
+@pytest.mark.parametrize('seed', range(200))
+def test_matches_quadratic_on_noisy_grids(seed):
+    rng = np.random.default_rng(seed)
+    seq = _noisy_grid(rng, n_noise=rng.integers(0, 40))
+    _assert_same(seq)
+
+@pytest.mark.parametrize('seed', range(200))
+def test_matches_quadratic_on_random_peaks(seed):
+    rng = np.random.default_rng(1000 + seed)
+    seq = np.unique(rng.integers(0, rng.integers(50, 400), rng.integers(0, 60)))
+    _assert_same(
+        seq, min_seq_len=int(rng.integers(2, 9)), err_px=int(rng.integers(1, 8))
+    )
+
+@pytest.mark.parametrize('seed', range(100))
+def test_matches_quadratic_on_overlapping_grids(seed):
+    # Two interleaved grids with close spacings share pairs of peaks, so
+    # later (i, j) pairs are skipped as already used
+    rng = np.random.default_rng(2000 + seed)
+    step = int(rng.integers(20, 40))
+    a = step * np.arange(10)
+    b = a + int(rng.integers(1, step)) + np.arange(10) * int(rng.integers(-1, 2))
+    seq = np.unique(np.concatenate([a, b, a[::2] + step // 2]))
+    _assert_same(seq, err_px=int(rng.integers(2, 6)))
+
+def test_used_pairs_are_skipped():
+    # Every other step of a found grid is itself a grid, only found once
+    seq = np.arange(0, 200, 10)
+    seqs = _assert_same(seq)
+    assert any(s[0] == 0 and s[1] == 10 for s in seqs)
+    assert not any(s[0] == 10 and s[1] == 20 for s in seqs)
+
+def test_early_break_at_last_possible_step():
+    # The inner loop stops once min_seq_len steps can't fit before the last
+    # peak, check that no sequence is lost as the last peak moves around it
+    seq = np.array([0, 20, 40, 60, 80, 100, 120])
+    assert len(_assert_same(seq)) == 1
+    for last in range(115, 160):
+        _assert_same(np.array([0, 20, 40, 60, 80, 100, last]))
+        _assert_same(np.array([0, 20, 41, 63, 84, 104, last]), err_px=3)
+
+def test_steps_within_err_px_are_ignored():
+    _assert_same(np.arange(0, 40, 3), min_seq_len=3, err_px=5)
+    _assert_same(np.arange(0, 40, 5), min_seq_len=3, err_px=5)
+
+def test_tie_goes_to_smaller_value():
+    # 30 + 10 = 40 is exactly between 38 and 42
+    _assert_same(np.array([20, 30, 38, 42, 50, 60]), min_seq_len=3, err_px=3)
+
+def test_too_few_values():
+    assert _get_all_sequences(np.arange(6) * 10) == []
+    assert _get_all_sequences(np.array([], dtype=np.int64)) == []
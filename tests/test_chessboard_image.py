@@ -0,0 +1,77 @@
+from io import BytesIO
+
+import numpy as np
+import PIL.Image
+import pytest
+
+from chessboard_image import get_chessboard_tiles_array
+
+tf = pytest.importorskip('tensorflow')
+
+# Largest and mean difference allowed from the PNG / tf.image tiles: none
+# for lossless images. JPEGs are decoded at a reduced DCT scale, and straight
+# to the luma channel for grayscale (user-017), which moves pixels of the
+# resampled board by a few levels (up to 6/255, 0.25/255 on average here)
+MAX_DIFF_LOSSLESS = (0., 0.)
+MAX_DIFF_JPEG = (8 / 255, 0.5 / 255)
+
+def _png_tf_image_tiles(chessboard_img_path, use_grayscale=True):
+    """ Tiles as recognize built them before user-002: each tile cut pixel
+        by pixel, saved as a PNG and decoded and resized with tf.image
+    """
+    img_data = PIL.Image.open(chessboard_img_path).convert('RGB')
+    img_data = img_data.resize([256, 256], PIL.Image.BILINEAR)
+    if use_grayscale:
+        img_data = img_data.convert('L', (0.2989, 0.5870, 0.1140, 0))
+    chessboard_256x256_img = np.asarray(img_data, dtype=np.uint8)
+    n_channels = 1 if use_grayscale else 3
+    img_data_list = []
+    for rank in range(8):
+        for file in range(8):
+            tile = np.zeros([32, 32, 3], dtype=np.uint8)
+            for i in range(32):
+                for j in range(32):
+                    if use_grayscale:
+                        tile[i, j] = chessboard_256x256_img[rank*32 + i, file*32 + j]
+                    else:
+                        tile[i, j] = chessboard_256x256_img[rank*32 + i, file*32 + j, :]
+            buf = BytesIO()
+            PIL.Image.fromarray(tile, 'RGB').save(buf, format='PNG')
+            img_data = tf.image.decode_image(buf.getvalue(), channels=n_channels)
+            img_data = tf.image.convert_image_dtype(img_data, tf.float32)
+            img_data = tf.image.resize(img_data, [32, 32])
+            img_data_list.append(img_data)
+    return np.stack([t.numpy() for t in img_data_list])
+
+@pytest.fixture(scope='module')
+def boards(tmp_path_factory):
+    """ Paths of lossless boards (the fixture board and a random near-square
+        image) and of JPEG boards (the fixture board and a large copy that
+        gets decoded at 1/2 scale)
+    """
+    tmp = tmp_path_factory.mktemp('boards')
+    # chess_board.png is a JPEG despite its name
+    PIL.Image.open('chess_board.png').convert('RGB').save(tmp / 'board.png')
+    rng = np.random.default_rng(0)
+    PIL.Image.fromarray(
+        rng.integers(0, 256, (397, 411, 3), dtype=np.uint8)
+    ).save(tmp / 'noise.png')
+    PIL.Image.open('chess_board.png').convert('RGB').resize([1500, 1494]).save(
+        tmp / 'large.jpg', quality=90
+    )
+    return {
+        'png': [str(tmp / 'board.png'), str(tmp / 'noise.png')],
+        'jpeg': ['chess_board.png', str(tmp / 'large.jpg')],
+    }
+
+@pytest.mark.parametrize('use_grayscale', [True, False])
+@pytest.mark.parametrize('kind, max_diff', [('png', MAX_DIFF_LOSSLESS), ('jpeg', MAX_DIFF_JPEG)])
+def test_tiles_match_png_tf_image_path(boards, kind, max_diff, use_grayscale):
+    for path in boards[kind]:
+        expected = _png_tf_image_tiles(path, use_grayscale)
+        actual = get_chessboard_tiles_array(path, use_grayscale=use_grayscale)
+        assert actual.shape == expected.shape == (64, 32, 32, 1 if use_grayscale else 3)
+        assert actual.dtype == np.float32
+        diff = np.abs(actual - expected)
+        assert diff.max() <= max_diff[0], path
+        assert diff.mean() <= max_diff[1], path
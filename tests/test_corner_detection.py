@@ -0,0 +1,27 @@
+import numpy as np
+import pytest
+
+from chessboard_finder import (
+    detect_chessboard_corners, locate_chessboard, synthetic_board, synthetic_screenshot,
+)
+
+@pytest.mark.parametrize('seed', range(50))
+def test_detect_chessboard_corners_on_synthetic_boards(seed):
+    img, expected = synthetic_board(np.random.default_rng(seed))
+    # noise_threshold is tuned on real screenshots, this checks the geometry
+    corners = detect_chessboard_corners(img, noise_threshold=0)
+    assert corners is not None
+    assert list(corners) == expected
+
+@pytest.mark.parametrize('seed', range(50))
+def test_locate_chessboard_on_synthetic_screenshots(seed):
+    img, expected = synthetic_screenshot(np.random.default_rng(100 + seed))
+    corners, _ = locate_chessboard(img)
+    assert corners is not None
+    assert list(corners) == expected
+
+@pytest.mark.parametrize('value', [0, 128, 255])
+def test_flat_image_has_no_board(value):
+    img = np.full((480, 640), value, dtype=np.uint8)
+    assert detect_chessboard_corners(img, noise_threshold=0) is None
+    assert locate_chessboard(img)[0] is None
@@ -0,0 +1,154 @@
+#!/usr/bin/env python3
+
+# Exports the tile classifier to quantized TFLite models and runs them with
+# the TFLite interpreter, which needs far less memory than the SavedModel
+
+import os
+import time
+import argparse
+from glob import glob
+
+import numpy as np
+
+from constants import TILES_DIR, NN_MODEL_PATH, NN_TFLITE_MODEL_PATHS
+
+# Number of tiles used to calibrate int8 activation ranges
+N_CALIBRATION_TILES = 500
+
+def _interpreter_class():
+    """ Prefer the standalone tflite-runtime package, which doesn't pull in
+        TensorFlow. Fall back to the interpreter bundled with TensorFlow
+    """
+    try:
+        from tflite_runtime.interpreter import Interpreter
+    except ImportError:
+        import tensorflow as tf
+        Interpreter = tf.lite.Interpreter
+    return Interpreter
+
+class TFLiteModel:
+    """ Runs a TFLite tile classifier on batches of tiles.
+        Called like a Keras model: model(batch) -> (N, 13) probabilities
+    """
+    def __init__(self, model_path):
+        self.model_path = model_path
+        self.interpreter = _interpreter_class()(model_path=model_path)
+        self._input = self.interpreter.get_input_details()[0]
+        self._output = self.interpreter.get_output_details()[0]
+        self._batch_size = None
+
+    def __call__(self, batch, training=False):
+        batch = np.asarray(batch, dtype=np.float32)
+        if batch.shape[0] != self._batch_size:
+            self.interpreter.resize_tensor_input(self._input['index'], batch.shape)
+            self.interpreter.allocate_tensors()
+            self._batch_size = batch.shape[0]
+        self.interpreter.set_tensor(self._input['index'], batch)
+        self.interpreter.invoke()
+        return self.interpreter.get_tensor(self._output['index'])
+
+def _calibration_tile_paths():
+    """ Random sample of tiles from TILES_DIR for int8 calibration """
+    all_paths = np.array(glob('{}/*/*/*.png'.format(TILES_DIR)))
+    np.random.seed(1)
+    np.random.shuffle(all_paths)
+    return all_paths[:N_CALIBRATION_TILES]
+
+def convert_model(model, quantization):
+    """ Converts a Keras tile classifier to a TFLite flatbuffer.
+        quantization = 'float16' or 'int8'
+    """
+    import tensorflow as tf
+    from train import image_data
+
+    converter = tf.lite.TFLiteConverter.from_keras_model(model)
+    converter.optimizations = [tf.lite.Optimize.DEFAULT]
+    if quantization == 'float16':
+        converter.target_spec.supported_types = [tf.float16]
+    elif quantization == 'int8':
+        tile_paths = _calibration_tile_paths()
+        if not len(tile_paths):
+            raise ValueError("No tiles found in {} to calibrate int8 model".format(TILES_DIR))
+
+        def representative_dataset():
+            for tile_path in tile_paths:
+                yield [np.array([image_data(tile_path)], dtype=np.float32)]
+
+        converter.representative_dataset = representative_dataset
+        # Integer kernels inside, float32 input and output so callers
+        # don't need to know the model is quantized
+        converter.target_spec.supported_ops = [tf.lite.OpsSet.TFLITE_BUILTINS_INT8]
+    else:
+        raise ValueError("Unknown quantization: {}".format(quantization))
+    return converter.convert()
+
+def export_models(quantizations):
+    from tensorflow.keras import models
+    model = models.load_model(NN_MODEL_PATH)
+    for quantization in quantizations:
+        model_path = NN_TFLITE_MODEL_PATHS[quantization]
+        print('Converting {} to {} TFLite model'.format(NN_MODEL_PATH, quantization))
+        with open(model_path, 'wb') as f:
+            f.write(convert_model(model, quantization))
+        print('Saved {} ({:.1f} KB)'.format(model_path, os.path.getsize(model_path) / 1024))
+
+def _time_per_board(model, test_images, n_repeats=20):
+    """ Median seconds to classify one 64-tile chessboard """
+    board = test_images[:64]
+    model(board)  # warm up
+    times = []
+    for _ in range(n_repeats):
+        t = time.perf_counter()
+        model(board)
+        times.append(time.perf_counter() - t)
+    return np.median(times)
+
+def compare_models(quantizations):
+    """ Prints accuracy and latency of the SavedModel and the TFLite models
+        on the test split of TILES_DIR
+    """
+    from tensorflow.keras import models
+    from train import get_dataset
+
+    _, (test_images, test_labels) = get_dataset()
+    if not len(test_images):
+        print("No test images found!")
+        return
+    candidates = [('savedmodel', models.load_model(NN_MODEL_PATH))]
+    for quantization in quantizations:
+        model_path = NN_TFLITE_MODEL_PATHS[quantization]
+        if not os.path.exists(model_path):
+            print('Skipping {}, {} not found'.format(quantization, model_path))
+            continue
+        candidates.append(('tflite-{}'.format(quantization), TFLiteModel(model_path)))
+
+    reference = None
+    print('{:<16} {:>10} {:>12} {:>14}'.format(
+        'backend', 'accuracy', 'agreement', 'ms per board'
+    ))
+    for name, model in candidates:
+        predicted = np.concatenate([
+            np.argmax(model(test_images[i:i+64]), axis=1)
+            for i in range(0, len(test_images), 64)
+        ])
+        if reference is None:
+            reference = predicted
+        print('{:<16} {:>10.4f} {:>12.4f} {:>14.2f}'.format(
+            name,
+            np.mean(predicted == test_labels),
+            np.mean(predicted == reference),
+            _time_per_board(model, test_images) * 1000,
+        ))
+
+if __name__ == '__main__':
+    parser = argparse.ArgumentParser()
+    parser.add_argument("--quantization", choices=sorted(NN_TFLITE_MODEL_PATHS),
+                        action="append",
+                        help="Only export/compare this quantization (repeatable)")
+    parser.add_argument("--compare-only", action="store_true",
+                        help="Compare existing TFLite models without exporting")
+    args = parser.parse_args()
+    quantizations = args.quantization or sorted(NN_TFLITE_MODEL_PATHS)
+    if not args.compare_only:
+        export_models(quantizations)
+    compare_models(quantizations)
@@ -0,0 +1,77 @@
+#!/usr/bin/env python3
+
+# Content hashes of tiles, so identical tiles (the empty squares of each
+# colour, repeated piece sprites) are classified once per batch, and an
+# optional LRU of the probabilities of tiles seen in earlier requests
+
+import hashlib
+import threading
+from collections import OrderedDict
+
+import numpy as np
+
+# Number of tiles whose probabilities are kept, see constants.TILE_CACHE_SIZE
+MAX_ENTRIES = 4096
+
+def tile_keys(tiles):
+    """ Given an (N, 32, 32, C) array of tiles, returns a list of N digests
+        of their pixels, equal for tiles with exactly the same pixels
+    """
+    tiles = np.ascontiguousarray(tiles)
+    return [hashlib.blake2b(tile, digest_size=16).digest() for tile in tiles]
+
+def unique_indices(keys):
+    """ Given a list of N tile keys, returns (indices of the first tile with
+        each distinct key, array of N positions of each tile's key in those)
+    """
+    positions = {}
+    first = []
+    inverse = np.empty(len(keys), dtype=np.intp)
+    for i, key in enumerate(keys):
+        position = positions.setdefault(key, len(first))
+        if position == len(first):
+            first.append(i)
+        inverse[i] = position
+    return first, inverse
+
+class TileCache:
+    """ LRU of up to max_entries tile key -> 13 class probabilities """
+    def __init__(self, max_entries=MAX_ENTRIES):
+        self.max_entries = max_entries
+        self._entries = OrderedDict()
+        self._lock = threading.Lock()
+        self.hits = 0
+        self.misses = 0
+
+    def get_many(self, keys):
+        """ Returns a list with the probabilities of each key, or None """
+        found = []
+        with self._lock:
+            for key in keys:
+                probabilities = self._entries.get(key)
+                if probabilities is None:
+                    self.misses += 1
+                else:
+                    self.hits += 1
+                    self._entries.move_to_end(key)
+                found.append(probabilities)
+        return found
+
+    def put_many(self, keys, probabilities):
+        with self._lock:
+            for key, p in zip(keys, probabilities):
+                self._entries[key] = p
+                self._entries.move_to_end(key)
+            while len(self._entries) > self.max_entries:
+                self._entries.popitem(last=False)
+
+    def stats(self):
+        """ Returns a dict of cache counters """
+        with self._lock:
+            lookups = self.hits + self.misses
+            return {
+                'entries': len(self._entries),
+                'hits': self.hits,
+                'misses': self.misses,
+                'hit_rate': self.hits / lookups if lookups else 0.,
+            }
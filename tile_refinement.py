@@ -0,0 +1,172 @@
+#!/usr/bin/env python3
+
+# Test-time augmentation for the tiles the network is unsure about: they are
+# classified again with more contrast, all in one model call, and the
+# probabilities are averaged. Confident tiles cost nothing extra
+#
+# usage: tile_refinement.py [--min-confidence P] [--backend BACKEND]
+#                           [--shifts DY,DX ...] [--zooms F ...] [--contrasts F ...]
+#                           [images ...]
+
+import os
+import argparse
+from glob import glob
+
+import numpy as np
+
+from constants import CHESSBOARDS_DIR, FEN_CHARS
+
+# Tiles whose most likely class is less probable than this are refined
+MIN_TILE_CONFIDENCE = 0.9
+
+# (dy, dx) px shifts, zoom factors and contrast factors of the augmentations.
+# Unsure tiles are mostly blurred or washed out, which more contrast undoes.
+# Shifting or resampling them blurs them further, and on the held-out boards
+# lowered both the accuracy and the confidence, so the bot only changes the
+# contrast. tile_refinement.py --shifts/--zooms measures them again
+SHIFTS = []
+ZOOMS = []
+CONTRASTS = [1.15, 1.3, 1.5]
+
+def _shift(tiles, dy, dx):
+    """ Moves the content of (N, H, W, C) tiles by (dy, dx) px, repeating
+        the edge pixels
+    """
+    padded = np.pad(tiles, ((0, 0), (1, 1), (1, 1), (0, 0)), mode='edge')
+    h, w = tiles.shape[1:3]
+    return padded[:, 1 - dy:1 - dy + h, 1 - dx:1 - dx + w]
+
+def _zoom(tiles, factor):
+    """ Bilinear zoom of (N, H, W, C) tiles about their centre, keeping the
+        size. factor > 1 zooms in
+    """
+    def sample_points(size):
+        centre = (size - 1) / 2
+        coords = np.clip((np.arange(size) - centre) / factor + centre, 0, size - 1)
+        low = np.floor(coords).astype(np.intp)
+        high = np.minimum(low + 1, size - 1)
+        return low, high, (coords - low).astype(np.float32)
+
+    y0, y1, wy = sample_points(tiles.shape[1])
+    x0, x1, wx = sample_points(tiles.shape[2])
+    wy = wy[:, np.newaxis, np.newaxis]
+    rows = tiles[:, y0] * (1 - wy) + tiles[:, y1] * wy
+    wx = wx[:, np.newaxis]
+    return rows[:, :, x0] * (1 - wx) + rows[:, :, x1] * wx
+
+def _contrast(tiles, factor):
+    mean = tiles.mean(axis=(1, 2, 3), keepdims=True)
+    return np.clip((tiles - mean) * factor + mean, 0, 1)
+
+def augment(tiles, shifts=SHIFTS, zooms=ZOOMS, contrasts=CONTRASTS):
+    """ Given (N, 32, 32, C) tiles, returns an (A, N, 32, 32, C) float32
+        array of their A augmented versions
+    """
+    variants = [_shift(tiles, dy, dx) for dy, dx in shifts]
+    variants += [_zoom(tiles, factor) for factor in zooms]
+    variants += [_contrast(tiles, factor) for factor in contrasts]
+    return np.stack(variants).astype(np.float32)
+
+def refine(tiles, probabilities, classify, min_confidence=MIN_TILE_CONFIDENCE,
+           augmentations=None):
+    """ Given (N, 32, 32, C) tiles and their (N, 13) probabilities, replaces
+        the probabilities of tiles less confident than min_confidence with
+        the average over the tile and its augmented versions, classified
+        with a single classify(tiles) call. augmentations are keyword
+        arguments of augment, the defaults when None.
+
+        Returns (refined probabilities, indices of the refined tiles)
+    """
+    uncertain = np.flatnonzero(probabilities.max(axis=1) < min_confidence)
+    if not len(uncertain):
+        return probabilities, uncertain
+    variants = augment(np.asarray(tiles)[uncertain], **(augmentations or {}))
+    n_variants = variants.shape[0]
+    variant_probabilities = classify(variants.reshape(-1, *variants.shape[2:]))
+    variant_probabilities = variant_probabilities.reshape(n_variants, len(uncertain), -1)
+    probabilities = np.array(probabilities)
+    probabilities[uncertain] = (
+        probabilities[uncertain] + variant_probabilities.sum(axis=0)
+    ) / (n_variants + 1)
+    return probabilities, uncertain
+
+def _fen_chars_from_filename(path):
+    """ FEN chars of the 64 squares of a generate_chessboards.py image,
+        a8 ... h1, or None if the filename doesn't end with them
+    """
+    # 8 ranks of 8 squares separated by '-'
+    name = os.path.splitext(os.path.basename(path))[0][-71:].replace('-', '')
+    if len(name) != 64 or any(c not in FEN_CHARS for c in name):
+        return None
+    return name
+
+def report(image_paths, classify, min_confidence=MIN_TILE_CONFIDENCE, augmentations=None):
+    """ Prints how many tiles of each board get refined, the board
+        confidence before and after, and how many squares are right when the
+        filename gives the position. Returns (fraction of boards refined,
+        average confidence gain of the refined boards)
+    """
+    from recognize import _chessboard_tiles_img_data
+    print('{:<24} {:>8} {:>11} {:>11} {:>14}'.format(
+        'board', 'refined', 'confidence', 'refined to', 'right squares'
+    ))
+    gains = []
+    for path in image_paths:
+        tiles = _chessboard_tiles_img_data(path)
+        before = classify(tiles)
+        after, refined = refine(tiles, before, classify, min_confidence, augmentations)
+        confidence_before = np.prod(before.max(axis=1))
+        confidence_after = np.prod(after.max(axis=1))
+        labels = _fen_chars_from_filename(path)
+        right = '-'
+        if labels is not None:
+            right = '{} -> {}'.format(*[
+                sum(FEN_CHARS[i] == c for i, c in zip(p.argmax(axis=1), labels))
+                for p in (before, after)
+            ])
+        if len(refined):
+            gains.append(confidence_after - confidence_before)
+        print('{:<24} {:>8} {:>11.4f} {:>11.4f} {:>14}'.format(
+            os.path.basename(path)[-24:], len(refined),
+            confidence_before, confidence_after, right,
+        ))
+    n_boards = max(len(image_paths), 1)
+    print('Refinement triggered on {} of {} boards, raising their confidence by {:.4f} '
+          'on average'.format(len(gains), len(image_paths), np.mean(gains) if gains else 0.))
+    return len(gains) / n_boards, np.mean(gains) if gains else 0.
+
+def _shift_arg(value):
+    dy, dx = value.split(',')
+    return int(dy), int(dx)
+
+if __name__ == '__main__':
+    parser = argparse.ArgumentParser()
+    parser.add_argument("--min-confidence", type=float, default=MIN_TILE_CONFIDENCE,
+                        help="Refine tiles less confident than this")
+    parser.add_argument("-b", "--backend",
+                        help="Neural network inference backend (default NN_BACKEND)")
+    parser.add_argument("--shifts", type=_shift_arg, nargs='*', default=SHIFTS,
+                        help="Also classify tiles moved by these DY,DX px, e.g. 1,0 0,-1")
+    parser.add_argument("--zooms", type=float, nargs='*', default=ZOOMS,
+                        help="Also classify tiles zoomed by these factors, e.g. 1.1")
+    parser.add_argument("--contrasts", type=float, nargs='*', default=CONTRASTS,
+                        help="Contrast factors to classify tiles with")
+    parser.add_argument("images", nargs='*',
+                        help="Held-out chessboard images (default: all in CHESSBOARDS_DIR)")
+    args = parser.parse_args()
+
+    import recognize
+    if args.backend:
+        recognize.backend = args.backend
+    image_paths = args.images or sorted(
+        glob(os.path.join(CHESSBOARDS_DIR, '**', '*.png'), recursive=True)
+    )
+    if not image_paths:
+        print("No chessboard images found!")
+        exit(1)
+    if not args.shifts + args.zooms + args.contrasts:
+        print("No augmentations given!")
+        exit(1)
+    report(image_paths, recognize.predict_tiles, args.min_confidence, dict(
+        shifts=args.shifts, zooms=args.zooms, contrasts=args.contrasts,
+    ))
@@ -0,0 +1,216 @@
+#!/usr/bin/env python3
+
+# Optional per-request tracing: nested spans with timings and attributes,
+# recorded for a sampled fraction of requests. The slowest recent traces are
+# kept in memory and can be exported as Chrome trace-event JSON, to open in
+# chrome://tracing or https://ui.perfetto.dev
+#
+# Unsampled requests only pay for reading a context variable per span
+
+import json
+import time
+import random
+import itertools
+import threading
+import contextvars
+from collections import deque
+
+# Fraction of requests traced, 0 turns tracing off
+SAMPLE_RATE = 0.
+
+# Number of finished traces kept to pick the slowest from
+RECENT_TRACES = 256
+
+_trace_ids = itertools.count(1)
+_recent = deque(maxlen=RECENT_TRACES)
+_recent_lock = threading.Lock()
+
+# Traces the spans of the running code belong to (more than one when
+# requests are batched together), and the spans open in it
+_active = contextvars.ContextVar('active_traces', default=None)
+_open_spans = contextvars.ContextVar('open_spans', default=())
+
+class Trace:
+    """ Spans recorded for one request """
+    def __init__(self, name):
+        self.id = next(_trace_ids)
+        self.name = name
+        self.time = time.time()
+        self.spans = []
+        self.root = None
+        self._lock = threading.Lock()
+
+    @property
+    def duration(self):
+        return self.root.duration if self.root is not None else 0.
+
+    def add(self, span):
+        with self._lock:
+            self.spans.append(span)
+
+class Span:
+    """ A timed step of one or more traces """
+    def __init__(self, name, traces, attrs):
+        self.name = name
+        self.traces = traces
+        self.attrs = attrs
+        self.start = None
+        self.end = None
+        self.thread_id = None
+        self.depth = 0
+        self._tokens = None
+
+    @property
+    def duration(self):
+        if self.start is None or self.end is None:
+            return 0.
+        return self.end - self.start
+
+    def set(self, **attrs):
+        self.attrs.update(attrs)
+
+    def __enter__(self):
+        self.thread_id = threading.get_ident()
+        open_spans = _open_spans.get()
+        self.depth = len(open_spans)
+        self._tokens = _open_spans.set(open_spans + (self,))
+        self.start = time.perf_counter()
+        return self
+
+    def __exit__(self, exc_type, exc, tb):
+        self.end = time.perf_counter()
+        _open_spans.reset(self._tokens)
+        if exc_type is not None:
+            self.attrs['error'] = repr(exc)
+        for trace in self.traces:
+            trace.add(self)
+        return False
+
+class _NullSpan:
+    """ Stands in for a span when the request isn't traced """
+    def set(self, **attrs):
+        pass
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, exc_type, exc, tb):
+        return False
+
+_NULL_SPAN = _NullSpan()
+
+class _RootSpan(Span):
+    """ Span of a whole request, starts the trace when entered and keeps it
+        once it's finished
+    """
+    def __init__(self, name, attrs):
+        self.trace = Trace(name)
+        super().__init__(name, (self.trace,), attrs)
+        self.trace.root = self
+
+    def __enter__(self):
+        self._active_token = _active.set(self.traces)
+        return super().__enter__()
+
+    def __exit__(self, exc_type, exc, tb):
+        super().__exit__(exc_type, exc, tb)
+        _active.reset(self._active_token)
+        with _recent_lock:
+            _recent.append(self.trace)
+        return False
+
+def set_sample_rate(rate):
+    global SAMPLE_RATE
+    SAMPLE_RATE = rate
+
+def trace(name, **attrs):
+    """ Returns a context manager that traces a request, a sampled fraction
+        of the time. Yields the root span, whose attributes can be set
+    """
+    if SAMPLE_RATE <= 0 or random.random() >= SAMPLE_RATE:
+        return _NULL_SPAN
+    return _RootSpan(name, attrs)
+
+def span(name, **attrs):
+    """ Returns a context manager timing a step of the traced requests the
+        code runs for, if any. Yields the span, whose attributes can be set
+    """
+    traces = _active.get()
+    if not traces:
+        return _NULL_SPAN
+    return Span(name, traces, attrs)
+
+def annotate(**attrs):
+    """ Sets attributes of the innermost open span, if traced """
+    open_spans = _open_spans.get()
+    if open_spans:
+        open_spans[-1].set(**attrs)
+
+def current_traces():
+    """ Returns the traces the running code records spans for, to continue
+        them on another thread with run_traced
+    """
+    return _active.get() or ()
+
+def run_traced(traces, fn, *args):
+    """ Calls fn(*args) recording spans for all of traces, e.g. on an
+        executor thread classifying the images of several requests at once
+    """
+    def run():
+        _active.set(tuple(traces))
+        return fn(*args)
+    return contextvars.Context().run(run)
+
+def slowest(n=10):
+    """ Returns the n slowest of the recent traces, slowest first """
+    with _recent_lock:
+        traces = list(_recent)
+    return sorted(traces, key=lambda t: t.duration, reverse=True)[:n]
+
+def chrome_trace(traces):
+    """ Returns a dict of traces in the Chrome trace-event format, one
+        process per trace and one thread per thread the spans ran on
+    """
+    events = []
+    for trace in traces:
+        events.append({
+            'name': 'process_name', 'ph': 'M', 'pid': trace.id,
+            'args': {'name': '{} #{} ({:.0f} ms)'.format(
+                trace.name, trace.id, trace.duration * 1000
+            )},
+        })
+        with trace._lock:
+            spans = list(trace.spans)
+        for s in spans:
+            events.append({
+                'name': s.name, 'ph': 'X', 'pid': trace.id, 'tid': s.thread_id,
+                'ts': s.start * 1e6, 'dur': s.duration * 1e6,
+                'args': {k: v if isinstance(v, (int, float, str, bool)) else str(v)
+                         for k, v in s.attrs.items()},
+            })
+    return {'traceEvents': events, 'displayTimeUnit': 'ms'}
+
+def save_chrome_trace(path, traces):
+    with open(path, 'w') as f:
+        json.dump(chrome_trace(traces), f)
+
+def summary(traces):
+    """ Returns a line of text per trace: its duration, start time, root
+        attributes and the duration of each span, indented by nesting on the
+        thread it ran on
+    """
+    lines = []
+    for trace in traces:
+        with trace._lock:
+            spans = sorted(trace.spans, key=lambda s: s.start)
+        lines.append('#{} {} {:.0f} ms at {} {}'.format(
+            trace.id, trace.name, trace.duration * 1000,
+            time.strftime('%Y-%m-%d %H:%M:%S', time.localtime(trace.time)),
+            trace.root.attrs if trace.root is not None else {},
+        ))
+        for s in spans:
+            if s is not trace.root:
+                lines.append('{:<32} {:>8.1f} ms {}'.format(
+                    '  ' * (s.depth + 1) + s.name, s.duration * 1000, s.attrs or ''
+                ))
+    return '\n'.join(lines) + '\n'
@@ -0,0 +1,274 @@
+#!/usr/bin/env python3
+
+# Pool of worker processes that each load the neural network once at startup
+# and recognize chessboard images sent to them over a queue
+
+import os
+import time
+import queue
+import threading
+import itertools
+import collections
+import multiprocessing
+from concurrent.futures import Future
+
+# Seconds between checks that every worker process is still alive
+HEALTH_CHECK_INTERVAL = 1.0
+
+# A worker that dies before loading the model is restarted after
+# RESTART_BACKOFF seconds, doubling with each failure up to MAX_RESTART_DELAY,
+# and given up on after MAX_STARTUP_FAILURES failures in a row
+RESTART_BACKOFF = 1.0
+MAX_RESTART_DELAY = 60.0
+MAX_STARTUP_FAILURES = 5
+
+def default_pool_size():
+    return os.cpu_count() or 1
+
+def _worker_main(worker_id, job_queue, result_queue, backend, refine_min_confidence):
+    """ Entry point of a worker process. Loads the model, then handles jobs
+        of (job_id, image bytes) until it receives None
+    """
+    # Imported here so the parent process doesn't need TensorFlow
+    import recognize
+    from recognize import (
+        warm_up, _chessboard_tiles_img_data, classify_tiles,
+        chessboard_from_probabilities,
+    )
+    if backend is not None:
+        recognize.backend = backend
+    if refine_min_confidence is not None:
+        recognize.refine_min_confidence = refine_min_confidence
+    if recognize.backend == 'savedmodel':
+        import tensorflow as tf
+        # Parallelism comes from the number of workers, one thread each avoids
+        # oversubscribing the cores
+        tf.config.threading.set_intra_op_parallelism_threads(1)
+        tf.config.threading.set_inter_op_parallelism_threads(1)
+    warm_up()
+    result_queue.put(('ready', worker_id, None, None))
+    while True:
+        job = job_queue.get()
+        if job is None:
+            break
+        job_id, image_bytes = job
+        try:
+            probabilities = classify_tiles(_chessboard_tiles_img_data(image_bytes))
+            fen, confidence = chessboard_from_probabilities(probabilities)
+            result = (fen, float(confidence), probabilities)
+            result_queue.put(('done', worker_id, job_id, result))
+        except Exception as e:
+            result_queue.put(('error', worker_id, job_id, e))
+
+class RecognitionWorkerPool:
+    """ Recognizes chessboard images on a fixed number of worker processes.
+
+        Jobs are image bytes, results are (FEN string, confidence,
+        64x13 probabilities). Workers that die are restarted and the job
+        they were working on fails with a RuntimeError. Workers that keep
+        dying before they are ready are restarted with a growing delay, and
+        then given up on.
+
+        backend and refine_min_confidence override the recognize defaults
+        in the workers, when given
+    """
+    def __init__(self, size=None, backend=None, refine_min_confidence=None):
+        self.size = size or default_pool_size()
+        self.backend = backend
+        self.refine_min_confidence = refine_min_confidence
+        self._ctx = multiprocessing.get_context('spawn')
+        self._result_queue = self._ctx.Queue()
+        self._job_ids = itertools.count()
+        self._futures = {}
+        self._pending = collections.deque()
+        # Each worker gets its own job queue and at most one job at a time,
+        # so a crashed worker can't take a shared queue lock down with it
+        self._job_queues = [None] * self.size
+        self._workers = [None] * self.size
+        self._in_flight = {}  # worker_id -> job_id
+        self._idle = set()
+        # Per worker: whether it loaded the model since it was last started,
+        # how many times in a row it died before that, and when it's due to
+        # be restarted
+        self._ready = [False] * self.size
+        self._startup_failures = [0] * self.size
+        self._restart_at = [None] * self.size
+        self._failed = set()
+        self._lock = threading.Lock()
+        self._closed = False
+        self.num_restarts = 0
+        for worker_id in range(self.size):
+            self._start_worker(worker_id)
+        self._collector = threading.Thread(target=self._collect_results, daemon=True)
+        self._collector.start()
+        self._monitor = threading.Thread(target=self._check_health, daemon=True)
+        self._monitor.start()
+
+    def _start_worker(self, worker_id):
+        job_queue = self._ctx.Queue()
+        process = self._ctx.Process(
+            target=_worker_main,
+            args=(worker_id, job_queue, self._result_queue, self.backend,
+                  self.refine_min_confidence),
+            daemon=True,
+        )
+        process.start()
+        self._ready[worker_id] = False
+        self._job_queues[worker_id] = job_queue
+        self._workers[worker_id] = process
+
+    def _dispatch(self):
+        """ Hands pending jobs to idle workers. Must hold self._lock """
+        while self._pending and self._idle:
+            worker_id = self._idle.pop()
+            job_id, image_bytes = self._pending.popleft()
+            self._in_flight[worker_id] = job_id
+            self._job_queues[worker_id].put((job_id, image_bytes))
+
+    def wait_until_ready(self, timeout=None):
+        """ Blocks until every worker that wasn't given up on has loaded the
+            model and is idle. Returns False on timeout or if every worker
+            was given up on
+        """
+        deadline = None if timeout is None else time.monotonic() + timeout
+        while len(self._idle) < self.size - len(self._failed):
+            if deadline is not None and time.monotonic() > deadline:
+                return False
+            time.sleep(0.05)
+        return len(self._failed) < self.size
+
+    def submit(self, image_bytes):
+        """ Queues a chessboard image for recognition.
+            Returns a concurrent.futures.Future of
+            (FEN string, confidence, probabilities)
+        """
+        if self._closed:
+            raise RuntimeError("Worker pool is closed")
+        future = Future()
+        job_id = next(self._job_ids)
+        with self._lock:
+            if len(self._failed) == self.size:
+                raise RuntimeError("No recognition worker could be started")
+            self._futures[job_id] = future
+            self._pending.append((job_id, bytes(image_bytes)))
+            self._dispatch()
+        return future
+
+    def predict(self, image_bytes, timeout=None):
+        """ Returns a tuple of (FEN string, confidence, probabilities) """
+        return self.submit(image_bytes).result(timeout)
+
+    def _collect_results(self):
+        while not self._closed:
+            try:
+                status, worker_id, job_id, payload = self._result_queue.get(timeout=0.5)
+            except queue.Empty:
+                continue
+            except (EOFError, OSError):
+                break
+            future = None
+            with self._lock:
+                if status == 'ready':
+                    self._ready[worker_id] = True
+                    self._startup_failures[worker_id] = 0
+                else:
+                    if self._in_flight.get(worker_id) != job_id:
+                        # Result from a worker that was already given up on
+                        continue
+                    del self._in_flight[worker_id]
+                    future = self._futures.pop(job_id, None)
+                self._idle.add(worker_id)
+                self._dispatch()
+            if future is None:
+                continue
+            if status == 'done':
+                future.set_result(payload)
+            else:
+                future.set_exception(payload)
+
+    def _check_health(self):
+        while not self._closed:
+            time.sleep(HEALTH_CHECK_INTERVAL)
+            for worker_id, process in enumerate(self._workers):
+                if self._closed or worker_id in self._failed or process.is_alive():
+                    continue
+                if self._restart_at[worker_id] is None:
+                    self._worker_died(worker_id, process.exitcode)
+                restart_at = self._restart_at[worker_id]
+                if restart_at is not None and time.monotonic() >= restart_at:
+                    with self._lock:
+                        self._restart_at[worker_id] = None
+                        self.num_restarts += 1
+                        self._start_worker(worker_id)
+
+    def _worker_died(self, worker_id, exitcode):
+        """ Fails the job of a worker that died, and schedules its restart or
+            gives up on it
+        """
+        orphaned = []
+        with self._lock:
+            self._idle.discard(worker_id)
+            job_id = self._in_flight.pop(worker_id, None)
+            future = self._futures.pop(job_id, None)
+            if not self._ready[worker_id]:
+                self._startup_failures[worker_id] += 1
+            failures = self._startup_failures[worker_id]
+            if failures >= MAX_STARTUP_FAILURES:
+                print("Recognition worker {} exited with code {} before it was ready "
+                      "{} times in a row, giving up on it".format(worker_id, exitcode, failures))
+                self._failed.add(worker_id)
+                if len(self._failed) == self.size:
+                    # Nothing is left to run the queued jobs
+                    orphaned = [self._futures.pop(job_id) for job_id, _ in self._pending]
+                    self._pending.clear()
+            else:
+                delay = 0.
+                if failures:
+                    delay = min(RESTART_BACKOFF * 2 ** (failures - 1), MAX_RESTART_DELAY)
+                print("Recognition worker {} exited with code {}, restarting in {:.0f}s".format(
+                    worker_id, exitcode, delay
+                ))
+                self._restart_at[worker_id] = time.monotonic() + delay
+        if future is not None:
+            future.set_exception(RuntimeError(
+                "Recognition worker crashed while processing this image"
+            ))
+        for future in orphaned:
+            future.set_exception(RuntimeError("No recognition worker could be started"))
+
+    def stats(self):
+        """ Returns a dict describing the state of the pool """
+        with self._lock:
+            return {
+                'size': self.size,
+                'alive': sum(p.is_alive() for p in self._workers),
+                'idle': len(self._idle),
+                'pending': len(self._pending),
+                'in_flight': len(self._in_flight),
+                'restarts': self.num_restarts,
+                'failed': len(self._failed),
+            }
+
+    def close(self, timeout=5):
+        """ Stops all workers. Jobs that haven't finished are cancelled """
+        if self._closed:
+            return
+        self._closed = True
+        for job_queue in self._job_queues:
+            job_queue.put(None)
+        for process in self._workers:
+            process.join(timeout)
+            if process.is_alive():
+                process.terminate()
+        with self._lock:
+            futures = list(self._futures.values())
+            self._futures.clear()
+            self._pending.clear()
+        for future in futures:
+            future.cancel()
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, *exc):
+        self.close()